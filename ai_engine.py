@@ -8,30 +8,339 @@ Version: 2.0.0
 """
 
 import os
+import time
+import asyncio
 import logging
 import json
-from typing import List, Dict, Optional, Union
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from typing import List, Dict, Optional, Union, Iterator, AsyncIterator, Callable, Tuple, Iterable
 from datetime import datetime
 
+import arabic_text
+from prompt_builder import PromptBuilder, truncate_to_tokens
+
 # AI Libraries
 try:
     import openai
-    from anthropic import Anthropic
+    from anthropic import Anthropic, AsyncAnthropic
 except ImportError as e:
     logging.warning(f"AI libraries not fully available: {e}")
     openai = None
     Anthropic = None
+    AsyncAnthropic = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+class ResponseCache:
+    """
+    In-process response cache with TTL and LRU eviction
+    
+    Entries can be tagged (with the ids of the passages an answer was
+    grounded on) so that they are dropped when those passages change.
+    """
+    
+    def __init__(self, timeout: int = 300, max_entries: int = 1000):
+        """
+        Initialize the cache
+        
+        Args:
+            timeout: Seconds an entry stays valid
+            max_entries: Entries kept before the least recently used is evicted
+        """
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tags: Dict[str, set] = {}  # tag -> keys
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+    
+    def get(self, key: str) -> Optional[str]:
+        """Get a cached response, or None when missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            
+            if entry:
+                self._remove(key)
+            self.misses += 1
+            return None
+    
+    def set(self, key: str, value: str, tags: Iterable = ()):
+        """Store a response, optionally under tags used by invalidate()"""
+        tags = {str(tag) for tag in tags}
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.timeout, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+    
+    def invalidate(self, tags: Iterable) -> int:
+        """Remove the entries stored under any of the tags; returns how many were removed"""
+        removed = 0
+        with self._lock:
+            for tag in {str(tag) for tag in tags}:
+                for key in self._tags.pop(tag, ()):
+                    if key in self._entries:
+                        self._remove(key)
+                        removed += 1
+            self.invalidated += removed
+        return removed
+    
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+    
+    def _remove(self, key: str):
+        """Drop an entry and its tag references (lock held by caller)"""
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+    
+    def get_stats(self) -> Dict:
+        """Get hit/miss statistics"""
+        total = self.hits + self.misses
+        return {
+            'backend': 'memory',
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidated': self.invalidated,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0
+        }
+
+class RedisResponseCache(ResponseCache):
+    """Response cache shared by all workers through Redis (TTL per key, LRU by Redis eviction policy)"""
+    
+    KEY_PREFIX = 'teacher_ai:response:'
+    TAG_PREFIX = 'teacher_ai:response_tag:'
+    
+    def __init__(self, redis_url: str, timeout: int = 300, max_entries: int = 1000):
+        """Initialize the cache with a Redis connection URL"""
+        super().__init__(timeout=timeout, max_entries=max_entries)
+        self.client = redis.Redis.from_url(redis_url, socket_timeout=1)
+    
+    def get(self, key: str) -> Optional[str]:
+        """Get a cached response, or None when missing, expired or Redis is unreachable"""
+        try:
+            value = self.client.get(self.KEY_PREFIX + key)
+        except Exception as e:
+            logger.warning(f"⚠️ فشل في قراءة ذاكرة التخزين المؤقت: {e}")
+            value = None
+        
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return value.decode('utf-8')
+    
+    def set(self, key: str, value: str, tags: Iterable = ()):
+        """Store a response with the cache TTL; each tag is a Redis set of keys expiring with it"""
+        try:
+            pipeline = self.client.pipeline()
+            pipeline.setex(self.KEY_PREFIX + key, self.timeout, value.encode('utf-8'))
+            for tag in {str(tag) for tag in tags}:
+                pipeline.sadd(self.TAG_PREFIX + tag, key)
+                pipeline.expire(self.TAG_PREFIX + tag, self.timeout)
+            pipeline.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ فشل في الكتابة إلى ذاكرة التخزين المؤقت: {e}")
+    
+    def invalidate(self, tags: Iterable) -> int:
+        """Remove the entries stored under any of the tags (for all workers)"""
+        tag_keys = [self.TAG_PREFIX + str(tag) for tag in set(tags)]
+        if not tag_keys:
+            return 0
+        
+        try:
+            keys = self.client.sunion(tag_keys)
+            pipeline = self.client.pipeline()
+            for key in keys:
+                pipeline.delete(self.KEY_PREFIX + key.decode('utf-8'))
+            pipeline.delete(*tag_keys)
+            removed = sum(pipeline.execute()[:len(keys)])
+        except Exception as e:
+            logger.warning(f"⚠️ فشل في إبطال الإجابات المحفوظة: {e}")
+            return 0
+        
+        with self._lock:
+            self.invalidated += removed
+        return removed
+    
+    def clear(self):
+        """Remove all response entries"""
+        for pattern in (self.KEY_PREFIX + '*', self.TAG_PREFIX + '*'):
+            for key in self.client.scan_iter(pattern):
+                self.client.delete(key)
+    
+    def get_stats(self) -> Dict:
+        """Get hit/miss statistics of this process"""
+        stats = super().get_stats()
+        stats['backend'] = 'redis'
+        stats.pop('entries')
+        return stats
+
+def create_response_cache(cache_type: str = 'simple', redis_url: Optional[str] = None,
+                          timeout: int = 300, max_entries: int = 1000) -> Optional[ResponseCache]:
+    """Build the response cache from settings (Redis when a URL is configured)"""
+    if cache_type == 'null':
+        return None
+    
+    if redis_url and redis:
+        try:
+            cache = RedisResponseCache(redis_url, timeout=timeout, max_entries=max_entries)
+            cache.client.ping()
+            logger.info("✅ تم تفعيل ذاكرة Redis المؤقتة للإجابات")
+            return cache
+        except Exception as e:
+            logger.warning(f"⚠️ Redis غير متاح، استخدام الذاكرة المحلية: {e}")
+    
+    return ResponseCache(timeout=timeout, max_entries=max_entries)
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker over a rolling window of recent calls
+    
+    closed: calls pass; the circuit opens when the error rate of the window
+    reaches error_threshold (after at least min_calls calls).
+    open: calls are skipped until open_seconds have passed.
+    half_open: one probe call is let through; success closes the circuit,
+    failure opens it again.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, name: str, window_size: int = 20, error_threshold: float = 0.5,
+                 min_calls: int = 5, open_seconds: float = 30.0):
+        """
+        Initialize the breaker
+        
+        Args:
+            name: Provider name (for logging)
+            window_size: Number of recent calls kept for the error rate and latencies
+            error_threshold: Error rate that opens the circuit
+            min_calls: Calls needed in the window before the circuit can open
+            open_seconds: Seconds the circuit stays open before a probe
+        """
+        self.name = name
+        self.error_threshold = error_threshold
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        
+        self.state = self.CLOSED
+        self._calls = deque(maxlen=window_size)  # (succeeded, latency seconds)
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.skipped = 0
+    
+    def allow(self) -> bool:
+        """Whether a call may be made now (claims the probe slot when half-open)"""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            
+            self.skipped += 1
+            return False
+    
+    def record_success(self, latency: float):
+        """Record a successful call"""
+        with self._lock:
+            self._calls.append((True, latency))
+            if self.state == self.HALF_OPEN:
+                self.state = self.CLOSED
+                self._calls.clear()
+                self._calls.append((True, latency))
+                logger.info(f"✅ عاد المزود {self.name} للعمل، تم إغلاق الدائرة")
+    
+    def record_failure(self, latency: float):
+        """Record a failed call and open the circuit when the error rate is too high"""
+        with self._lock:
+            self._calls.append((False, latency))
+            if self.state == self.HALF_OPEN:
+                self._open()
+            elif self.state == self.CLOSED and len(self._calls) >= self.min_calls \
+                    and self._error_rate() >= self.error_threshold:
+                self._open()
+    
+    def release(self):
+        """Give back a probe slot claimed by allow() without recording a result"""
+        with self._lock:
+            self._probe_in_flight = False
+    
+    def get_stats(self) -> Dict:
+        """Get state, error rate and latency percentiles"""
+        with self._lock:
+            latencies = sorted(latency for _, latency in self._calls)
+            return {
+                'state': self.state,
+                'calls': len(self._calls),
+                'error_rate': round(self._error_rate(), 3),
+                'latency_p50': self._percentile(latencies, 0.50),
+                'latency_p95': self._percentile(latencies, 0.95),
+                'latency_p99': self._percentile(latencies, 0.99),
+                'skipped': self.skipped
+            }
+    
+    def _open(self):
+        """Open the circuit (lock held by caller)"""
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        logger.warning(f"🔌 تم فتح دائرة المزود {self.name} لمدة {self.open_seconds} ث")
+    
+    def _error_rate(self) -> float:
+        """Share of failed calls in the window (lock held by caller)"""
+        if not self._calls:
+            return 0.0
+        return sum(1 for succeeded, _ in self._calls if not succeeded) / len(self._calls)
+    
+    @staticmethod
+    def _percentile(values: List[float], fraction: float) -> Optional[float]:
+        """Nearest-rank percentile of sorted values, in seconds"""
+        if not values:
+            return None
+        return round(values[min(len(values) - 1, int(fraction * len(values)))], 3)
+
 class TeacherAIEngine:
     """Enhanced AI Engine for Teacher AI with Arabic language support"""
     
-    def __init__(self):
+    def __init__(self, response_cache: Optional[ResponseCache] = None):
         """Initialize the AI engine with enhanced Arabic capabilities"""
         self.openai_client = None
         self.anthropic_client = None
+        self.response_cache = response_cache
         
         # Initialize OpenAI
         if openai and os.getenv('OPENAI_API_KEY'):
@@ -55,7 +364,33 @@ class TeacherAIEngine:
             'max_tokens': 4000,
             'temperature': 0.7,
             'arabic_enhanced': True,
-            'prefer_arabic': True
+            'prefer_arabic': True,
+            'provider_timeout': float(os.getenv('AI_PROVIDER_TIMEOUT', 30)),  # seconds per provider call
+            'hedge_delay': float(os.getenv('AI_HEDGE_DELAY', 0)),  # seconds before hedging to the next provider, 0 disables
+            'breaker_window': int(os.getenv('AI_BREAKER_WINDOW', 20)),
+            'breaker_error_threshold': float(os.getenv('AI_BREAKER_ERROR_THRESHOLD', 0.5)),
+            'breaker_open_seconds': float(os.getenv('AI_BREAKER_OPEN_SECONDS', 30)),
+            'max_input_tokens': int(os.getenv('AI_MAX_INPUT_TOKENS', 12000)),
+            'max_history_tokens': int(os.getenv('AI_MAX_HISTORY_TOKENS', 1500))
+        }
+        
+        self.prompt_builder = PromptBuilder(
+            max_input_tokens=self.config['max_input_tokens'],
+            max_history_tokens=self.config['max_history_tokens']
+        )
+        self._prompt_token_totals = dict.fromkeys(PromptBuilder.SECTIONS + ('total',), 0)
+        self._prompt_count = 0
+        self._prompt_stats_lock = threading.Lock()
+        
+        # One circuit breaker per provider, so an outage skips that provider immediately
+        self.circuit_breakers = {
+            name: CircuitBreaker(
+                name,
+                window_size=self.config['breaker_window'],
+                error_threshold=self.config['breaker_error_threshold'],
+                open_seconds=self.config['breaker_open_seconds']
+            )
+            for name in ('Anthropic', 'OpenAI')
         }
         
         # Enhanced Arabic system prompt
@@ -97,30 +432,80 @@ class TeacherAIEngine:
         user_message: str,
         context: str = "",
         conversation_history: List[Dict] = None,
+        conversation_summary: str = "",
         prefer_arabic: bool = True,
         enhanced_arabic_mode: bool = True,
-        request_complete_answer: bool = True
+        request_complete_answer: bool = True,
+        context_ids: Optional[List[int]] = None
     ) -> str:
         """
         Generate AI response with enhanced Arabic support
         
+        Args:
+            Same as generate_response_details
+        
+        Returns:
+            Generated response text
+        """
+        return self.generate_response_details(
+            user_message,
+            context=context,
+            conversation_history=conversation_history,
+            conversation_summary=conversation_summary,
+            prefer_arabic=prefer_arabic,
+            enhanced_arabic_mode=enhanced_arabic_mode,
+            request_complete_answer=request_complete_answer,
+            context_ids=context_ids
+        )['text']
+    
+    def generate_response_details(
+        self,
+        user_message: str,
+        context: str = "",
+        conversation_history: List[Dict] = None,
+        conversation_summary: str = "",
+        prefer_arabic: bool = True,
+        enhanced_arabic_mode: bool = True,
+        request_complete_answer: bool = True,
+        context_ids: Optional[List[int]] = None
+    ) -> Dict:
+        """
+        Generate AI response and report which provider answered and its token usage
+        
         Args:
             user_message: User's question or message
             context: Relevant document context
             conversation_history: Previous conversation messages
+            conversation_summary: Rolling summary of turns older than conversation_history
             prefer_arabic: Whether to prefer Arabic language in response
             enhanced_arabic_mode: Enable enhanced Arabic language processing
             request_complete_answer: Request comprehensive answer
+            context_ids: Ids of the retrieved passages, used for response caching
             
         Returns:
-            Generated response text
+            Dict with 'text', 'provider' and 'model' (None for cached and
+            fallback answers), 'usage' token counts and 'response_time'
         """
+        started = time.monotonic()
+        
+        # Answers that depend on earlier turns are not shared between conversations
+        cache_key = None
+        if self.response_cache and not conversation_history and not conversation_summary:
+            cache_key = self._response_cache_key(
+                user_message, context_ids, prefer_arabic, enhanced_arabic_mode, request_complete_answer
+            )
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                logger.info("⚡ تم استخدام إجابة محفوظة مؤقتاً")
+                return self._response_details(cached, started, provider='cache')
+        
         try:
             # Prepare enhanced prompt
             enhanced_prompt = self._prepare_enhanced_prompt(
                 user_message=user_message,
                 context=context,
                 conversation_history=conversation_history or [],
+                conversation_summary=conversation_summary,
                 prefer_arabic=prefer_arabic,
                 enhanced_arabic_mode=enhanced_arabic_mode,
                 request_complete_answer=request_complete_answer
@@ -129,29 +514,446 @@ class TeacherAIEngine:
             # Try Anthropic first (better for Arabic)
             if self.anthropic_client:
                 try:
-                    response = self._generate_anthropic_response(enhanced_prompt)
+                    response = self._call_provider('Anthropic', self._generate_anthropic_response, enhanced_prompt)
                     if response:
                         logger.info("✅ تم توليد الإجابة باستخدام Anthropic")
-                        return self._enhance_arabic_response(response)
+                        text = self._cache_response(
+                            cache_key, self._enhance_arabic_response(response['text']), context_ids
+                        )
+                        return self._response_details(text, started, 'Anthropic', response['usage'])
                 except Exception as e:
                     logger.warning(f"⚠️ فشل Anthropic، محاولة OpenAI: {e}")
             
             # Fallback to OpenAI
             if self.openai_client:
                 try:
-                    response = self._generate_openai_response(enhanced_prompt)
+                    response = self._call_provider('OpenAI', self._generate_openai_response, enhanced_prompt)
                     if response:
                         logger.info("✅ تم توليد الإجابة باستخدام OpenAI")
-                        return self._enhance_arabic_response(response)
+                        text = self._cache_response(
+                            cache_key, self._enhance_arabic_response(response['text']), context_ids
+                        )
+                        return self._response_details(text, started, 'OpenAI', response['usage'])
                 except Exception as e:
                     logger.warning(f"⚠️ فشل OpenAI: {e}")
             
             # Fallback response
-            return self._generate_fallback_response(user_message, context)
+            return self._response_details(self._generate_fallback_response(user_message, context), started)
             
         except Exception as e:
             logger.error(f"❌ خطأ في توليد الإجابة: {e}")
-            return self._generate_fallback_response(user_message, context)
+            return self._response_details(self._generate_fallback_response(user_message, context), started)
+    
+    def _response_details(self, text: str, started: float, provider: Optional[str] = None,
+                          usage: Optional[Dict] = None) -> Dict:
+        """Describe a generated answer for the caller (see generate_response_details)"""
+        return {
+            'text': text,
+            'provider': provider,
+            'model': self._model_for(provider),
+            'usage': usage or {},
+            'response_time': round(time.monotonic() - started, 3)
+        }
+    
+    def _model_for(self, provider: Optional[str]) -> Optional[str]:
+        """Configured model of a provider"""
+        models = {'Anthropic': self.config['anthropic_model'], 'OpenAI': self.config['openai_model']}
+        return models.get(provider)
+    
+    def _call_provider(self, name: str, generate: Callable[[Dict], Optional[Dict]], prompt: Dict) -> Optional[Dict]:
+        """Call a provider through its circuit breaker; None when skipped or failed"""
+        breaker = self.circuit_breakers[name]
+        if not breaker.allow():
+            logger.info(f"🔌 تم تخطي {name}، الدائرة مفتوحة")
+            return None
+        
+        started = time.monotonic()
+        try:
+            response = generate(prompt)
+        except Exception:
+            breaker.record_failure(time.monotonic() - started)
+            raise
+        
+        if response:
+            breaker.record_success(time.monotonic() - started)
+        else:
+            breaker.record_failure(time.monotonic() - started)
+        return response
+    
+    def _response_cache_key(
+        self,
+        user_message: str,
+        context_ids: Optional[List[int]],
+        prefer_arabic: bool,
+        enhanced_arabic_mode: bool,
+        request_complete_answer: bool
+    ) -> str:
+        """Hash of the normalized question, retrieved context ids, models and answer-mode flags"""
+        key_data = {
+            'question': ' '.join(arabic_text.TOKEN_PATTERN.findall(arabic_text.normalize(user_message))),
+            'context_ids': sorted(context_ids or []),
+            'models': [self.config['anthropic_model'], self.config['openai_model']],
+            'prefer_arabic': prefer_arabic,
+            'enhanced_arabic_mode': enhanced_arabic_mode,
+            'request_complete_answer': request_complete_answer
+        }
+        return hashlib.sha256(json.dumps(key_data, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+    
+    def _cache_response(self, cache_key: Optional[str], response: str,
+                        context_ids: Optional[List[int]] = None) -> str:
+        """Store a provider response when caching applies (tagged with its passage ids), and return it"""
+        if cache_key and response:
+            self.response_cache.set(cache_key, response, tags=context_ids or ())
+        return response
+    
+    def generate_response_stream(
+        self,
+        user_message: str,
+        context: str = "",
+        conversation_history: List[Dict] = None,
+        conversation_summary: str = "",
+        prefer_arabic: bool = True,
+        enhanced_arabic_mode: bool = True,
+        request_complete_answer: bool = True,
+        context_ids: Optional[List[int]] = None,
+        details: Optional[Dict] = None
+    ) -> Iterator[str]:
+        """
+        Stream an AI response as text deltas
+        
+        Providers are tried in the same order as generate_response. A provider
+        is only abandoned for the next one if it fails before its first token.
+        A response is cached only once its stream has completed; an
+        interrupted stream raises and leaves the cache untouched.
+        
+        Args:
+            Same as generate_response, plus:
+            details: Dict filled like generate_response_details once the stream completes
+        
+        Yields:
+            Text deltas as they arrive from the provider
+        """
+        started = time.monotonic()
+        details = details if details is not None else {}
+        
+        cache_key = None
+        if self.response_cache and not conversation_history and not conversation_summary:
+            cache_key = self._response_cache_key(
+                user_message, context_ids, prefer_arabic, enhanced_arabic_mode, request_complete_answer
+            )
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                logger.info("⚡ تم استخدام إجابة محفوظة مؤقتاً")
+                yield cached
+                details.update(self._response_details(cached, started, provider='cache'))
+                return
+        
+        enhanced_prompt = self._prepare_enhanced_prompt(
+            user_message=user_message,
+            context=context,
+            conversation_history=conversation_history or [],
+            conversation_summary=conversation_summary,
+            prefer_arabic=prefer_arabic,
+            enhanced_arabic_mode=enhanced_arabic_mode,
+            request_complete_answer=request_complete_answer
+        )
+        
+        providers = []
+        if self.anthropic_client:
+            providers.append(('Anthropic', self._stream_anthropic_response))
+        if self.openai_client:
+            providers.append(('OpenAI', self._stream_openai_response))
+        
+        for name, stream in providers:
+            breaker = self.circuit_breakers[name]
+            if not breaker.allow():
+                logger.info(f"🔌 تم تخطي {name}، الدائرة مفتوحة")
+                continue
+            
+            parts = []
+            start_time = time.monotonic()
+            usage = {}
+            try:
+                for delta in stream(enhanced_prompt, usage):
+                    parts.append(delta)
+                    yield delta
+                if parts:
+                    breaker.record_success(time.monotonic() - start_time)
+                    logger.info(f"✅ تم بث الإجابة باستخدام {name}")
+                    text = self._cache_response(
+                        cache_key, self._enhance_arabic_response("".join(parts)), context_ids
+                    )
+                    details.update(self._response_details(text, start_time, name, usage))
+                    return
+                breaker.record_failure(time.monotonic() - start_time)
+            except GeneratorExit:
+                # The client went away; this says nothing about the provider
+                breaker.release()
+                raise
+            except Exception as e:
+                breaker.record_failure(time.monotonic() - start_time)
+                if parts:
+                    logger.error(f"❌ انقطع بث {name}: {e}")
+                    raise
+                logger.warning(f"⚠️ فشل بث {name}، محاولة المزود التالي: {e}")
+        
+        # Fallback response
+        text = self._generate_fallback_response(user_message, context)
+        yield text
+        details.update(self._response_details(text, started))
+    
+    async def agenerate_response(
+        self,
+        user_message: str,
+        context: str = "",
+        conversation_history: List[Dict] = None,
+        conversation_summary: str = "",
+        prefer_arabic: bool = True,
+        enhanced_arabic_mode: bool = True,
+        request_complete_answer: bool = True,
+        context_ids: Optional[List[int]] = None,
+        hedge: Optional[bool] = None
+    ) -> str:
+        """Generate AI response with the async provider clients (see agenerate_response_details)"""
+        details = await self.agenerate_response_details(
+            user_message,
+            context=context,
+            conversation_history=conversation_history,
+            conversation_summary=conversation_summary,
+            prefer_arabic=prefer_arabic,
+            enhanced_arabic_mode=enhanced_arabic_mode,
+            request_complete_answer=request_complete_answer,
+            context_ids=context_ids,
+            hedge=hedge
+        )
+        return details['text']
+    
+    async def agenerate_response_details(
+        self,
+        user_message: str,
+        context: str = "",
+        conversation_history: List[Dict] = None,
+        conversation_summary: str = "",
+        prefer_arabic: bool = True,
+        enhanced_arabic_mode: bool = True,
+        request_complete_answer: bool = True,
+        context_ids: Optional[List[int]] = None,
+        hedge: Optional[bool] = None
+    ) -> Dict:
+        """
+        Generate AI response with the async provider clients
+        
+        Each provider call runs under its own deadline (provider_timeout). With
+        hedging, the next provider is started when the current one has not
+        produced a first token within hedge_delay seconds; the first provider
+        to produce a token wins and the other call is cancelled. Without
+        hedging, providers are tried in order as soon as one fails or times out.
+        
+        Args:
+            Same as generate_response, plus:
+            hedge: Enable hedging (defaults to hedge_delay > 0)
+        
+        Returns:
+            Same dict as generate_response_details
+        """
+        started = time.monotonic()
+        cache_key = None
+        if self.response_cache and not conversation_history and not conversation_summary:
+            cache_key = self._response_cache_key(
+                user_message, context_ids, prefer_arabic, enhanced_arabic_mode, request_complete_answer
+            )
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                logger.info("⚡ تم استخدام إجابة محفوظة مؤقتاً")
+                return self._response_details(cached, started, provider='cache')
+        
+        enhanced_prompt = self._prepare_enhanced_prompt(
+            user_message=user_message,
+            context=context,
+            conversation_history=conversation_history or [],
+            conversation_summary=conversation_summary,
+            prefer_arabic=prefer_arabic,
+            enhanced_arabic_mode=enhanced_arabic_mode,
+            request_complete_answer=request_complete_answer
+        )
+        
+        if hedge is None:
+            hedge = self.config['hedge_delay'] > 0
+        
+        anthropic_client = None
+        if self.anthropic_client and AsyncAnthropic:
+            anthropic_client = AsyncAnthropic(api_key=os.getenv('ANTHROPIC_API_KEY'))
+        
+        providers = []
+        if anthropic_client:
+            providers.append((
+                'Anthropic',
+                lambda prompt, usage: self._astream_anthropic_response(anthropic_client, prompt, usage)
+            ))
+        if self.openai_client:
+            providers.append(('OpenAI', self._astream_openai_response))
+        
+        try:
+            result = await self._arace_providers(enhanced_prompt, providers, hedge)
+        except Exception as e:
+            logger.error(f"❌ خطأ في توليد الإجابة: {e}")
+            result = None
+        finally:
+            if anthropic_client:
+                await anthropic_client.close()
+        
+        if result:
+            name, response, usage = result
+            logger.info(f"✅ تم توليد الإجابة باستخدام {name}")
+            text = self._cache_response(cache_key, self._enhance_arabic_response(response), context_ids)
+            return self._response_details(text, started, name, usage)
+        
+        return self._response_details(self._generate_fallback_response(user_message, context), started)
+    
+    async def _arace_providers(
+        self,
+        prompt: Dict,
+        providers: List[Tuple[str, Callable[[Dict, Dict], AsyncIterator[str]]]],
+        hedge: bool
+    ) -> Optional[Tuple[str, str, Dict]]:
+        """Run providers serially or hedged; return (provider name, text, usage) of the winner"""
+        remaining = list(providers)
+        runs = []
+        
+        while runs or remaining:
+            if not runs:
+                runs.append(self._start_provider_run(*remaining.pop(0), prompt))
+                if runs[-1] is None:
+                    runs.pop()
+                    continue
+            
+            wait_timeout = self.config['hedge_delay'] if hedge and remaining else None
+            winner = await self._await_first_token(runs, wait_timeout)
+            
+            if winner is None:
+                if remaining:
+                    if runs:
+                        logger.info(f"⏱️ لم يبدأ {runs[0]['name']} خلال {wait_timeout} ث، تشغيل المزود التالي")
+                    run = self._start_provider_run(*remaining.pop(0), prompt)
+                    if run:
+                        runs.append(run)
+                continue
+            
+            # Commit to the first provider that produced a token and cancel the others
+            for run in runs:
+                if run is not winner:
+                    run['task'].cancel()
+            
+            try:
+                return winner['name'], await winner['task'], winner['usage']
+            except Exception as e:
+                logger.warning(f"⚠️ انقطع {winner['name']} بعد بدء الإجابة: {e}")
+                runs = []
+        
+        return None
+    
+    def _start_provider_run(self, name: str, stream: Callable[[Dict, Dict], AsyncIterator[str]],
+                            prompt: Dict) -> Optional[Dict]:
+        """Start collecting one provider's streamed response under its deadline (None when its circuit is open)"""
+        breaker = self.circuit_breakers.get(name)
+        if breaker and not breaker.allow():
+            logger.info(f"🔌 تم تخطي {name}، الدائرة مفتوحة")
+            return None
+        
+        first_token = asyncio.Event()
+        started = time.monotonic()
+        usage = {}
+        
+        async def collect():
+            parts = []
+            async for delta in stream(prompt, usage):
+                parts.append(delta)
+                first_token.set()
+            return "".join(parts)
+        
+        def record(task):
+            # Cancelled runs lost a hedge race and are not counted against the provider
+            if not breaker:
+                return
+            if task.cancelled():
+                breaker.release()
+            elif task.exception() is not None or not task.result():
+                breaker.record_failure(time.monotonic() - started)
+            else:
+                breaker.record_success(time.monotonic() - started)
+        
+        task = asyncio.ensure_future(asyncio.wait_for(collect(), timeout=self.config['provider_timeout']))
+        task.add_done_callback(record)
+        return {'name': name, 'task': task, 'first_token': first_token, 'usage': usage}
+    
+    async def _await_first_token(self, runs: List[Dict], timeout: Optional[float]) -> Optional[Dict]:
+        """
+        Wait until a run produces its first token
+        
+        Runs that finish without producing text (errors, deadlines) are
+        removed from the list. Returns None on timeout or when no run is left.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        
+        while runs:
+            for run in list(runs):
+                if run['first_token'].is_set():
+                    return run
+                if run['task'].done():
+                    runs.remove(run)
+                    error = run['task'].exception() if not run['task'].cancelled() else None
+                    logger.warning(f"⚠️ فشل {run['name']}: {error!r}")
+            
+            if not runs:
+                return None
+            
+            wait_for = None
+            if deadline is not None:
+                wait_for = deadline - loop.time()
+                if wait_for <= 0:
+                    return None
+            
+            token_waiters = [asyncio.ensure_future(run['first_token'].wait()) for run in runs]
+            done, _ = await asyncio.wait(
+                token_waiters + [run['task'] for run in runs],
+                timeout=wait_for,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            for waiter in token_waiters:
+                waiter.cancel()
+            
+            if not done:
+                return None
+        
+        return None
+    
+    async def _astream_anthropic_response(self, client, prompt: Dict, usage: Dict) -> AsyncIterator[str]:
+        """Stream response text from Anthropic Claude with the async client"""
+        async with client.messages.stream(**self._anthropic_request(prompt)) as stream:
+            async for text in stream.text_stream:
+                if text:
+                    yield text
+            
+            final_message = await stream.get_final_message()
+            usage.update(self._anthropic_usage(final_message.usage))
+    
+    async def _astream_openai_response(self, prompt: Dict, usage: Dict) -> AsyncIterator[str]:
+        """Stream response text from OpenAI GPT with the async API (no usage is reported when streaming)"""
+        response = await self.openai_client.ChatCompletion.acreate(
+            model=self.config['openai_model'],
+            messages=self._openai_messages(prompt),
+            max_tokens=self.config['max_tokens'],
+            temperature=self.config['temperature'],
+            request_timeout=self.config['provider_timeout'],
+            stream=True
+        )
+        
+        async for chunk in response:
+            if chunk.choices:
+                text = chunk.choices[0].delta.get('content')
+                if text:
+                    yield text
     
     def _prepare_enhanced_prompt(
         self,
@@ -160,32 +962,19 @@ class TeacherAIEngine:
         conversation_history: List[Dict],
         prefer_arabic: bool,
         enhanced_arabic_mode: bool,
-        request_complete_answer: bool
-    ) -> str:
-        """Prepare enhanced prompt with Arabic optimization"""
-        
-        # Build conversation context
-        conversation_context = ""
-        if conversation_history:
-            conversation_context = "\n**السياق من المحادثة السابقة:**\n"
-            for msg in conversation_history[-3:]:  # Last 3 messages for context
-                role = "المستخدم" if msg.get('type') == 'user' else "المساعد"
-                conversation_context += f"{role}: {msg.get('text', '')}\n"
-        
-        # Build document context
-        document_context = ""
-        if context:
-            document_context = f"\n**المحتوى المرجعي:**\n{context}\n"
-        
-        # Build enhanced prompt
-        enhanced_prompt = f"""{self.arabic_system_prompt}
-
-{conversation_context}
-{document_context}
-
-**السؤال الحالي:** {user_message}
-
-**تعليمات خاصة:**
+        request_complete_answer: bool,
+        conversation_summary: str = ""
+    ) -> Dict:
+        """
+        Prepare the prompt sections within the input token budget
+        
+        The system prompt is sent separately as the provider's system message,
+        but its size still counts against the budget.
+        
+        Returns:
+            PromptBuilder.build result (system, context and prompt sections)
+        """
+        instructions = f"""**تعليمات خاصة:**
 - {"قدم إجابة شاملة ومفصلة" if request_complete_answer else "قدم إجابة مختصرة ومفيدة"}
 - {"استخدم اللغة العربية بشكل أساسي" if prefer_arabic else "يمكنك استخدام العربية والإنجليزية"}
 - {"طبق التحسينات العربية المتقدمة للنطق والفهم" if enhanced_arabic_mode else ""}
@@ -194,23 +983,90 @@ class TeacherAIEngine:
 
 **الإجابة:**"""
         
-        return enhanced_prompt
+        built = self.prompt_builder.build(
+            system_prompt=self.arabic_system_prompt,
+            question=user_message,
+            instructions=instructions,
+            context=context,
+            conversation_history=conversation_history,
+            conversation_summary=conversation_summary
+        )
+        self._record_prompt_tokens(built['token_counts'])
+        logger.debug(f"🧮 رموز الطلب: {built['token_counts']}")
+        
+        return built
+    
+    def _record_prompt_tokens(self, token_counts: Dict):
+        """Accumulate per-section prompt token counts for get_usage_stats"""
+        with self._prompt_stats_lock:
+            self._prompt_count += 1
+            for section, tokens in token_counts.items():
+                self._prompt_token_totals[section] += tokens
+    
+    def _anthropic_request(self, prompt: Dict) -> Dict:
+        """
+        Request arguments for Anthropic Messages
+        
+        The system prompt and the retrieved passages are sent as separate
+        blocks with prompt-caching markers, so repeated requests reuse the
+        cached prefix instead of reprocessing it.
+        """
+        content = []
+        if prompt['context']:
+            content.append({"type": "text", "text": prompt['context'], "cache_control": {"type": "ephemeral"}})
+        content.append({"type": "text", "text": prompt['prompt']})
+        
+        return {
+            'model': self.config['anthropic_model'],
+            'max_tokens': self.config['max_tokens'],
+            'temperature': self.config['temperature'],
+            'system': [{"type": "text", "text": prompt['system'], "cache_control": {"type": "ephemeral"}}],
+            'messages': [{
+                "role": "user",
+                "content": content
+            }]
+        }
+    
+    def _openai_messages(self, prompt: Dict) -> List[Dict]:
+        """Chat messages for OpenAI (passages lead the user turn so the prefix stays cacheable)"""
+        return [
+            {"role": "system", "content": prompt['system']},
+            {"role": "user", "content": prompt['context'] + prompt['prompt']}
+        ]
     
-    def _generate_anthropic_response(self, prompt: str) -> Optional[str]:
-        """Generate response using Anthropic Claude"""
+    def _anthropic_usage(self, usage) -> Dict:
+        """Token usage of an Anthropic response, including prompt-cache reads and writes"""
+        if not usage:
+            return {}
+        return {
+            'input_tokens': getattr(usage, 'input_tokens', None),
+            'output_tokens': getattr(usage, 'output_tokens', None),
+            'cache_read_tokens': getattr(usage, 'cache_read_input_tokens', None) or 0,
+            'cache_write_tokens': getattr(usage, 'cache_creation_input_tokens', None) or 0
+        }
+    
+    def _openai_usage(self, usage) -> Dict:
+        """Token usage of an OpenAI response (cached prompt tokens when reported)"""
+        if not usage:
+            return {}
+        details = usage.get('prompt_tokens_details') or {}
+        return {
+            'input_tokens': usage.get('prompt_tokens'),
+            'output_tokens': usage.get('completion_tokens'),
+            'cache_read_tokens': details.get('cached_tokens') or 0,
+            'cache_write_tokens': 0
+        }
+    
+    def _generate_anthropic_response(self, prompt: Dict) -> Optional[Dict]:
+        """Generate response using Anthropic Claude; returns text and usage"""
         try:
             message = self.anthropic_client.messages.create(
-                model=self.config['anthropic_model'],
-                max_tokens=self.config['max_tokens'],
-                temperature=self.config['temperature'],
-                messages=[{
-                    "role": "user",
-                    "content": prompt
-                }]
+                timeout=self.config['provider_timeout'],
+                **self._anthropic_request(prompt)
             )
             
             if message.content and len(message.content) > 0:
-                return message.content[0].text
+                return {'text': message.content[0].text, 'usage': self._anthropic_usage(message.usage)}
             
             return None
             
@@ -218,24 +1074,22 @@ class TeacherAIEngine:
             logger.error(f"❌ خطأ في Anthropic: {e}")
             return None
     
-    def _generate_openai_response(self, prompt: str) -> Optional[str]:
-        """Generate response using OpenAI GPT"""
+    def _generate_openai_response(self, prompt: Dict) -> Optional[Dict]:
+        """Generate response using OpenAI GPT; returns text and usage"""
         try:
             response = self.openai_client.ChatCompletion.create(
                 model=self.config['openai_model'],
-                messages=[
-                    {"role": "system", "content": self.arabic_system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=self._openai_messages(prompt),
                 max_tokens=self.config['max_tokens'],
                 temperature=self.config['temperature'],
                 top_p=1,
                 frequency_penalty=0,
-                presence_penalty=0
+                presence_penalty=0,
+                request_timeout=self.config['provider_timeout']
             )
             
             if response.choices and len(response.choices) > 0:
-                return response.choices[0].message.content
+                return {'text': response.choices[0].message.content, 'usage': self._openai_usage(response.get('usage'))}
             
             return None
             
@@ -243,6 +1097,90 @@ class TeacherAIEngine:
             logger.error(f"❌ خطأ في OpenAI: {e}")
             return None
     
+    def _stream_anthropic_response(self, prompt: Dict, usage: Dict) -> Iterator[str]:
+        """Stream response text from Anthropic Claude"""
+        with self.anthropic_client.messages.stream(
+            timeout=self.config['provider_timeout'],
+            **self._anthropic_request(prompt)
+        ) as stream:
+            for text in stream.text_stream:
+                if text:
+                    yield text
+            
+            usage.update(self._anthropic_usage(stream.get_final_message().usage))
+    
+    def _stream_openai_response(self, prompt: Dict, usage: Dict) -> Iterator[str]:
+        """Stream response text from OpenAI GPT (no usage is reported when streaming)"""
+        response = self.openai_client.ChatCompletion.create(
+            model=self.config['openai_model'],
+            messages=self._openai_messages(prompt),
+            max_tokens=self.config['max_tokens'],
+            temperature=self.config['temperature'],
+            stream=True,
+            request_timeout=self.config['provider_timeout']  # connect and per-chunk read timeout
+        )
+        
+        for chunk in response:
+            if chunk.choices:
+                text = chunk.choices[0].delta.get('content')
+                if text:
+                    yield text
+    
+    def summarize_conversation(self, previous_summary: str, messages: List[Dict], max_tokens: int = 400) -> str:
+        """
+        Fold older turns into the rolling conversation summary
+        
+        Uses the first available provider; without one, keeps an extractive
+        summary of the user's questions so the topic is not lost.
+        
+        Args:
+            previous_summary: Summary of the turns folded so far
+            messages: Turns to fold, oldest first, as {'type', 'text'} dicts
+            max_tokens: Size limit of the new summary
+        
+        Returns:
+            Updated summary text
+        """
+        transcript = "\n".join(
+            f"{'المستخدم' if msg.get('type') == 'user' else 'المساعد'}: {msg.get('text', '')}"
+            for msg in messages
+        )
+        prompt = {
+            'system': "أنت مساعد يلخص المحادثات التعليمية بدقة وإيجاز باللغة العربية.",
+            'context': "",
+            'prompt': f"""**الملخص السابق:**
+{previous_summary or "لا يوجد"}
+
+**رسائل جديدة:**
+{truncate_to_tokens(transcript, self.config['max_input_tokens'] // 2)}
+
+حدّث الملخص ليشمل الرسائل الجديدة: المواضيع التي سأل عنها الطالب، والمفاهيم التي شُرحت، وأي تفضيلات ذكرها.
+اكتب الملخص فقط في حدود {max_tokens} رمز تقريباً."""
+        }
+        
+        for name, client, generate in (
+            ('Anthropic', self.anthropic_client, self._generate_anthropic_response),
+            ('OpenAI', self.openai_client, self._generate_openai_response)
+        ):
+            if not client:
+                continue
+            try:
+                response = self._call_provider(name, generate, prompt)
+                if response and response['text']:
+                    return truncate_to_tokens(response['text'].strip(), max_tokens)
+            except Exception as e:
+                logger.warning(f"⚠️ فشل تلخيص المحادثة باستخدام {name}: {e}")
+        
+        # Extractive fallback: previous summary plus the questions asked, newest kept
+        lines = [line for line in (previous_summary or "").split("\n") if line]
+        lines.extend(
+            "- " + truncate_to_tokens(msg.get('text', ''), 40)
+            for msg in messages if msg.get('type') == 'user'
+        )
+        while len(lines) > 1 and arabic_text.estimate_tokens("\n".join(lines)) > max_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
+    
     def _enhance_arabic_response(self, response: str) -> str:
         """Enhance Arabic text for better speech synthesis and readability"""
         if not response:
@@ -342,6 +1280,27 @@ class TeacherAIEngine:
             models.extend(['claude-3-sonnet-20240229', 'claude-3-haiku-20240307'])
         return models
     
+    def get_provider_health(self) -> Dict:
+        """Get circuit breaker state and latency percentiles of the configured providers"""
+        configured = {'Anthropic': self.anthropic_client, 'OpenAI': self.openai_client}
+        return {
+            name: breaker.get_stats()
+            for name, breaker in self.circuit_breakers.items()
+            if configured.get(name)
+        }
+    
+    def get_prompt_token_stats(self) -> Dict:
+        """Average estimated input tokens per prompt section"""
+        with self._prompt_stats_lock:
+            count = self._prompt_count
+            return {
+                'prompts': count,
+                'average': {
+                    section: round(total / count, 1) if count else 0.0
+                    for section, total in self._prompt_token_totals.items()
+                }
+            }
+    
     def get_usage_stats(self) -> Dict:
         """Get usage statistics"""
         return {
@@ -349,5 +1308,8 @@ class TeacherAIEngine:
             'anthropic_available': self.anthropic_client is not None,
             'arabic_enhanced': self.config['arabic_enhanced'],
             'models_available': self.get_available_models(),
+            'response_cache': self.response_cache.get_stats() if self.response_cache else None,
+            'providers': self.get_provider_health(),
+            'prompt_tokens': self.get_prompt_token_stats(),
             'timestamp': datetime.now().isoformat()
         }
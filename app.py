@@ -19,20 +19,35 @@ from pathlib import Path
 project_root = Path(__file__).parent.absolute()
 sys.path.insert(0, str(project_root))
 
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+import html
 import json
 import uuid
+import base64
+import asyncio
+import threading
 import mimetypes
 
 # Import custom modules
 try:
-    from ai_engine import TeacherAIEngine
+    from ai_engine import TeacherAIEngine, create_response_cache
     from document_processor import DocumentProcessor
-    from database import init_db, db, Document, ChatSession, ChatMessage
+    from search_index import SearchIndex
+    from search_backends import create_search_backend, PostingsSearchBackend
+    from fuzzy_search import TrigramVocabulary
+    from semantic_index import create_semantic_index, fuse_rankings
+    from ingestion import IngestionQueue
+    from lifecycle import DocumentEvents, DocumentEvent
+    from file_store import ContentStore
+    from chunked_upload import ChunkedUploadStore, UploadError
+    import arabic_text
+    from database import init_db, db, upgrade_tables, Document, DocumentChunk, ChatSession, ChatMessage
     from config import Config
 except ImportError as e:
     print(f"❌ خطأ في استيراد الوحدات: {e}")
@@ -86,21 +101,111 @@ try:
 except Exception as e:
     logger.error(f"❌ خطأ في تهيئة قاعدة البيانات: {e}")
 
+def dispose_inherited_connections():
+    """Drop pooled connections copied from the parent by fork (gunicorn --preload) without closing them"""
+    try:
+        with app.app_context():
+            db.engine.dispose(close=False)
+    except Exception as e:
+        logger.error(f"❌ خطأ في تهيئة اتصالات قاعدة البيانات بعد التفرع: {e}")
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=dispose_inherited_connections)
+
 # Initialize AI Engine and Document Processor
 try:
-    ai_engine = TeacherAIEngine()
-    document_processor = DocumentProcessor()
+    ai_engine = TeacherAIEngine(response_cache=create_response_cache(
+        cache_type=app.config.get('CACHE_TYPE', 'simple'),
+        redis_url=app.config.get('REDIS_URL'),
+        timeout=app.config.get('CACHE_DEFAULT_TIMEOUT', 300),
+        max_entries=app.config.get('RESPONSE_CACHE_MAX_ENTRIES', 1000)
+    ))
+    document_processor = DocumentProcessor(
+        chunk_max_tokens=app.config.get('CHUNK_MAX_TOKENS', 300),
+        pdf_workers=app.config.get('PDF_EXTRACTION_WORKERS'),
+        pdf_parallel_min_pages=app.config.get('PDF_PARALLEL_MIN_PAGES', 40),
+        ocr_workers=app.config.get('OCR_WORKERS'),
+        ocr_languages=app.config.get('OCR_LANGUAGES', 'ara+eng'),
+        ocr_min_page_chars=app.config.get('OCR_MIN_PAGE_CHARS', 20),
+        ocr_page_timeout=app.config.get('OCR_PAGE_TIMEOUT', 60),
+        ocr_resolution=app.config.get('OCR_RESOLUTION', 300),
+        ocr_cache_dir=app.config.get('OCR_CACHE_FOLDER')
+    )
+    search_index = SearchIndex()
+    search_backend = create_search_backend(
+        search_index,
+        dialect_name=make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name(),
+        preferred=app.config.get('SEARCH_BACKEND', 'auto')
+    )
+    fuzzy_vocabulary = TrigramVocabulary(
+        time_budget_ms=app.config.get('FUZZY_SEARCH_BUDGET_MS', 50)
+    ) if app.config.get('ENABLE_FUZZY_SEARCH') else None
+    semantic_index = create_semantic_index(
+        app.config.get('SEMANTIC_INDEX_FOLDER', 'vector_index'),
+        app.config.get('SEMANTIC_MODEL'),
+        dtype=app.config.get('SEMANTIC_VECTOR_DTYPE', 'float16')
+    ) if app.config.get('SEMANTIC_RETRIEVAL', 'off') != 'off' else None
+    ingestion_queue = IngestionQueue(
+        app,
+        max_workers=app.config.get('INGESTION_WORKERS', 2),
+        poll_interval=app.config.get('INGESTION_POLL_INTERVAL', 5),
+        stale_timeout=app.config.get('INGESTION_STALE_TIMEOUT', 1800)
+    )
     logger.info("✅ تم تهيئة محرك الذكاء الاصطناعي ومعالج المستندات")
 except Exception as e:
     logger.error(f"❌ خطأ في تهيئة المحركات: {e}")
     ai_engine = None
     document_processor = None
+    search_index = None
+    search_backend = None
+    fuzzy_vocabulary = None
+    semantic_index = None
+    ingestion_queue = None
 
 # Create directories
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs('logs', exist_ok=True)
 os.makedirs('static/uploads', exist_ok=True)
 
+# Uploaded files are stored once per distinct content (SHA-256)
+content_store = ContentStore(app.config['UPLOAD_FOLDER'])
+
+# Large files arrive in resumable chunks written straight to disk
+upload_sessions = ChunkedUploadStore(
+    content_store,
+    chunk_size=app.config.get('CHUNKED_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024),
+    max_size=app.config.get('CHUNKED_UPLOAD_MAX_SIZE', 200 * 1024 * 1024),
+    session_timeout=app.config.get('UPLOAD_SESSION_TIMEOUT', 24 * 3600)
+)
+
+def drop_document_index(document_event):
+    """Remove the chunks and postings of replaced or deleted content (in the caller's transaction)"""
+    if search_index and document_event.event_type != DocumentEvent.CREATED:
+        search_index.remove_document(document_event.document_id)
+
+def drop_document_derivatives(document_event):
+    """Drop the embeddings and cached answers built from replaced or deleted content"""
+    if document_event.event_type == DocumentEvent.CREATED:
+        return
+    
+    if semantic_index:
+        semantic_index.remove_document(document_event.document_id)
+    if ai_engine and ai_engine.response_cache and document_event.chunk_ids:
+        removed = ai_engine.response_cache.invalidate(document_event.chunk_ids)
+        if removed:
+            logger.info(f"🧹 تم إبطال {removed} إجابة محفوظة للمستند {document_event.document_id}")
+
+def queue_document_ingestion(document_event):
+    """Wake the ingestion queue for new or replaced content"""
+    if ingestion_queue and document_event.event_type != DocumentEvent.DELETED:
+        ingestion_queue.enqueue(document_event.document_id)
+
+# Everything derived from a document follows its lifecycle (created, replaced, deleted)
+document_events = DocumentEvents(db.session)
+document_events.subscribe(drop_document_index)
+document_events.subscribe(drop_document_derivatives, after_commit=True)
+document_events.subscribe(queue_document_ingestion, after_commit=True)
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and \
@@ -135,9 +240,109 @@ def health_check():
         'timestamp': datetime.now().isoformat(),
         'version': '2.0.0',
         'ai_engine': ai_engine is not None,
-        'document_processor': document_processor is not None
+        'document_processor': document_processor is not None,
+        'ingestion_queue': ingestion_queue is not None,
+        'semantic_index': semantic_index.get_stats() if semantic_index else None,
+        'ai_providers': ai_engine.get_provider_health() if ai_engine else None
     })
 
+def register_upload(filename, original_filename, file_path, content_hash, file_size, mime_type=None):
+    """
+    Record a file stored in the content store as a document
+    
+    Returns:
+        Tuple of (document, duplicate, replaced)
+    """
+    mime_type = mimetypes.guess_type(filename)[0] or mime_type or 'application/octet-stream'
+    
+    # Same content already uploaded: reuse its extracted text, chunks and index entries
+    document = Document.query.filter_by(content_hash=content_hash).first()
+    if document:
+        return reuse_duplicate_upload(document, filename, file_path)
+    
+    try:
+        return store_upload_content(filename, original_filename, file_path, content_hash, file_size, mime_type)
+    except IntegrityError:
+        # A concurrent upload of the same bytes committed first (content_hash is unique)
+        db.session.rollback()
+        document = Document.query.filter_by(content_hash=content_hash).first()
+        if not document:
+            raise
+        return reuse_duplicate_upload(document, filename, file_path)
+
+def reuse_duplicate_upload(document, filename, file_path):
+    """Point an upload at the existing document with the same content"""
+    # The stored file is shared when the extensions match; only a differently named copy goes
+    if file_path != document.file_path:
+        content_store.delete(file_path)
+    if document.processing_status == 'failed':
+        document.processing_status = 'pending'
+        document.processing_error = None
+        db.session.commit()
+        if ingestion_queue:
+            ingestion_queue.enqueue(document.id)
+    logger.info(f"♻️ الملف {filename} مرفوع مسبقاً (المستند {document.id})")
+    return document, True, False
+
+def store_upload_content(filename, original_filename, file_path, content_hash, file_size, mime_type):
+    """Record new content, replacing the document of the same name if there is one"""
+    # New content under the name of an existing document replaces that document
+    document = Document.query.filter_by(filename=filename).order_by(Document.id.desc()).first()
+    if document:
+        # Old chunks, postings, embeddings and cached answers go with the old content
+        previous_path = document.file_path
+        document_events.emit(DocumentEvent.REPLACED, document.id)
+        
+        document.original_filename = original_filename
+        document.file_path = file_path
+        document.file_size = file_size
+        document.mime_type = mime_type
+        document.content_hash = content_hash
+        document.content = None
+        document.word_count = 0
+        document.processing_status = 'pending'
+        document.processing_error = None
+        document.upload_date = datetime.now()
+        db.session.commit()
+        
+        if previous_path != file_path:
+            content_store.delete(previous_path)
+        logger.info(f"🔁 تم استبدال محتوى المستند {document.id}: {filename}")
+        return document, False, True
+    
+    # Save to database; extraction runs in the background ingestion queue
+    document = Document(
+        filename=filename,
+        original_filename=original_filename,
+        file_path=file_path,
+        file_size=file_size,
+        mime_type=mime_type,
+        content_hash=content_hash,
+        word_count=0,
+        processing_status='pending',
+        upload_date=datetime.now()
+    )
+    
+    db.session.add(document)
+    db.session.flush()
+    document_events.emit(DocumentEvent.CREATED, document.id)
+    db.session.commit()
+    return document, False, False
+
+def describe_upload(document, original_filename, duplicate, replaced):
+    """Upload result entry returned to the client"""
+    return {
+        'id': document.id,
+        'filename': document.filename,
+        'original_filename': original_filename,
+        'size': document.file_size,
+        'word_count': document.word_count,
+        'processing_status': document.processing_status,
+        'duplicate': duplicate,
+        'replaced': replaced,
+        'icon': get_file_icon(document.filename)
+    }
+
 @app.route('/api/upload', methods=['POST'])
 def upload_files():
     """Upload and process documents"""
@@ -170,54 +375,18 @@ def upload_files():
                     if not filename:
                         filename = f"file_{uuid.uuid4().hex[:8]}.txt"
 
-                    # Save file
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    file.save(file_path)
-
-                    # Process document if processor is available
-                    content = ""
-                    word_count = 0
+                    # Save file while hashing it (content-addressed layout)
+                    extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+                    file_path, content_hash, file_size = content_store.save(file.stream, extension)
                     
-                    if document_processor:
-                        try:
-                            content = document_processor.process_file(file_path)
-                            word_count = len(content.split()) if content else 0
-                        except Exception as e:
-                            logger.warning(f"⚠️ فشل في معالجة الملف {filename}: {e}")
-                            # Try to read as text file
-                            try:
-                                with open(file_path, 'r', encoding='utf-8') as f:
-                                    content = f.read()
-                                word_count = len(content.split())
-                            except:
-                                content = f"تم رفع الملف {filename} ولكن فشل في معالجته"
-                                word_count = 0
-
-                    # Save to database
-                    document = Document(
-                        filename=filename,
-                        original_filename=file.filename,
-                        file_path=file_path,
-                        file_size=os.path.getsize(file_path),
-                        mime_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
-                        content=content,
-                        word_count=word_count,
-                        upload_date=datetime.now()
+                    document, duplicate, replaced = register_upload(
+                        filename, file.filename, file_path, content_hash, file_size
                     )
                     
-                    db.session.add(document)
-                    db.session.commit()
+                    uploaded_files.append(describe_upload(document, file.filename, duplicate, replaced))
 
-                    uploaded_files.append({
-                        'id': document.id,
-                        'filename': filename,
-                        'original_filename': file.filename,
-                        'size': document.file_size,
-                        'word_count': word_count,
-                        'icon': get_file_icon(filename)
-                    })
-
-                    logger.info(f"✅ تم رفع الملف بنجاح: {filename}")
+                    if not duplicate and not replaced:
+                        logger.info(f"✅ تم رفع الملف وإضافته لطابور المعالجة: {filename}")
 
                 except Exception as e:
                     error_msg = f"خطأ في رفع الملف {file.filename}: {str(e)}"
@@ -249,14 +418,223 @@ def upload_files():
             'message': f"خطأ في رفع الملفات: {str(e)}"
         }), 500
 
+def parse_int(value, default=None):
+    """Integer from a JSON field (number or digit string); default when missing or malformed"""
+    if isinstance(value, bool):
+        return default
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value.strip().lstrip('+-').isdecimal():
+        return int(value)
+    return default
+
+def upload_error_response(error):
+    """JSON response for a rejected chunked upload request"""
+    payload = {'status': 'error', 'message': str(error)}
+    if error.offset is not None:
+        payload['offset'] = error.offset
+    return jsonify(payload), error.status_code
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload_session():
+    """Start a resumable chunked upload: {filename, size} -> upload_id and chunk size"""
+    try:
+        data = request.get_json() or {}
+        original_filename = data.get('filename', '')
+        
+        if not original_filename or not allowed_file(original_filename):
+            return jsonify({
+                'status': 'error',
+                'message': f"نوع الملف غير مدعوم: {original_filename}"
+            }), 400
+        
+        size = parse_int(data.get('size'))
+        if size is None or size < 0:
+            return jsonify({
+                'status': 'error',
+                'message': 'حجم الملف غير صالح'
+            }), 400
+        
+        filename = secure_filename(original_filename) or f"file_{uuid.uuid4().hex[:8]}.txt"
+        state = upload_sessions.create(filename, original_filename, size)
+        
+        return jsonify({
+            'status': 'success',
+            'upload_id': state['upload_id'],
+            'offset': state['offset'],
+            'chunk_size': upload_sessions.chunk_size
+        })
+    
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        logger.error(f"❌ خطأ في بدء الرفع المجزأ: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': f"خطأ في بدء الرفع: {str(e)}"
+        }), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload_session(upload_id):
+    """Bytes received so far, to resume an interrupted upload"""
+    try:
+        state = upload_sessions.status(upload_id)
+        return jsonify({
+            'status': 'success',
+            'upload_id': upload_id,
+            'offset': state['offset'],
+            'size': state['size']
+        })
+    except UploadError as e:
+        return upload_error_response(e)
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def put_upload_chunk(upload_id):
+    """Write the raw request body at ?offset= (must equal the bytes received so far)"""
+    try:
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            return jsonify({
+                'status': 'error',
+                'message': 'موضع الجزء مطلوب'
+            }), 400
+        
+        # The body is streamed from the socket, never buffered as a whole
+        state = upload_sessions.write_chunk(upload_id, offset, request.stream)
+        return jsonify({
+            'status': 'success',
+            'upload_id': upload_id,
+            'offset': state['offset'],
+            'size': state['size']
+        })
+    
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        logger.error(f"❌ خطأ في استقبال جزء الملف: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': f"خطأ في استقبال جزء الملف: {str(e)}"
+        }), 500
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload_session(upload_id):
+    """Store the assembled file and hand it to the ingestion pipeline"""
+    try:
+        stored = upload_sessions.complete(upload_id)
+        document, duplicate, replaced = register_upload(
+            stored['filename'],
+            stored['original_filename'],
+            stored['file_path'],
+            stored['content_hash'],
+            stored['file_size'],
+            mime_type=stored['mime_type']
+        )
+        
+        return jsonify({
+            'status': 'success',
+            'uploaded_files': [describe_upload(document, stored['original_filename'], duplicate, replaced)],
+            'message': f"تم رفع الملف {document.filename} بنجاح"
+        })
+    
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        logger.error(f"❌ خطأ في إنهاء الرفع المجزأ: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': f"خطأ في إنهاء الرفع: {str(e)}"
+        }), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload_session(upload_id):
+    """Cancel a chunked upload and discard its data"""
+    try:
+        upload_sessions.abort(upload_id)
+        return jsonify({
+            'status': 'success',
+            'message': 'تم إلغاء الرفع'
+        })
+    except UploadError as e:
+        return upload_error_response(e)
+
+# Columns returned by the document listing (never the extracted content)
+DOCUMENT_LIST_COLUMNS = (
+    Document.id,
+    Document.filename,
+    Document.original_filename,
+    Document.file_size,
+    Document.word_count,
+    Document.upload_date,
+    Document.mime_type,
+    Document.processing_status,
+    Document.document_type,
+    Document.subject,
+    Document.tags
+)
+
+def encode_document_cursor(upload_date, doc_id):
+    """Opaque keyset cursor for the position after (upload_date, id)"""
+    raw = json.dumps([upload_date.isoformat(), doc_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_document_cursor(cursor):
+    """Inverse of encode_document_cursor; raises ValueError on malformed cursors"""
+    try:
+        upload_date, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(upload_date), int(doc_id)
+    except Exception as e:
+        raise ValueError(f"مؤشر الصفحة غير صالح: {e}")
+
 @app.route('/api/documents', methods=['GET'])
 def get_documents():
-    """Get all uploaded documents"""
+    """
+    Get uploaded documents, newest first, one page at a time
+    
+    Query parameters: limit, cursor (next_cursor of the previous page),
+    subject, document_type and tag filters.
+    """
     try:
-        documents = Document.query.order_by(Document.upload_date.desc()).all()
+        page_size = app.config.get('PAGINATION_SIZE', 20)
+        limit = min(max(request.args.get('limit', page_size, type=int), 1), 100)
+        cursor = request.args.get('cursor')
+        
+        query = db.session.query(*DOCUMENT_LIST_COLUMNS)
+        
+        if request.args.get('subject'):
+            query = query.filter(Document.subject == request.args['subject'])
+        if request.args.get('document_type'):
+            query = query.filter(Document.document_type == request.args['document_type'])
+        if request.args.get('tag'):
+            # Tags are a JSON list; match the encoded element within the serialized column
+            encoded_tag = json.dumps(request.args['tag'])
+            query = query.filter(db.cast(Document.tags, db.Text).contains(encoded_tag))
+        
+        # Only the first page reports the total, later pages stay index-only
+        total = query.count() if not cursor else None
+        
+        if cursor:
+            try:
+                cursor_date, cursor_id = decode_document_cursor(cursor)
+            except ValueError as e:
+                return jsonify({
+                    'status': 'error',
+                    'message': str(e)
+                }), 400
+            
+            query = query.filter(db.or_(
+                Document.upload_date < cursor_date,
+                db.and_(Document.upload_date == cursor_date, Document.id < cursor_id)
+            ))
+        
+        rows = query.order_by(Document.upload_date.desc(), Document.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
         
         docs_list = []
-        for doc in documents:
+        for doc in rows:
             docs_list.append({
                 'id': doc.id,
                 'filename': doc.filename,
@@ -265,13 +643,19 @@ def get_documents():
                 'word_count': doc.word_count,
                 'upload_date': doc.upload_date.isoformat(),
                 'mime_type': doc.mime_type,
+                'processing_status': doc.processing_status,
+                'document_type': doc.document_type,
+                'subject': doc.subject,
+                'tags': doc.tags,
                 'icon': get_file_icon(doc.filename)
             })
-
+        
         return jsonify({
             'status': 'success',
             'documents': docs_list,
-            'total': len(docs_list)
+            'total': total,
+            'count': len(docs_list),
+            'next_cursor': encode_document_cursor(rows[-1].upload_date, rows[-1].id) if has_more else None
         })
 
     except Exception as e:
@@ -281,6 +665,27 @@ def get_documents():
             'message': f"خطأ في جلب المستندات: {str(e)}"
         }), 500
 
+@app.route('/api/documents/<int:doc_id>/status', methods=['GET'])
+def get_document_status(doc_id):
+    """Get the background processing status of a document"""
+    try:
+        document = Document.query.get_or_404(doc_id)
+        
+        return jsonify({
+            'status': 'success',
+            'document_id': document.id,
+            'processing_status': document.processing_status,
+            'processing_error': document.processing_error,
+            'word_count': document.word_count
+        })
+    
+    except Exception as e:
+        logger.error(f"❌ خطأ في جلب حالة المستند: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': f"خطأ في جلب حالة المستند: {str(e)}"
+        }), 500
+
 @app.route('/api/documents/<int:doc_id>', methods=['DELETE'])
 def delete_document(doc_id):
     """Delete a document"""
@@ -289,12 +694,12 @@ def delete_document(doc_id):
         
         # Delete file from filesystem
         try:
-            if os.path.exists(document.file_path):
-                os.remove(document.file_path)
+            content_store.delete(document.file_path)
         except Exception as e:
             logger.warning(f"⚠️ فشل في حذف الملف من النظام: {e}")
 
-        # Delete from database
+        # Delete from database; index entries, embeddings and cached answers follow the event
+        document_events.emit(DocumentEvent.DELETED, document.id)
         db.session.delete(document)
         db.session.commit()
 
@@ -312,6 +717,195 @@ def delete_document(doc_id):
             'message': f"خطأ في حذف الملف: {str(e)}"
         }), 500
 
+def rank_semantic_chunks(user_message, limit=50):
+    """Embedding-based (or hybrid) chunk ranking, or None to use BM25 alone"""
+    if not semantic_index:
+        return None
+    
+    try:
+        semantic = semantic_index.search(user_message, limit=limit)
+    except Exception as e:
+        logger.warning(f"⚠️ فشل البحث الدلالي، سيتم استخدام البحث النصي: {e}")
+        return None
+    
+    # Empty or still-building index, or documents never embedded: BM25 takes over
+    if not semantic:
+        return None
+    
+    if app.config.get('SEMANTIC_RETRIEVAL') != 'hybrid':
+        return semantic
+    
+    return fuse_rankings(
+        search_index.search_chunks(user_message, limit=limit),
+        semantic,
+        semantic_weight=app.config.get('SEMANTIC_HYBRID_WEIGHT', 0.5),
+        limit=limit
+    )
+
+def retrieve_document_context(user_message):
+    """Pack the best-scoring passages for a message into a context string, sources and chunk ids"""
+    if not search_index:
+        return "", [], []
+    
+    top_chunks = search_index.pack_context(
+        user_message,
+        max_tokens=app.config.get('MAX_CONTEXT_LENGTH', 8000),
+        ranked=rank_semantic_chunks(user_message)
+    )
+    if not top_chunks:
+        return "", [], []
+    
+    document_context = "\n\n".join([
+        f"من الملف {chunk.document.filename}"
+        + (f" (صفحة {chunk.page})" if chunk.page else "")
+        + f":\n{chunk.text}"
+        for chunk in top_chunks
+    ])
+    
+    # Cited pages per file, in first-use order
+    source_pages = {}
+    for chunk in top_chunks:
+        pages = source_pages.setdefault(chunk.document.filename, [])
+        if chunk.page and chunk.page not in pages:
+            pages.append(chunk.page)
+    sources = [
+        {'filename': filename, 'pages': sorted(pages)}
+        for filename, pages in source_pages.items()
+    ]
+    return document_context, sources, [chunk.id for chunk in top_chunks]
+
+def load_conversation(conversation_id):
+    """
+    Load the rolling summary and the not-yet-summarized messages of a session
+    
+    The query is bounded by the summary interval, so its cost does not grow
+    with the length of the session.
+    
+    Returns:
+        Tuple of (history as {'type', 'text'} dicts oldest first, summary)
+    """
+    try:
+        session = db.session.get(ChatSession, conversation_id)
+        
+        query = db.session.query(ChatMessage.message_type, ChatMessage.content).filter(
+            ChatMessage.session_id == conversation_id
+        )
+        if session and session.summarized_until:
+            query = query.filter(ChatMessage.id > session.summarized_until)
+        
+        limit = app.config.get('CHAT_HISTORY_MESSAGES', 6) + app.config.get('CHAT_SUMMARY_INTERVAL', 10)
+        rows = query.order_by(ChatMessage.id.desc()).limit(limit).all()
+        
+        history = [{'type': message_type, 'text': content} for message_type, content in reversed(rows)]
+        return history, (session.summary if session else None) or ""
+    
+    except Exception as e:
+        logger.warning(f"⚠️ فشل في تحميل سجل المحادثة: {e}")
+        return [], ""
+
+# Sessions whose summary is being refreshed (one refresh per session at a time)
+_summaries_in_progress = set()
+_summaries_lock = threading.Lock()
+
+def refresh_conversation_summary(conversation_id):
+    """Fold older messages into the session summary once enough have accumulated"""
+    with _summaries_lock:
+        if conversation_id in _summaries_in_progress:
+            return
+        _summaries_in_progress.add(conversation_id)
+    
+    try:
+        with app.app_context():
+            session = db.session.get(ChatSession, conversation_id)
+            if not session:
+                return
+            
+            pending = ChatMessage.query.filter(ChatMessage.session_id == conversation_id)
+            if session.summarized_until:
+                pending = pending.filter(ChatMessage.id > session.summarized_until)
+            
+            # The most recent messages stay verbatim in the prompt
+            fold_count = pending.count() - app.config.get('CHAT_HISTORY_MESSAGES', 6)
+            if fold_count < app.config.get('CHAT_SUMMARY_INTERVAL', 10):
+                return
+            
+            to_fold = pending.with_entities(
+                ChatMessage.id, ChatMessage.message_type, ChatMessage.content
+            ).order_by(ChatMessage.id).limit(fold_count).all()
+            
+            session.summary = ai_engine.summarize_conversation(
+                session.summary,
+                [{'type': message_type, 'text': content} for _, message_type, content in to_fold],
+                max_tokens=app.config.get('CHAT_SUMMARY_MAX_TOKENS', 400)
+            )
+            session.summarized_until = to_fold[-1].id
+            db.session.commit()
+            logger.info(f"📝 تم تحديث ملخص المحادثة {conversation_id} ({len(to_fold)} رسالة)")
+    
+    except Exception as e:
+        logger.warning(f"⚠️ فشل في تحديث ملخص المحادثة: {e}")
+    
+    finally:
+        with _summaries_lock:
+            _summaries_in_progress.discard(conversation_id)
+
+def save_chat_exchange(conversation_id, user_message, response_text, confidence, sources, details=None):
+    """Persist a user message and the assistant response (with provider, timing and token usage details)"""
+    details = details or {}
+    usage = details.get('usage') or {}
+    try:
+        session = db.session.get(ChatSession, conversation_id)
+        if not session:
+            session = ChatSession(title=user_message[:200], id=conversation_id, message_count=0)
+            db.session.add(session)
+        session.message_count = (session.message_count or 0) + 2
+        session.last_activity = datetime.utcnow()
+        
+        # Save user message
+        user_msg = ChatMessage(
+            session_id=conversation_id,
+            message_type='user',
+            content=user_message,
+            timestamp=datetime.now()
+        )
+        db.session.add(user_msg)
+        
+        # Save assistant response
+        assistant_msg = ChatMessage(
+            session_id=conversation_id,
+            message_type='assistant',
+            content=response_text,
+            confidence=confidence,
+            sources=json.dumps(sources, ensure_ascii=False),
+            model_used=details.get('model'),
+            response_time=details.get('response_time'),
+            input_tokens=usage.get('input_tokens'),
+            output_tokens=usage.get('output_tokens'),
+            cache_read_tokens=usage.get('cache_read_tokens'),
+            cache_write_tokens=usage.get('cache_write_tokens'),
+            timestamp=datetime.now()
+        )
+        db.session.add(assistant_msg)
+        db.session.commit()
+    
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"⚠️ فشل في حفظ الرسائل: {e}")
+        return
+    
+    # Summarizing may call a provider, so it runs off the request path
+    if ai_engine:
+        threading.Thread(
+            target=refresh_conversation_summary,
+            args=(conversation_id,),
+            name='conversation-summary',
+            daemon=True
+        ).start()
+
+def sse_event(event, payload):
+    """Format a Server-Sent Events frame with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """Handle chat messages with enhanced Arabic support"""
@@ -330,90 +924,55 @@ def chat():
                 'message': 'الرسالة فارغة'
             }), 400
 
-        # Get conversation context
+        # Get conversation context (stored history wins over a client-supplied transcript)
         conversation_id = data.get('conversation_id')
-        conversation_history = data.get('conversation_history', [])
+        if conversation_id:
+            conversation_history, conversation_summary = load_conversation(conversation_id)
+        else:
+            conversation_history, conversation_summary = data.get('conversation_history', []), ""
         request_complete_answer = data.get('request_complete_answer', True)
         prefer_arabic = data.get('prefer_arabic', True)
         enhanced_arabic_mode = data.get('enhanced_arabic_mode', True)
 
-        # Get relevant documents
-        documents = Document.query.all()
-        document_context = ""
-        
-        if documents:
-            # Simple keyword matching for context
-            keywords = user_message.lower().split()
-            relevant_docs = []
-            
-            for doc in documents:
-                if doc.content:
-                    content_lower = doc.content.lower()
-                    relevance_score = sum(1 for keyword in keywords if keyword in content_lower)
-                    if relevance_score > 0:
-                        relevant_docs.append((doc, relevance_score))
-            
-            # Sort by relevance and take top 3
-            relevant_docs.sort(key=lambda x: x[1], reverse=True)
-            top_docs = relevant_docs[:3]
-            
-            if top_docs:
-                document_context = "\n\n".join([
-                    f"من الملف {doc.filename}:\n{doc.content[:1000]}..."
-                    for doc, _ in top_docs
-                ])
+        # Get the best-scoring passages across all documents within the context budget
+        document_context, context_sources, context_ids = retrieve_document_context(user_message)
 
         # Generate response using AI engine
         if ai_engine:
             try:
-                response_text = ai_engine.generate_response(
-                    user_message,
+                generation_args = dict(
                     context=document_context,
                     conversation_history=conversation_history,
+                    conversation_summary=conversation_summary,
                     prefer_arabic=prefer_arabic,
                     enhanced_arabic_mode=enhanced_arabic_mode,
-                    request_complete_answer=request_complete_answer
+                    request_complete_answer=request_complete_answer,
+                    context_ids=context_ids
                 )
+                if app.config.get('AI_ASYNC_ENGINE'):
+                    details = asyncio.run(ai_engine.agenerate_response_details(user_message, **generation_args))
+                else:
+                    details = ai_engine.generate_response_details(user_message, **generation_args)
+                response_text = details['text']
                 
                 confidence = 0.85  # Default confidence
-                sources = [{'filename': doc.filename} for doc, _ in top_docs] if 'top_docs' in locals() else []
+                sources = context_sources
                 
             except Exception as e:
                 logger.error(f"❌ خطأ في محرك الذكاء الاصطناعي: {e}")
                 response_text = self.generate_fallback_response(user_message, document_context)
+                details = None
                 confidence = 0.6
                 sources = []
         else:
             response_text = self.generate_fallback_response(user_message, document_context)
+            details = None
             confidence = 0.6
             sources = []
 
         # Save chat message to database if conversation_id provided
         if conversation_id:
-            try:
-                # Save user message
-                user_msg = ChatMessage(
-                    session_id=conversation_id,
-                    message_type='user',
-                    content=user_message,
-                    timestamp=datetime.now()
-                )
-                db.session.add(user_msg)
-                
-                # Save assistant response
-                assistant_msg = ChatMessage(
-                    session_id=conversation_id,
-                    message_type='assistant',
-                    content=response_text,
-                    confidence=confidence,
-                    sources=json.dumps(sources, ensure_ascii=False),
-                    timestamp=datetime.now()
-                )
-                db.session.add(assistant_msg)
-                db.session.commit()
-                
-            except Exception as e:
-                logger.warning(f"⚠️ فشل في حفظ الرسائل: {e}")
+            save_chat_exchange(conversation_id, user_message, response_text, confidence, sources, details)
 
         return jsonify({
             'status': 'success',
@@ -432,6 +991,90 @@ def chat():
             'message': f"خطأ في معالجة الرسالة: {str(e)}"
         }), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Stream the chat response token by token as Server-Sent Events"""
+    data = request.get_json()
+    if not data or 'message' not in data:
+        return jsonify({
+            'status': 'error',
+            'message': 'لا توجد رسالة للمعالجة'
+        }), 400
+    
+    user_message = data['message'].strip()
+    if not user_message:
+        return jsonify({
+            'status': 'error',
+            'message': 'الرسالة فارغة'
+        }), 400
+    
+    if not ai_engine:
+        return jsonify({
+            'status': 'error',
+            'message': 'محرك الذكاء الاصطناعي غير متوفر'
+        }), 503
+    
+    # Get conversation context (stored history wins over a client-supplied transcript)
+    conversation_id = data.get('conversation_id')
+    if conversation_id:
+        conversation_history, conversation_summary = load_conversation(conversation_id)
+    else:
+        conversation_history, conversation_summary = data.get('conversation_history', []), ""
+    request_complete_answer = data.get('request_complete_answer', True)
+    prefer_arabic = data.get('prefer_arabic', True)
+    enhanced_arabic_mode = data.get('enhanced_arabic_mode', True)
+    
+    try:
+        document_context, sources, context_ids = retrieve_document_context(user_message)
+    except Exception as e:
+        logger.error(f"❌ خطأ في استرجاع السياق: {e}")
+        document_context, sources, context_ids = "", [], []
+    
+    def generate():
+        details = {}
+        try:
+            for delta in ai_engine.generate_response_stream(
+                user_message,
+                context=document_context,
+                conversation_history=conversation_history,
+                conversation_summary=conversation_summary,
+                prefer_arabic=prefer_arabic,
+                enhanced_arabic_mode=enhanced_arabic_mode,
+                request_complete_answer=request_complete_answer,
+                context_ids=context_ids,
+                details=details
+            ):
+                yield sse_event('token', {'text': delta})
+        except Exception as e:
+            # The client drops the partial answer; nothing of it is saved or cached
+            logger.error(f"❌ خطأ في بث الإجابة: {e}")
+            yield sse_event('error', {'message': f"خطأ في معالجة الرسالة: {str(e)}"})
+            return
+        
+        # Persist the final message once the stream has completed
+        response_text = details['text']
+        confidence = 0.85  # Default confidence
+        if conversation_id:
+            save_chat_exchange(conversation_id, user_message, response_text, confidence, sources, details)
+        
+        yield sse_event('done', {
+            'response': response_text,
+            'confidence': confidence,
+            'sources': sources,
+            'is_complete_answer': request_complete_answer,
+            'arabic_enhanced': enhanced_arabic_mode,
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # disable proxy buffering so tokens flush immediately
+        }
+    )
+
 def generate_fallback_response(self, user_message, context=""):
     """Generate a fallback response when AI engine is not available"""
     responses = {
@@ -471,9 +1114,44 @@ def generate_fallback_response(self, user_message, context=""):
         import random
         return random.choice(responses['default'])
 
+def search_document_page(terms, limit, offset):
+    """Rank documents with the configured backend, falling back to the BM25 postings"""
+    try:
+        return search_backend.search(terms, limit=limit, offset=offset)
+    except Exception as e:
+        if isinstance(search_backend, PostingsSearchBackend):
+            raise
+        db.session.rollback()
+        logger.warning(f"⚠️ فشل البحث عبر {search_backend.name}، استخدام الفهرس الداخلي: {e}")
+        return PostingsSearchBackend(search_index).search(terms, limit=limit, offset=offset)
+
+def highlight_html(text, matches):
+    """HTML-escape a snippet and wrap its [start, end] matches in <mark>"""
+    highlighted, cursor = [], 0
+    for match_start, match_end in matches:
+        highlighted.append(html.escape(text[cursor:match_start]))
+        highlighted.append(f"<mark>{html.escape(text[match_start:match_end])}</mark>")
+        cursor = match_end
+    highlighted.append(html.escape(text[cursor:]))
+    return "".join(highlighted)
+
+def expand_query_terms(query_terms, prefix_last=False):
+    """Add typo-tolerant (and, while typing, prefix) matches of the query terms from the vocabulary"""
+    fuzzy_vocabulary.refresh()
+    expansions, elapsed_ms = fuzzy_vocabulary.expand(query_terms, prefix_last=prefix_last)
+    terms = list(dict.fromkeys(term for similar in expansions.values() for term in similar))
+    return terms, expansions, elapsed_ms
+
 @app.route('/api/search', methods=['POST'])
 def search_documents():
-    """Search in uploaded documents"""
+    """
+    Search in uploaded documents (ranked, paginated, with highlighted snippets)
+    
+    Request fields: query, page, per_page, fuzzy (true/false; by default
+    fuzzy matching is tried only when the exact terms find nothing) and
+    prefix (search-as-you-type: the last word may be incomplete) and
+    snippets (passages per document, 0 to SEARCH_MAX_SNIPPETS).
+    """
     try:
         data = request.get_json()
         query = data.get('query', '').strip()
@@ -483,41 +1161,83 @@ def search_documents():
                 'status': 'error',
                 'message': 'استعلام البحث فارغ'
             }), 400
-
-        # Search in documents
-        documents = Document.query.all()
+        
+        default_per_page = app.config.get('SEARCH_RESULTS_LIMIT', 20)
+        per_page = min(max(parse_int(data.get('per_page'), default_per_page), 1), 100)
+        page = max(parse_int(data.get('page'), 1), 1)
+        snippets_per_document = min(max(parse_int(data.get('snippets'), 3), 0), app.config.get('SEARCH_MAX_SNIPPETS', 10))
+        
+        fuzzy = data.get('fuzzy')
+        prefix = bool(data.get('prefix')) and not data.get('query', '').endswith(' ')
+        
+        # Query terms are normalized and stemmed exactly like the indexed chunk terms
+        query_terms = list(dict.fromkeys(search_index.tokenize(query))) if search_index else []
+        search_terms = query_terms
+        expansions = None
+        fuzzy_time_ms = None
         results = []
+        total = 0
         
-        for doc in documents:
-            if doc.content and query.lower() in doc.content.lower():
-                # Find the context around the match
-                content_lower = doc.content.lower()
-                query_lower = query.lower()
+        if query_terms:
+            offset = (page - 1) * per_page
+            if fuzzy_vocabulary and (fuzzy or prefix):
+                search_terms, expansions, fuzzy_time_ms = expand_query_terms(query_terms, prefix_last=prefix)
+            
+            ranked, total = search_document_page(search_terms, per_page, offset)
+            
+            # Typo tolerance as a fallback: retry with similar terms when nothing matched
+            if not total and fuzzy is None and fuzzy_vocabulary and expansions is None:
+                search_terms, expansions, fuzzy_time_ms = expand_query_terms(query_terms)
+                if len(search_terms) > len(query_terms):
+                    ranked, total = search_document_page(search_terms, per_page, offset)
+            
+            # Top passages per document from the stored term positions
+            snippets = search_index.snippets(
+                [document_id for _, document_id, _ in ranked],
+                search_terms,
+                per_document=snippets_per_document
+            )
+            documents = {
+                doc.id: doc
+                for doc in db.session.query(
+                    Document.id, Document.filename, Document.word_count, Document.upload_date
+                ).filter(Document.id.in_([document_id for _, document_id, _ in ranked]))
+            }
+            
+            for chunk_id, document_id, score in ranked:
+                doc = documents.get(document_id)
+                if not doc:
+                    continue
                 
-                match_index = content_lower.find(query_lower)
-                if match_index >= 0:
-                    start = max(0, match_index - 100)
-                    end = min(len(doc.content), match_index + len(query) + 100)
-                    content_preview = doc.content[start:end]
-                    
-                    if start > 0:
-                        content_preview = "..." + content_preview
-                    if end < len(doc.content):
-                        content_preview = content_preview + "..."
-                    
-                    results.append({
-                        'id': doc.id,
-                        'filename': doc.filename,
-                        'content_preview': content_preview,
-                        'word_count': doc.word_count,
-                        'created_at': doc.upload_date.isoformat()
-                    })
+                document_snippets = [
+                    dict(snippet, highlighted=highlight_html(snippet['text'], snippet['matches']))
+                    for snippet in snippets.get(document_id, [])
+                ]
+                first = document_snippets[0] if document_snippets else {'text': '', 'highlighted': '', 'matches': []}
+                results.append({
+                    'id': doc.id,
+                    'filename': doc.filename,
+                    'content_preview': first['text'],
+                    'content_highlighted': first['highlighted'],
+                    'matches': first['matches'],
+                    'snippets': document_snippets,
+                    'score': round(score, 4),
+                    'word_count': doc.word_count,
+                    'created_at': doc.upload_date.isoformat()
+                })
 
         return jsonify({
             'status': 'success',
             'results': results,
             'query': query,
-            'total_results': len(results)
+            'page': page,
+            'per_page': per_page,
+            'total_results': total,
+            'has_more': page * per_page < total,
+            'search_backend': search_backend.name if search_backend else None,
+            'fuzzy': expansions is not None,
+            'expanded_terms': expansions,
+            'fuzzy_time_ms': fuzzy_time_ms
         })
 
     except Exception as e:
@@ -587,12 +1307,69 @@ def handle_file_too_large(error):
         'message': 'الملف كبير جداً. الحد الأقصى 16 ميجابايت'
     }), 413
 
+def create_schema():
+    """Create or upgrade the database tables and create the search backend's indexes (idempotent)"""
+    db.create_all()
+    logger.info("✅ تم إنشاء جداول قاعدة البيانات")
+    
+    # Columns and indexes added to tables that an earlier release created
+    for change in upgrade_tables():
+        logger.info(f"🔧 تمت ترقية قاعدة البيانات: {change}")
+    
+    if search_backend:
+        try:
+            search_backend.install()
+            logger.info(f"✅ تم تجهيز محرك البحث {search_backend.name}")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"❌ فشل في تجهيز محرك البحث {search_backend.name}: {e}")
+
+def start_background_services():
+    """
+    Start the ingestion dispatcher and warm the fuzzy vocabulary
+    
+    Never run at import: spawned worker processes re-import this module
+    (as __mp_main__ under python app.py) and must stay side-effect free.
+    """
+    if ingestion_queue:
+        ingestion_queue.start()
+    if fuzzy_vocabulary:
+        fuzzy_vocabulary.warm(app)
+
+@app.cli.command('ingest')
+def run_ingestion():
+    """Process uploaded documents in the foreground (one per deployment)"""
+    if not ingestion_queue:
+        print("❌ طابور المعالجة غير متوفر")
+        return
+    
+    ingestion_queue.start()
+    print("✅ تم تشغيل طابور المعالجة، اضغط Ctrl+C للإيقاف")
+    try:
+        ingestion_queue.join()
+    except KeyboardInterrupt:
+        ingestion_queue.shutdown()
+
+@app.cli.command('init-db')
+def init_database():
+    """Create the database schema, including full-text search tables and indexes"""
+    create_schema()
+    print("✅ تم تجهيز قاعدة البيانات")
+
+@app.cli.command('reindex')
+def reindex_documents():
+    """Rebuild the inverted index for all stored documents"""
+    count = search_index.rebuild(document_processor)
+    print(f"✅ تمت إعادة فهرسة {count} مستند")
+    if semantic_index:
+        count = semantic_index.rebuild()
+        print(f"✅ تم تضمين {count} مستند في فهرس المتجهات")
+
 if __name__ == '__main__':
     # Create database tables
     with app.app_context():
         try:
-            db.create_all()
-            logger.info("✅ تم إنشاء جداول قاعدة البيانات")
+            create_schema()
         except Exception as e:
             logger.error(f"❌ خطأ في إنشاء الجداول: {e}")
 
@@ -600,6 +1377,10 @@ if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV') == 'development'
     
+    # Single-process development server: the queue runs here (in the reloader's child only)
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
+    
     logger.info(f"🚀 بدء تشغيل المدرس AI المحسن على المنفذ {port}")
     
     app.run(
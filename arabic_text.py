@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Arabic Text Normalization
+تطبيق المدرس AI المحسن - توحيد النص العربي وتقطيعه
+
+Author: Teacher AI Enhanced Team
+Version: 2.0.0
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Dict, Iterator, List, Tuple
+
+# Tashkeel (harakat, tanween, shadda, sukun), superscript alef and tatweel
+DIACRITICS = ''.join(chr(code) for code in range(0x064B, 0x0653)) + 'ٰ' + 'ـ'
+
+# Display-safe fixes: unify letters that PDF/Word exports write with Persian code points
+ORTHOGRAPHY_TABLE = str.maketrans({
+    'ی': 'ي',  # Farsi Yeh -> Yeh
+    'ک': 'ك',  # Keheh -> Kaf
+    'ـ': None,  # Tatweel
+})
+
+# Arabic Presentation Forms-A (U+FB50-FDFF) and -B (U+FE70-FEFF) folded to base letters;
+# unlike a full NFKC pass this leaves ligatures, superscripts and full-width Latin untouched
+PRESENTATION_FORMS_TABLE = {
+    code: unicodedata.normalize('NFKC', chr(code)).translate(ORTHOGRAPHY_TABLE)
+    for code in (*range(0xFB50, 0xFE00), *range(0xFE70, 0xFF00))
+    if unicodedata.normalize('NFKC', chr(code)) != chr(code)
+}
+
+# Ingest-time cleanup in a single pass
+CLEAN_TABLE = {**PRESENTATION_FORMS_TABLE, **ORTHOGRAPHY_TABLE}
+
+# Search normalization: fold letter variants so that spelling differences still match
+SEARCH_TABLE = str.maketrans({
+    **{char: None for char in DIACRITICS},
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و',
+    'ة': 'ه',
+    'ی': 'ي', 'ک': 'ك',
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},  # Arabic-Indic digits
+    **{chr(0x06F0 + digit): str(digit) for digit in range(10)},  # Extended Arabic-Indic digits
+})
+
+# Word characters plus combining Arabic marks, so vocalized words are not split
+TOKEN_PATTERN = re.compile(r'[\w\u064B-\u0652\u0670\u0640]+', re.UNICODE)
+
+# Light stemming affixes (Light10), longest first; already in normalized form
+PREFIXES = ('وال', 'بال', 'كال', 'فال', 'لل', 'ال')
+SUFFIXES = ('ها', 'ان', 'ات', 'ون', 'ين', 'يه', 'ه', 'ي')
+
+# Function words that carry no retrieval value; already in normalized form
+STOPWORDS = frozenset({
+    'في', 'من', 'الي', 'علي', 'عن', 'مع', 'ما', 'ماذا', 'هل', 'هو', 'هي', 'هم', 'انا', 'انت',
+    'هذا', 'هذه', 'ذلك', 'تلك', 'التي', 'الذي', 'الذين', 'او', 'ام', 'ثم', 'لا', 'لم', 'لن',
+    'قد', 'كان', 'كانت', 'ان', 'اذا', 'كل', 'بين', 'حتي', 'عند', 'بعد', 'قبل', 'كيف', 'لماذا',
+    'the', 'a', 'an', 'of', 'to', 'in', 'on', 'and', 'or', 'is', 'are', 'what', 'how', 'why',
+})
+
+# Arabic block, used to estimate the denser tokenization of Arabic script
+ARABIC_CHAR_PATTERN = re.compile(r'[\u0600-\u06FF]')
+
+def token_weight(text: str) -> float:
+    """
+    Unrounded token estimate of a text
+    
+    Calibrated for BPE tokenizers: Arabic script averages about 2.5
+    characters per token, Latin text about 4. Weights of consecutive
+    pieces add up to the weight of their concatenation.
+    """
+    arabic_chars = len(ARABIC_CHAR_PATTERN.findall(text))
+    return arabic_chars / 2.5 + (len(text) - arabic_chars) / 4
+
+def estimate_tokens(text: str) -> int:
+    """Estimate LLM tokens of a text (see token_weight)"""
+    if not text:
+        return 0
+    
+    return max(1, int(token_weight(text)))
+
+def clean_text(text: str) -> str:
+    """
+    Display-safe cleanup applied once at ingest time
+    
+    Folds Arabic presentation forms (common in PDF extraction) back to
+    base letters and unifies Persian letter variants, keeping diacritics.
+    """
+    if not text:
+        return text
+    
+    return text.translate(CLEAN_TABLE)
+
+def normalize(text: str) -> str:
+    """Normalize text for matching (letter folding, no diacritics, lowercase)"""
+    if not text:
+        return ""
+    
+    return unicodedata.normalize('NFKC', text).translate(SEARCH_TABLE).lower()
+
+@lru_cache(maxsize=65536)
+def stem(token: str) -> str:
+    """Light stemming: strip one common prefix and one common suffix"""
+    if len(token) > 3 and token.startswith('و'):
+        token = token[1:]
+    
+    for prefix in PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            token = token[len(prefix):]
+            break
+    
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 2:
+            token = token[:-len(suffix)]
+            break
+    
+    return token
+
+def tokenize(text: str, min_length: int = 2) -> List[str]:
+    """Normalize, split and stem text into index terms"""
+    return [
+        stem(token) for token in TOKEN_PATTERN.findall(normalize(text))
+        if len(token) >= min_length and token not in STOPWORDS
+    ]
+
+def iter_terms(text: str, min_length: int = 2) -> Iterator[Tuple[str, int, int]]:
+    """
+    Yield (term, start, end) for each word of the original text
+    
+    Offsets point into the unnormalized text, so callers can cut previews
+    and highlight matches without rescanning a normalized copy.
+    """
+    for match in TOKEN_PATTERN.finditer(text or ""):
+        token = normalize(match.group())
+        if len(token) >= min_length and token not in STOPWORDS:
+            yield stem(token), match.start(), match.end()
+
+# Letters by script, counted on bounded samples for language statistics
+LETTER_PATTERN = re.compile(r'[^\W\d_]')
+ARABIC_LETTER_PATTERN = re.compile(r'[\u0620-\u064A\u066E-\u06D3\u06D5\u06EE-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFC]')
+LATIN_LETTER_PATTERN = re.compile(r'[A-Za-z\u00C0-\u024F]')
+
+# Characters sampled from a text (as windows spread over it) and the Arabic share marking it Arabic
+SCRIPT_SAMPLE_CHARS = 8000
+SCRIPT_SAMPLE_WINDOWS = 8
+ARABIC_LANGUAGE_RATIO = 0.3
+CONFIDENT_SAMPLE_LETTERS = 100
+
+def sample_text(text: str, max_chars: int = SCRIPT_SAMPLE_CHARS, windows: int = SCRIPT_SAMPLE_WINDOWS) -> str:
+    """Bounded sample of a text: the whole text, or windows spread from its start to its end"""
+    if len(text) <= max_chars:
+        return text
+    
+    window = max_chars // windows
+    step = (len(text) - window) // (windows - 1)
+    return '\n'.join(text[start:start + window] for start in range(0, step * windows, step))
+
+def script_stats(text: str, max_chars: int = SCRIPT_SAMPLE_CHARS) -> Dict:
+    """
+    Share of Arabic, Latin and other letters in a text, and the language they suggest
+    
+    Only a bounded sample is counted, so the cost does not grow with the
+    document. The language is 'ar' when more than 30% of the letters are
+    Arabic, otherwise 'en' when Latin letters dominate; 'other' and
+    'unknown' (no letters) cover the rest. The confidence is the share of
+    letters in the detected script, scaled down for samples of fewer than
+    100 letters.
+    
+    Returns:
+        Dict with 'language', 'confidence', 'ratios' (per script) and 'letters' (sampled)
+    """
+    sample = sample_text(text or "", max_chars)
+    letters = len(LETTER_PATTERN.findall(sample))
+    if not letters:
+        return {'language': 'unknown', 'confidence': 0.0, 'ratios': {'arabic': 0.0, 'latin': 0.0, 'other': 0.0}, 'letters': 0}
+    
+    arabic = len(ARABIC_LETTER_PATTERN.findall(sample)) / letters
+    latin = len(LATIN_LETTER_PATTERN.findall(sample)) / letters
+    other = max(0.0, 1.0 - arabic - latin)
+    
+    if arabic > ARABIC_LANGUAGE_RATIO:
+        language, share = 'ar', arabic
+    elif latin >= other:
+        language, share = 'en', latin
+    else:
+        language, share = 'other', other
+    
+    return {
+        'language': language,
+        'confidence': round(share * min(1.0, letters / CONFIDENT_SAMPLE_LETTERS), 3),
+        'ratios': {'arabic': round(arabic, 3), 'latin': round(latin, 3), 'other': round(other, 3)},
+        'letters': letters
+    }
+
+def is_arabic(text: str) -> bool:
+    """Whether more than 30% of the (sampled) letters of a text are Arabic"""
+    return script_stats(text)['language'] == 'ar'
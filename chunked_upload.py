@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Resumable Chunked Uploads
+تطبيق المدرس AI المحسن - الرفع المجزأ القابل للاستئناف
+
+Author: Teacher AI Enhanced Team
+Version: 2.0.0
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Optional
+
+# Inter-process lock on a session's data file (POSIX only)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from file_store import ContentStore, HASH_BUFFER_SIZE
+from document_processor import sniff_mime_type, MIME_SNIFF_BYTES
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Session ids are generated by create() (uuid4 hex); anything else never reaches the filesystem
+UPLOAD_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+# Extensions whose content has a recognizable signature, and the types it may sniff as
+EXPECTED_MIME_TYPES = {
+    'pdf': {'application/pdf'},
+    'docx': {'application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'application/zip'},
+    'odt': {'application/zip'},
+    'doc': {'application/msword'},
+    'rtf': {'application/rtf'},
+}
+
+class UploadError(Exception):
+    """Rejected chunked upload request (message is shown to the user)"""
+    
+    def __init__(self, message: str, status_code: int = 400, offset: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset  # bytes received so far, for the client to resume from
+
+class ChunkedUploadStore:
+    """
+    Upload sessions written chunk by chunk to a temporary file
+    
+    A session is a temporary file plus a small JSON state file, so it
+    survives restarts and can be continued by any worker process. Chunks
+    must arrive in order (PUT at the current offset); a request that breaks
+    off midway is simply repeated from the last acknowledged offset, and
+    requests on one session are serialized across threads and worker
+    processes by an exclusive flock on its data file. The
+    SHA-256 digest is updated as chunks arrive (and recomputed from the file
+    by a process that did not see the earlier chunks), and the MIME type is
+    sniffed as soon as the first bytes are in. Memory per request is bounded
+    by the read buffer.
+    """
+    
+    def __init__(self, content_store: ContentStore, chunk_size: int = 8 * 1024 * 1024,
+                 max_size: int = 200 * 1024 * 1024, session_timeout: float = 24 * 3600):
+        """
+        Initialize the store
+        
+        Args:
+            content_store: Store receiving finished uploads
+            chunk_size: Largest chunk accepted per request
+            max_size: Largest file accepted
+            session_timeout: Seconds an idle session is kept before it is purged
+        """
+        self.content_store = content_store
+        self.root = os.path.join(content_store.root, '.uploads')
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.session_timeout = session_timeout
+        
+        self._hashers: Dict[str, tuple] = {}  # upload_id -> (offset, sha256 object)
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        
+        os.makedirs(self.root, exist_ok=True)
+    
+    def create(self, filename: str, original_filename: str, size: int) -> Dict:
+        """Open a session for a file of the announced size"""
+        if size <= 0:
+            raise UploadError("الملف فارغ")
+        if size > self.max_size:
+            # Only announced, nothing sent yet: a bad request rather than 413
+            raise UploadError(f"الملف كبير جداً. الحد الأقصى {self.max_size // (1024 * 1024)} ميجابايت")
+        
+        self.purge_expired()
+        
+        upload_id = uuid.uuid4().hex
+        state = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'original_filename': original_filename,
+            'extension': filename.rsplit('.', 1)[1].lower() if '.' in filename else '',
+            'size': size,
+            'offset': 0,
+            'mime_type': None
+        }
+        open(self._data_path(upload_id), 'wb').close()
+        self._save_state(state)
+        self._hashers[upload_id] = (0, hashlib.sha256())
+        
+        logger.info(f"📦 بدء رفع مجزأ {upload_id}: {filename} ({size} بايت)")
+        return state
+    
+    def status(self, upload_id: str) -> Dict:
+        """Current state of a session (the offset to resume from)"""
+        return self._load_state(upload_id)
+    
+    def write_chunk(self, upload_id: str, offset: int, stream: BinaryIO) -> Dict:
+        """
+        Append one chunk read from a request body stream
+        
+        Args:
+            upload_id: Session id
+            offset: Position of the chunk in the file; must equal the bytes received so far
+            stream: Request body stream
+        
+        Returns:
+            Updated session state
+        """
+        with self._lock_for(upload_id):
+            state = self._load_state(upload_id)
+            if offset != state['offset']:
+                raise UploadError("موضع الجزء غير متوقع", 409, offset=state['offset'])
+            
+            hasher = self._hasher_at(upload_id, state['offset']).copy()
+            limit = min(self.chunk_size, state['size'] - offset)
+            written = 0
+            
+            with open(self._data_path(upload_id), 'r+b') as data_file:
+                data_file.seek(offset)
+                for block in iter(lambda: stream.read(HASH_BUFFER_SIZE), b''):
+                    written += len(block)
+                    if written > limit:
+                        raise UploadError("حجم الجزء أكبر من المسموح", 413, offset=state['offset'])
+                    data_file.write(block)
+                    hasher.update(block)
+            
+            # Only a fully received chunk moves the offset (and the digest) forward
+            state['offset'] = offset + written
+            self._hashers[upload_id] = (state['offset'], hasher)
+            
+            if state['mime_type'] is None and (state['offset'] >= MIME_SNIFF_BYTES or state['offset'] == state['size']):
+                state['mime_type'] = self._sniff(upload_id, state)
+            
+            self._save_state(state)
+            return state
+    
+    def complete(self, upload_id: str) -> Dict:
+        """
+        Move a fully received file into the content store
+        
+        Returns:
+            Dict with 'filename', 'original_filename', 'file_path',
+            'content_hash', 'file_size' and 'mime_type'
+        """
+        with self._lock_for(upload_id):
+            state = self._load_state(upload_id)
+            if state['offset'] != state['size']:
+                raise UploadError("لم يكتمل رفع الملف بعد", 409, offset=state['offset'])
+            
+            data_path = self._data_path(upload_id)
+            with open(data_path, 'r+b') as data_file:
+                data_file.truncate(state['size'])  # bytes of an interrupted, repeated chunk
+            
+            content_hash = self._hasher_at(upload_id, state['offset']).hexdigest()
+            file_path = self.content_store.adopt(data_path, content_hash, state['extension'])
+            self._forget(upload_id)
+            
+            logger.info(f"✅ اكتمل الرفع المجزأ {upload_id}: {state['filename']}")
+            return {
+                'filename': state['filename'],
+                'original_filename': state['original_filename'],
+                'file_path': file_path,
+                'content_hash': content_hash,
+                'file_size': state['size'],
+                'mime_type': state['mime_type']
+            }
+    
+    def abort(self, upload_id: str):
+        """Discard a session and its data"""
+        with self._lock_for(upload_id):
+            self._load_state(upload_id)
+            self._forget(upload_id)
+    
+    def purge_expired(self):
+        """Remove sessions that have been idle longer than the session timeout"""
+        cutoff = time.time() - self.session_timeout
+        for entry in os.scandir(self.root):
+            if entry.name.endswith('.json') and entry.stat().st_mtime < cutoff:
+                self._forget(entry.name[:-len('.json')])
+                logger.info(f"🧹 تم حذف جلسة رفع منتهية: {entry.name}")
+    
+    def _sniff(self, upload_id: str, state: Dict) -> str:
+        """Sniff the MIME type from the first bytes and check it against the extension"""
+        with open(self._data_path(upload_id), 'rb') as data_file:
+            mime_type = sniff_mime_type(data_file.read(MIME_SNIFF_BYTES))
+        
+        expected = EXPECTED_MIME_TYPES.get(state['extension'])
+        if expected and mime_type not in expected:
+            self._forget(upload_id)
+            raise UploadError(f"محتوى الملف لا يطابق امتداده ({mime_type})", 415)
+        return mime_type
+    
+    def _hasher_at(self, upload_id: str, offset: int):
+        """SHA-256 object over the first offset bytes (rehashed from disk when not in memory)"""
+        cached = self._hashers.get(upload_id)
+        if cached and cached[0] == offset:
+            return cached[1]
+        
+        hasher = hashlib.sha256()
+        remaining = offset
+        with open(self._data_path(upload_id), 'rb') as data_file:
+            while remaining:
+                block = data_file.read(min(HASH_BUFFER_SIZE, remaining))
+                if not block:
+                    break
+                hasher.update(block)
+                remaining -= len(block)
+        
+        self._hashers[upload_id] = (offset, hasher)
+        return hasher
+    
+    @contextmanager
+    def _lock_for(self, upload_id: str):
+        """
+        Hold a session exclusively
+        
+        The thread lock serializes requests within this process; the flock
+        on the data file serializes them across worker processes. Without
+        fcntl (Windows) only the thread lock applies, so a single worker
+        process must serve the upload routes.
+        """
+        if not UPLOAD_ID_PATTERN.fullmatch(upload_id):
+            raise UploadError("جلسة الرفع غير موجودة أو منتهية", 404)
+        
+        with self._locks_guard:
+            thread_lock = self._locks.setdefault(upload_id, threading.Lock())
+        
+        with thread_lock:
+            try:
+                # The data file is never replaced while the session lives, unlike the state file
+                lock_file = open(self._data_path(upload_id), 'rb')
+            except FileNotFoundError:
+                raise UploadError("جلسة الرفع غير موجودة أو منتهية", 404)
+            
+            with lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+    
+    def _forget(self, upload_id: str):
+        """Delete a session's files and in-memory state"""
+        for path in (self._data_path(upload_id), self._state_path(upload_id)):
+            if os.path.exists(path):
+                os.remove(path)
+        self._hashers.pop(upload_id, None)
+        with self._locks_guard:
+            self._locks.pop(upload_id, None)
+    
+    def _load_state(self, upload_id: str) -> Dict:
+        """Read a session's state file"""
+        if not UPLOAD_ID_PATTERN.fullmatch(upload_id):
+            raise UploadError("جلسة الرفع غير موجودة أو منتهية", 404)
+        
+        try:
+            with open(self._state_path(upload_id), 'r', encoding='utf-8') as state_file:
+                return json.load(state_file)
+        except (FileNotFoundError, ValueError):
+            raise UploadError("جلسة الرفع غير موجودة أو منتهية", 404)
+    
+    def _save_state(self, state: Dict):
+        """Write a session's state file atomically"""
+        path = self._state_path(state['upload_id'])
+        with open(path + '.tmp', 'w', encoding='utf-8') as state_file:
+            json.dump(state, state_file, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+    
+    def _data_path(self, upload_id: str) -> str:
+        return os.path.join(self.root, f"{upload_id}.part")
+    
+    def _state_path(self, upload_id: str) -> str:
+        return os.path.join(self.root, f"{upload_id}.json")
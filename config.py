@@ -35,6 +35,9 @@ class Config:
     UPLOAD_FOLDER = 'uploads'
     STATIC_UPLOAD_FOLDER = 'static/uploads'
     ALLOWED_EXTENSIONS = {'txt', 'pdf', 'doc', 'docx', 'rtf', 'odt'}
+    CHUNKED_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # largest body of one PUT /api/uploads/<id>
+    CHUNKED_UPLOAD_MAX_SIZE = 200 * 1024 * 1024  # files above MAX_CONTENT_LENGTH go through /api/uploads
+    UPLOAD_SESSION_TIMEOUT = 24 * 3600  # seconds an unfinished chunked upload is kept
     
     # Security Configuration
     WTF_CSRF_ENABLED = True
@@ -49,6 +52,17 @@ class Config:
     ANTHROPIC_API_KEY = os.environ.get('ANTHROPIC_API_KEY')
     OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-3.5-turbo')
     ANTHROPIC_MODEL = os.environ.get('ANTHROPIC_MODEL', 'claude-3-sonnet-20240229')
+    AI_ASYNC_ENGINE = os.environ.get('AI_ASYNC_ENGINE', 'false').lower() == 'true'  # use the asyncio provider path in /api/chat
+    AI_PROVIDER_TIMEOUT = float(os.environ.get('AI_PROVIDER_TIMEOUT', 30))  # read by TeacherAIEngine
+    AI_HEDGE_DELAY = float(os.environ.get('AI_HEDGE_DELAY', 0))  # read by TeacherAIEngine, 0 disables hedging
+    AI_BREAKER_WINDOW = int(os.environ.get('AI_BREAKER_WINDOW', 20))  # calls in the circuit breaker window
+    AI_BREAKER_ERROR_THRESHOLD = float(os.environ.get('AI_BREAKER_ERROR_THRESHOLD', 0.5))  # error rate that opens a circuit
+    AI_BREAKER_OPEN_SECONDS = float(os.environ.get('AI_BREAKER_OPEN_SECONDS', 30))  # seconds before a half-open probe
+    AI_MAX_INPUT_TOKENS = int(os.environ.get('AI_MAX_INPUT_TOKENS', 12000))  # prompt budget: system, history, context, question
+    AI_MAX_HISTORY_TOKENS = int(os.environ.get('AI_MAX_HISTORY_TOKENS', 1500))  # share of the budget for earlier turns
+    CHAT_HISTORY_MESSAGES = 6  # recent messages loaded from the database for each chat turn
+    CHAT_SUMMARY_INTERVAL = 10  # older messages folded into the session summary at a time
+    CHAT_SUMMARY_MAX_TOKENS = 400
     
     # Arabic Language Support
     DEFAULT_LANGUAGE = 'ar'
@@ -70,6 +84,7 @@ class Config:
     CACHE_TYPE = os.environ.get('CACHE_TYPE', 'simple')
     CACHE_DEFAULT_TIMEOUT = 300
     REDIS_URL = os.environ.get('REDIS_URL')
+    RESPONSE_CACHE_MAX_ENTRIES = 1000  # in-process LRU size for AI responses
     
     # Rate Limiting
     RATELIMIT_STORAGE_URL = os.environ.get('REDIS_URL', 'memory://')
@@ -109,6 +124,18 @@ class Config:
         'text/rtf',
         'application/rtf'
     ]
+    CHUNK_MAX_TOKENS = 300  # passage size used for retrieval and prompt context
+    PDF_EXTRACTION_WORKERS = int(os.environ.get('PDF_EXTRACTION_WORKERS', os.cpu_count() or 1))
+    PDF_PARALLEL_MIN_PAGES = 40  # smaller PDFs are extracted serially
+    OCR_WORKERS = int(os.environ.get('OCR_WORKERS', os.cpu_count() or 1))  # processes OCR-ing scanned pages
+    OCR_LANGUAGES = os.environ.get('OCR_LANGUAGES', 'ara+eng')  # Tesseract languages
+    OCR_MIN_PAGE_CHARS = 20  # pages with a shorter text layer are OCR'd
+    OCR_PAGE_TIMEOUT = 60  # seconds Tesseract may spend on one page
+    OCR_RESOLUTION = 300  # DPI of rendered pages
+    OCR_CACHE_FOLDER = os.environ.get('OCR_CACHE_FOLDER', 'ocr_cache')  # OCR text per (file hash, page)
+    INGESTION_WORKERS = int(os.environ.get('INGESTION_WORKERS', 2))  # background extraction processes
+    INGESTION_POLL_INTERVAL = 5  # seconds between scans for pending documents
+    INGESTION_STALE_TIMEOUT = 1800  # seconds before a 'processing' document of a dead worker is requeued
     
     # AI Response Configuration
     MAX_RESPONSE_LENGTH = 4000
@@ -118,9 +145,17 @@ class Config:
     RESPONSE_TEMPERATURE = 0.7
     
     # Search Configuration
-    SEARCH_RESULTS_LIMIT = 20
+    SEARCH_RESULTS_LIMIT = 20  # results per page of /api/search
+    SEARCH_MAX_SNIPPETS = 10  # upper bound of the 'snippets' field of /api/search
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto')  # auto: SQLite FTS5 / PostgreSQL tsvector, index: BM25 postings
     SEARCH_MIN_QUERY_LENGTH = 2
     ENABLE_FUZZY_SEARCH = True
+    FUZZY_SEARCH_BUDGET_MS = 50  # time allowed for typo-tolerant term expansion per query
+    SEMANTIC_RETRIEVAL = os.environ.get('SEMANTIC_RETRIEVAL', 'off')  # off, semantic or hybrid chat context retrieval
+    SEMANTIC_MODEL = os.environ.get('SEMANTIC_MODEL', 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
+    SEMANTIC_INDEX_FOLDER = os.environ.get('SEMANTIC_INDEX_FOLDER', 'vector_index')
+    SEMANTIC_VECTOR_DTYPE = 'float16'  # float16 halves the mapped matrix, float32 scores without widening
+    SEMANTIC_HYBRID_WEIGHT = 0.5  # share of the cosine score in hybrid ranking
     
     # Performance Settings
     LAZY_LOADING = True
@@ -10,7 +10,9 @@ Version: 2.0.0
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Boolean, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Boolean, JSON, inspect, text
+from sqlalchemy.orm import deferred
+from sqlalchemy.schema import CreateTable
 import uuid
 import json
 
@@ -25,6 +27,10 @@ def init_db(app):
 class Document(db.Model):
     """Document model for uploaded files"""
     __tablename__ = 'documents'
+    __table_args__ = (
+        # Keyset pagination of the document listing (newest first, id as tie-breaker)
+        db.Index('ix_documents_upload_date_id', 'upload_date', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     filename = Column(String(255), nullable=False, index=True)
@@ -34,10 +40,12 @@ class Document(db.Model):
     mime_type = Column(String(100), nullable=True)
     
     # Content and processing
-    content = Column(Text, nullable=True)
-    content_hash = Column(String(64), nullable=True, index=True)
+    # Large text is deferred (group 'content'): loaded only when a code path reads it
+    content = deferred(Column(Text, nullable=True), group='content')
+    content_hash = Column(String(64), nullable=True, unique=True, index=True)  # one document per distinct content
     word_count = Column(Integer, default=0)
-    language = Column(String(10), default='ar')
+    language = Column(String(10), default='ar')  # ar, en, other or unknown, detected at ingestion
+    language_stats = Column(JSON, nullable=True)  # per-script letter ratios and detection confidence
     
     # Metadata
     upload_date = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
@@ -47,12 +55,17 @@ class Document(db.Model):
     # Processing status
     processing_status = Column(String(20), default='pending')  # pending, processing, completed, failed
     processing_error = Column(Text, nullable=True)
+    processing_started = Column(DateTime, nullable=True)  # claim time, to reclaim rows of dead workers
     
     # Document classification
     document_type = Column(String(50), nullable=True)  # book, notes, assignment, etc.
     subject = Column(String(100), nullable=True)
     tags = Column(JSON, nullable=True)
     
+    # Relationships
+    chunks = db.relationship('DocumentChunk', backref='document', lazy='dynamic', cascade='all, delete-orphan')
+    postings = db.relationship('IndexPosting', backref='document', lazy='dynamic', cascade='all, delete-orphan')
+    
     def __init__(self, filename, original_filename, file_path, file_size, **kwargs):
         self.filename = filename
         self.original_filename = original_filename
@@ -73,6 +86,7 @@ class Document(db.Model):
             'mime_type': self.mime_type,
             'word_count': self.word_count,
             'language': self.language,
+            'language_stats': self.language_stats,
             'upload_date': self.upload_date.isoformat() if self.upload_date else None,
             'last_accessed': self.last_accessed.isoformat() if self.last_accessed else None,
             'access_count': self.access_count,
@@ -91,6 +105,71 @@ class Document(db.Model):
     def __repr__(self):
         return f'<Document {self.filename}>'
 
+class DocumentChunk(db.Model):
+    """Passage of a document used for retrieval and prompt context"""
+    __tablename__ = 'document_chunks'
+    
+    id = Column(Integer, primary_key=True)
+    document_id = Column(Integer, db.ForeignKey('documents.id'), nullable=False, index=True)
+    chunk_index = Column(Integer, nullable=False)  # position of the chunk inside the document
+    offset = Column(Integer, nullable=False)  # character offset in the extracted text
+    page = Column(Integer, nullable=True)  # 1-based source page (None for unpaginated formats)
+    text = Column(Text, nullable=False)
+    token_count = Column(Integer, nullable=False, default=0)
+    
+    # Normalized, stemmed index terms joined by spaces; source of the database full-text index
+    search_text = deferred(Column(Text, nullable=True))
+    
+    # Relationships
+    postings = db.relationship('IndexPosting', backref='chunk', lazy='dynamic')
+    
+    def __init__(self, document_id, chunk_index, offset, text, token_count=0, search_text=None, page=None):
+        self.document_id = document_id
+        self.chunk_index = chunk_index
+        self.offset = offset
+        self.page = page
+        self.text = text
+        self.token_count = token_count
+        self.search_text = search_text
+    
+    def to_dict(self):
+        """Convert chunk to dictionary"""
+        return {
+            'id': self.id,
+            'document_id': self.document_id,
+            'chunk_index': self.chunk_index,
+            'offset': self.offset,
+            'page': self.page,
+            'text': self.text,
+            'token_count': self.token_count
+        }
+    
+    def __repr__(self):
+        return f'<DocumentChunk {self.document_id}#{self.chunk_index}>'
+
+class IndexPosting(db.Model):
+    """Inverted index posting: occurrences of a term in a document chunk"""
+    __tablename__ = 'index_postings'
+    
+    __table_args__ = {'sqlite_autoincrement': True}  # ids are the fuzzy vocabulary's refresh watermark, never reuse them
+    
+    id = Column(Integer, primary_key=True)
+    term = Column(String(100), nullable=False, index=True)
+    chunk_id = Column(Integer, db.ForeignKey('document_chunks.id'), nullable=False, index=True)
+    document_id = Column(Integer, db.ForeignKey('documents.id'), nullable=False, index=True)
+    term_frequency = Column(Integer, nullable=False, default=1)
+    positions = Column(Text, nullable=True)  # "start:length" of each occurrence in the chunk text, space separated
+    
+    def __init__(self, term, chunk_id, document_id, term_frequency=1, positions=None):
+        self.term = term
+        self.chunk_id = chunk_id
+        self.document_id = document_id
+        self.term_frequency = term_frequency
+        self.positions = positions
+    
+    def __repr__(self):
+        return f'<IndexPosting {self.term} -> {self.chunk_id} ({self.term_frequency})>'
+
 class ChatSession(db.Model):
     """Chat session model"""
     __tablename__ = 'chat_sessions'
@@ -107,6 +186,10 @@ class ChatSession(db.Model):
     language = Column(String(10), default='ar')
     voice_settings = Column(JSON, nullable=True)
     
+    # Rolling summary of older turns (messages up to summarized_until are folded in)
+    summary = Column(Text, nullable=True)
+    summarized_until = Column(Integer, nullable=True)
+    
     # Session status
     is_active = Column(Boolean, default=True)
     is_archived = Column(Boolean, default=False)
@@ -130,6 +213,7 @@ class ChatSession(db.Model):
             'message_count': self.message_count,
             'language': self.language,
             'voice_settings': self.voice_settings,
+            'summary': self.summary,
             'is_active': self.is_active,
             'is_archived': self.is_archived
         }
@@ -163,6 +247,10 @@ class ChatSession(db.Model):
 class ChatMessage(db.Model):
     """Chat message model"""
     __tablename__ = 'chat_messages'
+    __table_args__ = (
+        # Serves the bounded "latest messages of a session" history query
+        db.Index('ix_chat_messages_session_id_id', 'session_id', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     session_id = Column(String(36), db.ForeignKey('chat_sessions.id'), nullable=False, index=True)
@@ -180,6 +268,12 @@ class ChatMessage(db.Model):
     response_time = Column(Float, nullable=True)  # in seconds
     model_used = Column(String(50), nullable=True)
     
+    # Provider token usage (cache read/write are prompt-caching tokens)
+    input_tokens = Column(Integer, nullable=True)
+    output_tokens = Column(Integer, nullable=True)
+    cache_read_tokens = Column(Integer, nullable=True)
+    cache_write_tokens = Column(Integer, nullable=True)
+    
     # Sources and context
     sources = Column(JSON, nullable=True)  # List of source documents
     context_used = Column(Text, nullable=True)
@@ -214,6 +308,10 @@ class ChatMessage(db.Model):
             'confidence': self.confidence,
             'response_time': self.response_time,
             'model_used': self.model_used,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'cache_read_tokens': self.cache_read_tokens,
+            'cache_write_tokens': self.cache_write_tokens,
             'sources': self.sources,
             'was_spoken': self.was_spoken,
             'speech_settings': self.speech_settings,
@@ -382,6 +480,98 @@ def create_tables():
     """Create all database tables"""
     db.create_all()
 
+def upgrade_tables():
+    """
+    Bring tables created by an earlier release up to the current models (idempotent)
+    
+    db.create_all() creates missing tables but never alters existing ones,
+    so columns and indexes added to a model since are created here: every
+    column added to an existing table is nullable, so ADD COLUMN needs no
+    backfill. SQLite tables that now need AUTOINCREMENT (index_postings)
+    are rebuilt with their rows, as SQLite cannot add it in place. Run
+    after create_tables() (flask init-db).
+    
+    Returns:
+        Descriptions of the changes applied
+    """
+    changes = []
+    with db.engine.begin() as connection:
+        inspector = inspect(connection)
+        quote = connection.dialect.identifier_preparer.quote
+        
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            
+            if _needs_sqlite_autoincrement(connection, table):
+                _rebuild_sqlite_table(connection, table, inspector)
+                changes.append(f"autoincrement {table.name}")
+                continue
+            
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                if not column.nullable:
+                    raise RuntimeError(f"Column {table.name}.{column.name} is NOT NULL and cannot be added in place")
+                
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(
+                    f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}"
+                ))
+                changes.append(f"column {table.name}.{column.name}")
+            
+            existing_indexes = {index['name']: index for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                existing = existing_indexes.get(index.name)
+                if existing is not None and bool(existing['unique']) == bool(index.unique):
+                    continue
+                
+                if existing is not None:
+                    # Index made unique after release (documents.content_hash): duplicates must be merged first
+                    duplicates = connection.execute(text(
+                        f"SELECT count(*) FROM (SELECT 1 FROM {quote(table.name)} "
+                        f"WHERE {' AND '.join(f'{quote(column.name)} IS NOT NULL' for column in index.columns)} "
+                        f"GROUP BY {', '.join(quote(column.name) for column in index.columns)} HAVING count(*) > 1) AS duplicated"
+                    )).scalar() if index.unique else 0
+                    if duplicates:
+                        raise RuntimeError(
+                            f"{duplicates} duplicated values in {table.name} block the unique index {index.name}"
+                        )
+                    index.drop(connection)
+                
+                index.create(connection)
+                changes.append(f"index {index.name}")
+    
+    return changes
+
+def _needs_sqlite_autoincrement(connection, table):
+    """Whether an existing SQLite table lacks the AUTOINCREMENT its model asks for"""
+    if connection.dialect.name != 'sqlite' or not table.dialect_options['sqlite']['autoincrement']:
+        return False
+    
+    sql = connection.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': table.name}
+    ).scalar()
+    return 'AUTOINCREMENT' not in (sql or '').upper()
+
+def _rebuild_sqlite_table(connection, table, inspector):
+    """Recreate a SQLite table from its model, keeping its rows and ids"""
+    quote = connection.dialect.identifier_preparer.quote
+    old_name = f"{table.name}_before_upgrade"
+    columns = ', '.join(
+        quote(column['name']) for column in inspector.get_columns(table.name) if column['name'] in table.columns
+    )
+    
+    connection.execute(text(f"ALTER TABLE {quote(table.name)} RENAME TO {quote(old_name)}"))
+    connection.execute(CreateTable(table))
+    connection.execute(text(
+        f"INSERT INTO {quote(table.name)} ({columns}) SELECT {columns} FROM {quote(old_name)}"
+    ))
+    connection.execute(text(f"DROP TABLE {quote(old_name)}"))
+    for index in table.indexes:
+        index.create(connection)
+
 def drop_tables():
     """Drop all database tables"""
     db.drop_all()
@@ -399,5 +589,7 @@ def get_database_stats():
         'chat_messages': ChatMessage.query.count(),
         'user_settings': UserSettings.query.count(),
         'analytics_events': Analytics.query.count(),
+        'document_chunks': DocumentChunk.query.count(),
+        'index_postings': IndexPosting.query.count(),
         'total_words': db.session.query(db.func.sum(Document.word_count)).scalar() or 0
     }
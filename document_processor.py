@@ -8,13 +8,19 @@ Version: 2.0.0
 """
 
 import os
+import re
+import mmap
+import codecs
 import logging
 import mimetypes
 import hashlib
 from pathlib import Path
-from typing import Optional, Dict, List, Tuple
+from typing import Optional, Dict, List, Tuple, Iterable, Iterator
 import tempfile
 import shutil
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 
 # Document processing libraries
 try:
@@ -41,35 +47,247 @@ except ImportError:
     pytesseract = None
     Image = None
 
-# Arabic text processing
+# Page rendering for OCR (also used by pdfplumber)
 try:
-    import arabic_reshaper
-    from bidi.algorithm import get_display
+    import pypdfium2 as pdfium
 except ImportError:
-    arabic_reshaper = None
-    get_display = None
+    pdfium = None
+
+import arabic_text
+from file_store import HASH_BUFFER_SIZE
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Leading bytes inspected to recognize a file type
+MIME_SNIFF_BYTES = 4096
+
+def sniff_mime_type(header: bytes) -> str:
+    """MIME type recognized from the first bytes of a file (text/plain when unknown)"""
+    # PDF signature
+    if header.startswith(b'%PDF'):
+        return 'application/pdf'
+    
+    # ZIP-based formats: DOCX when its parts are visible this early, otherwise generic (e.g. ODT)
+    if header.startswith(b'PK\x03\x04'):
+        if b'word/' in header:
+            return 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+        return 'application/zip'
+    
+    # DOC signature
+    if header.startswith(b'\xd0\xcf\x11\xe0'):
+        return 'application/msword'
+    
+    # RTF signature
+    if header.startswith(b'{\\rtf'):
+        return 'application/rtf'
+    
+    # Default to text
+    return 'text/plain'
+
+# Byte order marks, longest first (the UTF-32 LE mark starts with the UTF-16 LE one)
+TEXT_BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+
+# Bytes sniffed to detect a text encoding, taken as windows spread over the file
+ENCODING_SAMPLE_BYTES = 64 * 1024
+ENCODING_SAMPLE_WINDOWS = 4
+
+# Single-byte Arabic code pages, told apart by how well the sample reads as Arabic
+ARABIC_CODEPAGES = ('windows-1256', 'iso-8859-6')
+ARABIC_LETTER_PATTERN = re.compile(r'[\u0621-\u064A]')
+CONTROL_CHAR_PATTERN = re.compile(r'[\x80-\x9f]')
+
+# Non-ASCII bytes inside Latin words (accented letters); Arabic words have no ASCII letters
+LATIN_ACCENT_PATTERN = re.compile(rb'[A-Za-z][\x80-\xff]|[\x80-\xff][A-Za-z]')
+
+def detect_text_encoding(data) -> Tuple[str, int]:
+    """
+    Detect the encoding of a text file's bytes without decoding all of them
+    
+    A byte order mark decides on its own. Otherwise a bounded sample
+    (windows spread over the data) is checked for UTF-16 without a mark
+    (one or two byte values, such as 0x06 and 0x00 for Arabic, filling one
+    side of each code unit), then for valid UTF-8, and
+    finally scored as the Arabic code pages: Arabic letters minus C1
+    control characters, plus a bonus for the article "ال" (C7 E1 in
+    windows-1256, C7 E4 in ISO-8859-6). Samples whose non-ASCII bytes
+    sit inside Latin words, or do not read as Arabic, fall back to latin-1.
+    
+    Args:
+        data: File bytes (bytes or an mmap)
+    
+    Returns:
+        Tuple of (codec name, length of the byte order mark to skip)
+    """
+    for bom, encoding in TEXT_BOMS:
+        if data[:len(bom)] == bom:
+            return encoding, len(bom)
+    
+    size = len(data)
+    window = ENCODING_SAMPLE_BYTES // ENCODING_SAMPLE_WINDOWS
+    if size <= ENCODING_SAMPLE_BYTES:
+        samples = [bytes(data[:size])]
+    else:
+        # Even offsets keep UTF-16 code units aligned
+        step = (size - window) // (ENCODING_SAMPLE_WINDOWS - 1)
+        samples = [bytes(data[start:start + window]) for start in range(0, size - window + 1, step & ~1)]
+    
+    # UTF-16 without a byte order mark: the high bytes of the code units are nearly all
+    # the same block (0x06 for Arabic, 0x00 for spaces, digits and Latin), the low bytes vary
+    even_share, even_top = _dominant_byte_share(samples, 0)
+    odd_share, odd_top = _dominant_byte_share(samples, 1)
+    if odd_share >= 0.9 and odd_top < 0x20 and even_share < 0.6:
+        return 'utf-16-le', 0
+    if even_share >= 0.9 and even_top < 0x20 and odd_share < 0.6:
+        return 'utf-16-be', 0
+    
+    if all(_is_utf8_sample(sample, complete=len(samples) == 1) for sample in samples):
+        return 'utf-8', 0
+    
+    sample = b''.join(samples)
+    best_encoding, best_score = 'latin-1', 0
+    high_bytes = sum(1 for byte in sample if byte >= 0x80)
+    if len(LATIN_ACCENT_PATTERN.findall(sample)) > high_bytes * 0.3:
+        return best_encoding, 0
+    for encoding in ARABIC_CODEPAGES:
+        text = sample.decode(encoding, errors='replace')
+        letters = len(ARABIC_LETTER_PATTERN.findall(text))
+        if letters < high_bytes * 0.5:
+            continue  # mostly not Arabic in this code page
+        score = letters + 4 * text.count('ال') - 4 * (len(CONTROL_CHAR_PATTERN.findall(text)) + text.count('\ufffd'))
+        if score > best_score:
+            best_encoding, best_score = encoding, score
+    
+    return best_encoding, 0
+
+def _dominant_byte_share(samples: List[bytes], parity: int) -> Tuple[float, int]:
+    """Share of the two most frequent byte values at even (0) or odd (1) offsets, and the most frequent one"""
+    counts = Counter()
+    for sample in samples:
+        counts.update(sample[parity::2])
+    
+    total = sum(counts.values())
+    if not total:
+        return 0.0, 0
+    top = counts.most_common(2)
+    return sum(count for _, count in top) / total, top[0][0]
+
+def _is_utf8_sample(sample: bytes, complete: bool) -> bool:
+    """Whether a sample is valid UTF-8 (a cut window may start or end inside a character)"""
+    if not complete:
+        # Skip continuation bytes of a character that started before the window
+        skip = 0
+        while skip < 3 and skip < len(sample) and 0x80 <= sample[skip] <= 0xBF:
+            skip += 1
+        sample = sample[skip:]
+    
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=complete)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+# Line-sized segments (with their offsets) used as chunking units
+SEGMENT_PATTERN = re.compile(r'[^\n]+')
+WORD_PATTERN = re.compile(r'\S+')
+
+# Separator written before each page of a paginated document in the stored text
+# (form feed, as pdftotext does), so pages can be recovered from Document.content
+PAGE_BREAK = '\f'
+
+# Paragraph-sized blocks of plain text files
+TEXT_BLOCK_CHARS = 64 * 1024
+
+def block_separator(block: Dict) -> str:
+    """Separator written before a block that is not the first: PAGE_BREAK before pages, a newline otherwise"""
+    return PAGE_BREAK if block.get('page') is not None else '\n'
+
+def join_blocks(blocks: Iterable[Dict]) -> str:
+    """Document text of extracted blocks (see block_separator)"""
+    parts = []
+    for block in blocks:
+        if parts:
+            parts.append(block_separator(block))
+        parts.append(block['text'])
+    return ''.join(parts)
+
+def split_blocks(text: str) -> List[Dict]:
+    """Blocks of a stored document text (inverse of join_blocks for the page structure)"""
+    if PAGE_BREAK in text:
+        return [{'page': number, 'text': page} for number, page in enumerate(text.split(PAGE_BREAK), 1)]
+    return [{'page': None, 'text': text}]
+
+def _extract_pdf_pages(file_path: str, start: int, end: int) -> List[str]:
+    """Extract text of pages [start, end) with pdfplumber (runs in a worker process)"""
+    texts = []
+    with pdfplumber.open(file_path) as pdf:
+        for page in pdf.pages[start:end]:
+            texts.append(page.extract_text() or "")
+            page.flush_cache()
+    return texts
+
+def _ocr_pdf_page(file_path: str, page_index: int, resolution: int, languages: str, timeout: float) -> str:
+    """Render one PDF page and run Tesseract on it (runs in a worker process)"""
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        page = pdf[page_index]
+        image = page.render(scale=resolution / 72).to_pil()
+        page.close()
+    finally:
+        pdf.close()
+    
+    # Tesseract runs as a child process that is killed once the timeout expires
+    return pytesseract.image_to_string(image, lang=languages, timeout=timeout)
+
 class DocumentProcessor:
     """Enhanced document processor with Arabic text support"""
     
-    def __init__(self):
-        """Initialize the document processor"""
+    def __init__(self, chunk_max_tokens: int = 300, pdf_workers: Optional[int] = None, pdf_parallel_min_pages: int = 40,
+                 ocr_workers: Optional[int] = None, ocr_languages: str = 'ara+eng', ocr_min_page_chars: int = 20,
+                 ocr_page_timeout: float = 60, ocr_resolution: int = 300, ocr_cache_dir: Optional[str] = None):
+        """
+        Initialize the document processor
+        
+        Args:
+            chunk_max_tokens: Token budget per retrieval chunk
+            pdf_workers: Processes used for PDF page extraction (defaults to CPU count, 1 disables)
+            pdf_parallel_min_pages: PDFs with fewer pages are extracted serially
+            ocr_workers: Processes used for OCR of scanned pages (defaults to pdf_workers)
+            ocr_languages: Tesseract languages
+            ocr_min_page_chars: Pages whose text layer is shorter than this are OCR'd
+            ocr_page_timeout: Seconds Tesseract may spend on one page
+            ocr_resolution: Rendering resolution (DPI) of OCR'd pages
+            ocr_cache_dir: Folder caching OCR text per (file hash, page); None disables the cache
+        """
+        self.chunk_max_tokens = chunk_max_tokens
+        self.pdf_workers = pdf_workers or os.cpu_count() or 1
+        self.pdf_parallel_min_pages = pdf_parallel_min_pages
+        self.ocr_workers = ocr_workers or self.pdf_workers
+        self.ocr_languages = ocr_languages
+        self.ocr_min_page_chars = ocr_min_page_chars
+        self.ocr_page_timeout = ocr_page_timeout
+        self.ocr_resolution = ocr_resolution
+        self.ocr_cache_dir = ocr_cache_dir
+        self._ocr_ready = None  # Tesseract and its languages checked on first use
+        
+        # MIME type -> generator of {'page', 'text'} blocks
         self.supported_types = {
-            'application/pdf': self._process_pdf,
-            'application/msword': self._process_doc,
-            'application/vnd.openxmlformats-officedocument.wordprocessingml.document': self._process_docx,
-            'text/plain': self._process_txt,
-            'application/rtf': self._process_rtf,
-            'text/rtf': self._process_rtf
+            'application/pdf': self._iter_pdf_blocks,
+            'application/msword': self._single_block(self._process_doc),
+            'application/vnd.openxmlformats-officedocument.wordprocessingml.document': self._iter_docx_blocks,
+            'text/plain': self._iter_txt_blocks,
+            'application/rtf': self._single_block(self._process_rtf),
+            'text/rtf': self._single_block(self._process_rtf)
         }
         
         # Arabic text processing configuration
         self.arabic_config = {
-            'reshape_enabled': arabic_reshaper is not None,
-            'bidi_enabled': get_display is not None,
             'detect_arabic': True,
             'preserve_formatting': True
         }
@@ -84,31 +302,10 @@ class DocumentProcessor:
             file_path: Path to the document file
             
         Returns:
-            Extracted text content
+            Extracted text content (see iter_blocks for a streaming alternative)
         """
         try:
-            if not os.path.exists(file_path):
-                raise FileNotFoundError(f"الملف غير موجود: {file_path}")
-            
-            # Detect MIME type
-            mime_type, _ = mimetypes.guess_type(file_path)
-            if not mime_type:
-                mime_type = self._detect_mime_type(file_path)
-            
-            logger.info(f"🔍 معالجة الملف: {file_path} (النوع: {mime_type})")
-            
-            # Process based on file type
-            if mime_type in self.supported_types:
-                processor = self.supported_types[mime_type]
-                content = processor(file_path)
-            else:
-                # Try as text file
-                content = self._process_txt(file_path)
-            
-            # Enhance Arabic text
-            if content and self._is_arabic_text(content):
-                content = self._enhance_arabic_text(content)
-            
+            content = join_blocks(self.iter_blocks(file_path))
             logger.info(f"✅ تم معالجة الملف بنجاح: {len(content)} حرف")
             return content
             
@@ -116,76 +313,240 @@ class DocumentProcessor:
             logger.error(f"❌ خطأ في معالجة الملف {file_path}: {e}")
             return f"فشل في معالجة الملف: {str(e)}"
     
-    def _process_pdf(self, file_path: str) -> str:
-        """Process PDF files"""
-        content = ""
+    def iter_blocks(self, file_path: str) -> Iterator[Dict]:
+        """
+        Stream the text of a document one page-sized block at a time
+        
+        PDFs yield one block per page (empty pages included, so numbering
+        stays aligned), DOCX files one per paragraph or table row and text
+        files paragraph-sized runs of lines. Arabic blocks are cleaned as
+        they are produced. Extraction errors propagate to the caller.
+        
+        Args:
+            file_path: Path to the document file
+        
+        Yields:
+            Dicts with 'page' (1-based, None for unpaginated formats) and 'text'
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"الملف غير موجود: {file_path}")
+        
+        # Detect MIME type
+        mime_type, _ = mimetypes.guess_type(file_path)
+        if not mime_type:
+            mime_type = self._detect_mime_type(file_path)
+        
+        logger.info(f"🔍 معالجة الملف: {file_path} (النوع: {mime_type})")
+        
+        # Unknown types are tried as text files
+        block_reader = self.supported_types.get(mime_type, self._iter_txt_blocks)
+        for block in block_reader(file_path):
+            text = block['text'].strip()
+            
+            # Enhance Arabic text
+            if text and self._is_arabic_text(text):
+                text = self._enhance_arabic_text(text)
+            
+            if text or block['page'] is not None:
+                yield {'page': block['page'], 'text': text}
+    
+    def chunk_text(self, text: str, max_tokens: Optional[int] = None) -> List[Dict]:
+        """
+        Split extracted text into passages for retrieval
+        
+        Args:
+            text: Extracted document text (pages separated by PAGE_BREAK)
+            max_tokens: Token budget per chunk (defaults to chunk_max_tokens)
+        
+        Returns:
+            List of dicts with offset, page, text and token_count
+        """
+        if not text:
+            return []
+        
+        return list(self.chunk_blocks(split_blocks(text), max_tokens))
+    
+    def chunk_blocks(self, blocks: Iterable[Dict], max_tokens: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Split a stream of extracted blocks into passages for retrieval
+        
+        Chunks follow line boundaries and only split inside a line when the
+        line alone exceeds the budget. They may span unpaginated blocks but
+        never cross a page, so every chunk can be cited by its page. Each
+        chunk keeps its character offset in the joined text (join_blocks).
+        Only the open chunk is held in memory.
+        
+        Args:
+            blocks: Dicts with 'page' and 'text' (see iter_blocks)
+            max_tokens: Token budget per chunk (defaults to chunk_max_tokens)
+        
+        Yields:
+            Dicts with offset, page, text and token_count
+        """
+        max_tokens = max_tokens or self.chunk_max_tokens
+        parts = []  # text of the open chunk from earlier blocks
+        start = page = None  # offset and page of the open chunk (None: no open chunk)
+        tokens = 0.0  # unrounded weight of the open chunk, separators included
+        block_offset = 0
+        
+        def make_chunk(passage):
+            passage = passage.strip()
+            if passage:
+                return {
+                    'offset': start,
+                    'page': page,
+                    'text': passage,
+                    'token_count': self.estimate_tokens(passage)
+                }
+            return None
+        
+        for index, block in enumerate(blocks):
+            text = block['text']
+            if index:
+                block_offset += 1  # separator written by join_blocks
+            
+            if start is not None and block.get('page') != page:
+                chunk = make_chunk('\n'.join(parts))
+                if chunk:
+                    yield chunk
+                start = None
+            
+            # An open chunk continues at the top of this block, after the joining newline
+            piece_start = piece_end = cursor = 0
+            if start is not None:
+                tokens += arabic_text.token_weight('\n')
+            
+            for segment in self._iter_segments(text, max_tokens):
+                seg_start, seg_end = segment.span()
+                
+                # Weights are summed unrounded, with the whitespace since the previous segment,
+                # so that many short segments (words of an over-long line) do not undercount
+                seg_tokens = arabic_text.token_weight(text[cursor:seg_end])
+                if start is not None and tokens + seg_tokens > max_tokens:
+                    chunk = make_chunk('\n'.join(parts + [text[piece_start:piece_end]]))
+                    if chunk:
+                        yield chunk
+                    start = None
+                
+                if start is None:
+                    start, page, tokens, parts = block_offset + seg_start, block.get('page'), 0.0, []
+                    piece_start = seg_start
+                    seg_tokens = arabic_text.token_weight(segment.group())
+                tokens += seg_tokens
+                piece_end = cursor = seg_end
+            
+            if start is not None:
+                tokens += arabic_text.token_weight(text[cursor:])
+                parts.append(text[piece_start:])
+            block_offset += len(text)
         
+        if start is not None:
+            chunk = make_chunk('\n'.join(parts))
+            if chunk:
+                yield chunk
+    
+    def _iter_segments(self, text: str, max_tokens: int):
+        """Yield line matches, splitting over-long lines into word runs"""
+        for line in SEGMENT_PATTERN.finditer(text):
+            if self.estimate_tokens(line.group()) <= max_tokens:
+                yield line
+                continue
+            
+            # Line is larger than a chunk: fall back to word-level segments
+            yield from WORD_PATTERN.finditer(text, line.start(), line.end())
+    
+    def estimate_tokens(self, text: str) -> int:
+        """Estimate LLM tokens (Arabic script tokenizes denser than Latin)"""
+        return arabic_text.estimate_tokens(text)
+    
+    def _iter_pdf_blocks(self, file_path: str) -> Iterator[Dict]:
+        """Stream PDF pages (pdfplumber, PyPDF2 as fallback)"""
         # Try pdfplumber first (better for Arabic)
+        page_count = None
         if pdfplumber:
             try:
                 with pdfplumber.open(file_path) as pdf:
-                    for page in pdf.pages:
-                        page_text = page.extract_text()
-                        if page_text:
-                            content += page_text + "\n"
-                logger.info("📖 تم استخدام pdfplumber لاستخراج النص")
-                return content.strip()
+                    page_count = len(pdf.pages)
             except Exception as e:
                 logger.warning(f"⚠️ فشل pdfplumber: {e}")
         
+        if page_count is not None:
+            if self.pdf_workers > 1 and page_count >= self.pdf_parallel_min_pages:
+                page_texts = self._extract_pdf_parallel(file_path, page_count)
+            else:
+                page_texts = self._extract_pdf_serial(file_path)
+            
+            logger.info(f"📖 تم استخدام pdfplumber لاستخراج النص ({page_count} صفحة)")
+            yield from self._ocr_sparse_pages(file_path, page_texts)
+            return
+        
         # Fallback to PyPDF2
         if PdfReader:
-            try:
-                with open(file_path, 'rb') as file:
-                    pdf_reader = PdfReader(file)
-                    for page in pdf_reader.pages:
-                        page_text = page.extract_text()
-                        if page_text:
-                            content += page_text + "\n"
-                logger.info("📖 تم استخدام PyPDF2 لاستخراج النص")
-                return content.strip()
-            except Exception as e:
-                logger.warning(f"⚠️ فشل PyPDF2: {e}")
+            logger.info("📖 تم استخدام PyPDF2 لاستخراج النص")
+            with open(file_path, 'rb') as file:
+                pdf_reader = PdfReader(file)
+                yield from self._ocr_sparse_pages(file_path, (page.extract_text() or "" for page in pdf_reader.pages))
+            return
         
         # If both fail, try OCR for images
-        if pytesseract and Image:
-            try:
-                return self._ocr_pdf(file_path)
-            except Exception as e:
-                logger.warning(f"⚠️ فشل OCR: {e}")
+        if self._check_ocr():
+            yield from self._ocr_pdf(file_path)
+            return
         
-        return "فشل في استخراج النص من ملف PDF"
+        yield {'page': None, 'text': "فشل في استخراج النص من ملف PDF"}
     
-    def _process_docx(self, file_path: str) -> str:
-        """Process DOCX files"""
-        if not DocxDocument:
-            return "مكتبة python-docx غير مثبتة"
+    def _extract_pdf_serial(self, file_path: str) -> Iterator[str]:
+        """Extract page texts one page at a time in this process"""
+        with pdfplumber.open(file_path) as pdf:
+            for page in pdf.pages:
+                yield page.extract_text() or ""
+                page.flush_cache()
+    
+    def _extract_pdf_parallel(self, file_path: str, page_count: int) -> Iterator[str]:
+        """Split page ranges across worker processes and yield page texts in page order as ranges finish"""
+        workers = min(self.pdf_workers, page_count)
+        
+        # A few ranges per worker keeps the pool busy when pages differ in cost
+        range_size = max(1, -(-page_count // (workers * 4)))
+        ranges = [(start, min(start + range_size, page_count)) for start in range(0, page_count, range_size)]
         
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
         try:
-            doc = DocxDocument(file_path)
-            content = ""
-            
-            # Extract paragraphs
-            for paragraph in doc.paragraphs:
-                if paragraph.text.strip():
-                    content += paragraph.text + "\n"
-            
-            # Extract tables
-            for table in doc.tables:
-                for row in table.rows:
-                    row_text = []
-                    for cell in row.cells:
-                        if cell.text.strip():
-                            row_text.append(cell.text.strip())
-                    if row_text:
-                        content += " | ".join(row_text) + "\n"
-            
-            logger.info("📄 تم استخراج النص من DOCX")
-            return content.strip()
-            
-        except Exception as e:
-            logger.error(f"❌ خطأ في معالجة DOCX: {e}")
-            return f"فشل في معالجة ملف DOCX: {str(e)}"
+            results = executor.map(
+                _extract_pdf_pages,
+                [file_path] * len(ranges),
+                [start for start, _ in ranges],
+                [end for _, end in ranges]
+            )
+            for texts in results:
+                yield from texts
+        finally:
+            # A consumer that stops early (e.g. language sampling) cancels the ranges not yet started
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        logger.info(f"⚡ تم استخراج {page_count} صفحة بالتوازي باستخدام {workers} عملية")
+    
+    def _iter_docx_blocks(self, file_path: str) -> Iterator[Dict]:
+        """Stream DOCX paragraphs, then table rows"""
+        if not DocxDocument:
+            yield {'page': None, 'text': "مكتبة python-docx غير مثبتة"}
+            return
+        
+        doc = DocxDocument(file_path)
+        
+        # Extract paragraphs
+        for paragraph in doc.paragraphs:
+            if paragraph.text.strip():
+                yield {'page': None, 'text': paragraph.text}
+        
+        # Extract tables
+        for table in doc.tables:
+            for row in table.rows:
+                row_text = [cell.text.strip() for cell in row.cells if cell.text.strip()]
+                if row_text:
+                    yield {'page': None, 'text': " | ".join(row_text)}
+        
+        logger.info("📄 تم استخراج النص من DOCX")
     
     def _process_doc(self, file_path: str) -> str:
         """Process DOC files (legacy Word format)"""
@@ -205,31 +566,53 @@ class DocumentProcessor:
         
         return "تنسيق DOC القديم يتطلب تحويل. يرجى حفظ الملف بصيغة DOCX"
     
+    def _iter_txt_blocks(self, file_path: str) -> Iterator[Dict]:
+        """
+        Stream a text file in paragraph-sized blocks of lines
+        
+        The file is memory-mapped, its encoding detected once from a sample
+        (detect_text_encoding) and decoded incrementally, so it is read a
+        single time and never held whole as bytes and text. Line endings
+        are normalized to \\n; undecodable bytes become U+FFFD.
+        """
+        with open(file_path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return
+            
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                encoding, bom_length = detect_text_encoding(data)
+                logger.info(f"📝 تم قراءة النص بترميز {encoding}")
+                
+                decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+                pending = ''  # text after the last line break, continued by the next read
+                for start in range(bom_length, len(data), TEXT_BLOCK_CHARS):
+                    pending += decoder.decode(data[start:start + TEXT_BLOCK_CHARS])
+                    
+                    # Cut at the last line break (a trailing \r may be the first half of \r\n)
+                    cut = pending.rfind('\n') + 1
+                    if not cut and len(pending) >= TEXT_BLOCK_CHARS:
+                        cut = len(pending) - pending.endswith('\r')
+                    if cut:
+                        yield {'page': None, 'text': self._normalize_newlines(pending[:cut])}
+                        pending = pending[cut:]
+                
+                pending += decoder.decode(b'', final=True)
+                if pending:
+                    yield {'page': None, 'text': self._normalize_newlines(pending)}
+    
+    def _normalize_newlines(self, text: str) -> str:
+        """Convert \\r\\n and \\r line endings to \\n"""
+        return text.replace('\r\n', '\n').replace('\r', '\n')
+    
+    def _single_block(self, processor):
+        """Block reader for formats extracted as a whole"""
+        def iter_blocks(file_path: str) -> Iterator[Dict]:
+            yield {'page': None, 'text': processor(file_path)}
+        return iter_blocks
+    
     def _process_txt(self, file_path: str) -> str:
         """Process text files with encoding detection"""
-        encodings = ['utf-8', 'utf-16', 'windows-1256', 'iso-8859-6', 'latin-1']
-        
-        for encoding in encodings:
-            try:
-                with open(file_path, 'r', encoding=encoding) as file:
-                    content = file.read()
-                    if content and not any(ord(char) > 1000000 for char in content[:100]):
-                        logger.info(f"📝 تم قراءة النص بترميز {encoding}")
-                        return content.strip()
-            except (UnicodeDecodeError, UnicodeError):
-                continue
-            except Exception as e:
-                logger.warning(f"⚠️ خطأ في قراءة الملف بترميز {encoding}: {e}")
-        
-        # Last resort: read as binary and clean
-        try:
-            with open(file_path, 'rb') as file:
-                content = file.read()
-                text = content.decode('utf-8', errors='ignore')
-                return text.strip()
-        except Exception as e:
-            logger.error(f"❌ فشل في قراءة الملف النصي: {e}")
-            return "فشل في قراءة الملف النصي"
+        return ''.join(block['text'] for block in self._iter_txt_blocks(file_path)).strip()
     
     def _process_rtf(self, file_path: str) -> str:
         """Process RTF files"""
@@ -258,96 +641,164 @@ class DocumentProcessor:
             logger.error(f"❌ خطأ في معالجة RTF: {e}")
             return f"فشل في معالجة ملف RTF: {str(e)}"
     
-    def _ocr_pdf(self, file_path: str) -> str:
-        """Extract text from PDF using OCR"""
-        if not (pytesseract and Image):
-            return "مكتبات OCR غير متوفرة"
+    def _ocr_pdf(self, file_path: str) -> Iterator[Dict]:
+        """OCR every page of a PDF whose text layer could not be read"""
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            page_count = len(pdf)
+        finally:
+            pdf.close()
+        
+        logger.info(f"🔍 استخراج النص باستخدام OCR ({page_count} صفحة)")
+        yield from self._ocr_sparse_pages(file_path, [""] * page_count)
+    
+    def _ocr_sparse_pages(self, file_path: str, page_texts: Iterable[str]) -> Iterator[Dict]:
+        """
+        Yield PDF pages in order, OCR-ing those without a usable text layer
+        
+        Only pages whose text layer is shorter than ocr_min_page_chars are
+        rendered and sent to the OCR process pool, so born-digital PDFs never
+        start it. Pages are OCR'd concurrently while later pages are read; a
+        bounded window keeps them in order. OCR text is cached per
+        (file hash, page), and a page that fails or times out keeps its text
+        layer.
+        """
+        executor = None
+        file_hash = None
+        pending = deque()  # (page number, text layer, OCR future or None), in page order
+        window = self.ocr_workers * 2
+        ocr_pages = 0
         
         try:
-            # Convert PDF to images and OCR
-            content = ""
-            # This is a simplified OCR approach
-            # In production, you'd want to use pdf2image to convert PDF pages to images
-            logger.info("🔍 محاولة استخراج النص باستخدام OCR")
-            return "OCR غير مكتمل في هذا الإصدار"
+            for number, text in enumerate(page_texts, 1):
+                future = None
+                if len(text.strip()) < self.ocr_min_page_chars and self._check_ocr():
+                    file_hash = file_hash or self._file_hash(file_path)
+                    cached = self._read_ocr_cache(file_hash, number)
+                    if cached is not None:
+                        text = self._better_page_text(text, cached)
+                    else:
+                        if executor is None:
+                            executor = ProcessPoolExecutor(
+                                max_workers=self.ocr_workers, mp_context=multiprocessing.get_context('spawn')
+                            )
+                        future = executor.submit(
+                            _ocr_pdf_page, file_path, number - 1,
+                            self.ocr_resolution, self.ocr_languages, self.ocr_page_timeout
+                        )
+                        ocr_pages += 1
+                pending.append((number, text, future))
+                
+                # Hand out finished pages; wait for the oldest once the window is full
+                while pending and (pending[0][2] is None or pending[0][2].done() or len(pending) > window):
+                    yield self._finish_ocr_page(file_hash, *pending.popleft())
+            
+            while pending:
+                yield self._finish_ocr_page(file_hash, *pending.popleft())
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+                logger.info(f"🔍 تم تطبيق OCR على {ocr_pages} صفحة باستخدام {self.ocr_workers} عملية")
+    
+    def _finish_ocr_page(self, file_hash: Optional[str], number: int, text: str, future) -> Dict:
+        """Block of a page, with the OCR result once it is available"""
+        if future is not None:
+            try:
+                ocr_text = future.result()
+                self._write_ocr_cache(file_hash, number, ocr_text)
+                text = self._better_page_text(text, ocr_text)
+            except Exception as e:
+                logger.warning(f"⚠️ فشل OCR للصفحة {number}: {e}")
+        
+        return {'page': number, 'text': text}
+    
+    def _better_page_text(self, text_layer: str, ocr_text: str) -> str:
+        """OCR text, unless the page's own text layer holds more"""
+        return ocr_text if len(ocr_text.strip()) > len(text_layer.strip()) else text_layer
+    
+    def _check_ocr(self) -> bool:
+        """Whether OCR can run: libraries, the Tesseract binary and the configured languages"""
+        if self._ocr_ready is None:
+            self._ocr_ready = False
+            if not (pytesseract and Image and pdfium):
+                return False
             
-        except Exception as e:
-            logger.error(f"❌ خطأ في OCR: {e}")
-            return f"فشل في OCR: {str(e)}"
+            try:
+                installed = set(pytesseract.get_languages(config=''))
+                missing = [language for language in self.ocr_languages.split('+') if language not in installed]
+                if missing:
+                    logger.warning(f"⚠️ لغات OCR غير مثبتة في Tesseract: {', '.join(missing)}")
+                else:
+                    self._ocr_ready = True
+            except Exception as e:
+                logger.warning(f"⚠️ Tesseract غير متوفر: {e}")
+        
+        return self._ocr_ready
+    
+    def _file_hash(self, file_path: str) -> str:
+        """SHA-256 of a file (key of its cached OCR pages)"""
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(HASH_BUFFER_SIZE), b''):
+                hasher.update(block)
+        return hasher.hexdigest()
+    
+    def _ocr_cache_path(self, file_hash: str, page_number: int) -> str:
+        """Cache file of one page: <cache>/<first two hex digits>/<hash>/<page>.txt"""
+        return os.path.join(self.ocr_cache_dir, file_hash[:2], file_hash, f"{page_number}.txt")
+    
+    def _read_ocr_cache(self, file_hash: str, page_number: int) -> Optional[str]:
+        """Cached OCR text of a page, or None"""
+        if not self.ocr_cache_dir:
+            return None
+        
+        try:
+            with open(self._ocr_cache_path(file_hash, page_number), 'r', encoding='utf-8') as cache_file:
+                return cache_file.read()
+        except OSError:
+            return None
+    
+    def _write_ocr_cache(self, file_hash: str, page_number: int, text: str):
+        """Store the OCR text of a page (atomically, workers may share the cache)"""
+        if not self.ocr_cache_dir:
+            return
+        
+        path = self._ocr_cache_path(file_hash, page_number)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as cache_file:
+                cache_file.write(text)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"⚠️ فشل في حفظ نتيجة OCR: {e}")
     
     def _detect_mime_type(self, file_path: str) -> str:
         """Detect MIME type from file content"""
         try:
             with open(file_path, 'rb') as file:
-                header = file.read(4096)
-            
-            # PDF signature
-            if header.startswith(b'%PDF'):
-                return 'application/pdf'
-            
-            # DOCX signature (ZIP-based)
-            if header.startswith(b'PK\x03\x04') and b'word/' in header:
-                return 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-            
-            # DOC signature
-            if header.startswith(b'\xd0\xcf\x11\xe0'):
-                return 'application/msword'
-            
-            # RTF signature
-            if header.startswith(b'{\\rtf'):
-                return 'application/rtf'
-            
-            # Default to text
-            return 'text/plain'
+                return sniff_mime_type(file.read(MIME_SNIFF_BYTES))
             
         except Exception:
             return 'text/plain'
     
     def _is_arabic_text(self, text: str) -> bool:
-        """Check if text contains Arabic characters"""
-        if not text:
-            return False
-        
-        arabic_count = sum(1 for char in text if '\u0600' <= char <= '\u06FF')
-        total_chars = len([char for char in text if char.isalpha()])
-        
-        if total_chars == 0:
-            return False
-        
-        return arabic_count / total_chars > 0.3  # More than 30% Arabic
+        """Check if text is mostly Arabic (counted on a bounded sample)"""
+        return arabic_text.is_arabic(text)
     
     def _enhance_arabic_text(self, text: str) -> str:
-        """Enhance Arabic text for better processing"""
+        """
+        Enhance Arabic text for better processing
+        
+        Stored text stays in logical order with base letters; reshaping and
+        bidi reordering are display concerns left to the browser.
+        """
         if not text:
             return text
         
         try:
-            # Normalize Arabic text
-            enhanced_text = text
-            
-            # Fix common Arabic text issues
-            fixes = {
-                'ي': 'ي',  # Normalize Yeh
-                'ك': 'ك',  # Normalize Kaf
-                'ة': 'ة',  # Normalize Teh Marbuta
-                'أ': 'أ',  # Normalize Alef with Hamza
-                'إ': 'إ',  # Normalize Alef with Hamza below
-                'آ': 'آ',  # Normalize Alef with Madda
-            }
-            
-            for old, new in fixes.items():
-                enhanced_text = enhanced_text.replace(old, new)
-            
-            # Reshape Arabic text if library is available
-            if self.arabic_config['reshape_enabled'] and arabic_reshaper:
-                try:
-                    reshaped = arabic_reshaper.reshape(enhanced_text)
-                    if self.arabic_config['bidi_enabled'] and get_display:
-                        enhanced_text = get_display(reshaped)
-                except Exception as e:
-                    logger.warning(f"⚠️ فشل في تحسين النص العربي: {e}")
-            
-            return enhanced_text
+            # Normalize Arabic text (presentation forms, Persian Yeh/Kaf, tatweel)
+            return arabic_text.clean_text(text)
             
         except Exception as e:
             logger.warning(f"⚠️ خطأ في تحسين النص العربي: {e}")
@@ -362,11 +813,11 @@ class DocumentProcessor:
             if not mime_type:
                 mime_type = self._detect_mime_type(file_path)
             
-            # Calculate file hash
-            hash_md5 = hashlib.md5()
+            # Calculate file hash (same digest as the upload content store)
+            hash_sha256 = hashlib.sha256()
             with open(file_path, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hash_md5.update(chunk)
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    hash_sha256.update(chunk)
             
             return {
                 'filename': os.path.basename(file_path),
@@ -374,7 +825,7 @@ class DocumentProcessor:
                 'mime_type': mime_type,
                 'created': stat.st_ctime,
                 'modified': stat.st_mtime,
-                'hash': hash_md5.hexdigest(),
+                'hash': hash_sha256.hexdigest(),
                 'supported': mime_type in self.supported_types
             }
             
@@ -430,19 +881,25 @@ class DocumentProcessor:
         return metadata
     
     def _detect_language(self, file_path: str) -> str:
-        """Detect document language"""
+        """
+        Detect document language from its first blocks
+        
+        Extraction stops once a sample has been read. Ingested documents
+        already carry the language of their full text (Document.language).
+        """
         try:
-            # Read a sample of the text
-            content = self.process_file(file_path)
-            if not content:
-                return 'unknown'
-            
-            # Simple Arabic detection
-            sample = content[:1000]  # First 1000 characters
-            if self._is_arabic_text(sample):
-                return 'arabic'
-            else:
-                return 'english'
+            sample = []
+            sampled_chars = 0
+            blocks = self.iter_blocks(file_path)
+            for block in blocks:
+                sample.append(block['text'])
+                sampled_chars += len(block['text'])
+                if sampled_chars >= arabic_text.SCRIPT_SAMPLE_CHARS:
+                    break
+            blocks.close()
+            
+            language = arabic_text.script_stats('\n'.join(sample))['language']
+            return {'ar': 'arabic', 'en': 'english'}.get(language, 'unknown')
                 
         except Exception:
             return 'unknown'
@@ -481,14 +938,13 @@ class DocumentProcessor:
             'supported_types': len(self.supported_types),
             'pdf_support': PdfReader is not None or pdfplumber is not None,
             'docx_support': DocxDocument is not None,
-            'ocr_support': pytesseract is not None and Image is not None,
-            'arabic_support': self.arabic_config['reshape_enabled'],
+            'ocr_support': pytesseract is not None and Image is not None and pdfium is not None,
+            'arabic_support': True,
             'libraries_available': {
                 'PyPDF2': PyPDF2 is not None,
                 'pdfplumber': pdfplumber is not None,
                 'python-docx': DocxDocument is not None,
                 'pytesseract': pytesseract is not None,
-                'arabic-reshaper': arabic_reshaper is not None,
-                'python-bidi': get_display is not None
+                'pypdfium2': pdfium is not None
             }
         }
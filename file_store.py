@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Content-Addressed File Store
+تطبيق المدرس AI المحسن - تخزين الملفات حسب بصمة المحتوى
+
+Author: Teacher AI Enhanced Team
+Version: 2.0.0
+"""
+
+import os
+import uuid
+import hashlib
+import logging
+from typing import BinaryIO, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Read buffer used while hashing and copying uploads
+HASH_BUFFER_SIZE = 1024 * 1024  # 1MB
+
+class ContentStore:
+    """Stores each distinct file once under its SHA-256 digest"""
+    
+    def __init__(self, root: str):
+        """Initialize the store rooted at the uploads folder"""
+        self.root = root
+        self.temp_dir = os.path.join(root, '.incoming')
+        os.makedirs(self.temp_dir, exist_ok=True)
+    
+    def path_for(self, content_hash: str, extension: str = '') -> str:
+        """Content-addressed path: <root>/<first two hex digits>/<hash>.<ext>"""
+        filename = f"{content_hash}.{extension}" if extension else content_hash
+        return os.path.join(self.root, content_hash[:2], filename)
+    
+    def save(self, stream: BinaryIO, extension: str = '') -> Tuple[str, str, int]:
+        """
+        Copy a stream into the store while hashing it in one pass
+        
+        Args:
+            stream: Readable binary stream (e.g. a Werkzeug FileStorage stream)
+            extension: File extension to keep on the stored file
+        
+        Returns:
+            Tuple of (file_path, sha256 hex digest, size in bytes)
+        """
+        digest = hashlib.sha256()
+        size = 0
+        temp_path = os.path.join(self.temp_dir, uuid.uuid4().hex)
+        
+        try:
+            with open(temp_path, 'wb') as temp_file:
+                for block in iter(lambda: stream.read(HASH_BUFFER_SIZE), b''):
+                    digest.update(block)
+                    temp_file.write(block)
+                    size += len(block)
+            
+            content_hash = digest.hexdigest()
+            return self.adopt(temp_path, content_hash, extension), content_hash, size
+        
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    def adopt(self, temp_path: str, content_hash: str, extension: str = '') -> str:
+        """
+        Move a fully written temporary file to its content-addressed location
+        
+        When the same content is already stored the temporary file is discarded.
+        
+        Returns:
+            Path of the stored file
+        """
+        file_path = self.path_for(content_hash, extension)
+        if os.path.exists(file_path):
+            os.remove(temp_path)
+            return file_path
+        
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.replace(temp_path, file_path)
+        logger.info(f"💾 تم تخزين الملف: {file_path}")
+        return file_path
+    
+    def delete(self, file_path: str):
+        """Remove a stored file"""
+        if file_path and os.path.exists(file_path):
+            os.remove(file_path)
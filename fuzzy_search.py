@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Fuzzy Term Matching
+تطبيق المدرس AI المحسن - البحث التقريبي المتسامح مع الأخطاء
+
+Author: Teacher AI Enhanced Team
+Version: 2.0.0
+"""
+
+import os
+import time
+import bisect
+import logging
+import threading
+from array import array
+from collections import defaultdict
+from typing import List, Dict, Optional, Tuple
+
+from flask import Flask, current_app
+
+from database import db, IndexPosting
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Padding so that the first and last letters also form trigrams
+TRIGRAM_PAD = '$'
+
+def trigrams(term: str) -> List[str]:
+    """Distinct character trigrams of a padded term"""
+    padded = f"{TRIGRAM_PAD}{TRIGRAM_PAD}{term}{TRIGRAM_PAD}{TRIGRAM_PAD}"
+    return list(dict.fromkeys(padded[i:i + 3] for i in range(len(padded) - 2)))
+
+def max_edit_distance(term: str) -> int:
+    """Typo allowance by term length (short terms must match exactly)"""
+    if len(term) <= 3:
+        return 0
+    if len(term) <= 6:
+        return 1
+    return 2
+
+def bounded_edit_distance(source: str, target: str, max_distance: int) -> Optional[int]:
+    """
+    Levenshtein distance limited to a diagonal band
+    
+    Returns:
+        The distance, or None as soon as it is known to exceed max_distance
+    """
+    if abs(len(source) - len(target)) > max_distance:
+        return None
+    
+    previous = list(range(len(target) + 1))
+    for i, source_char in enumerate(source, 1):
+        low = max(1, i - max_distance)
+        high = min(len(target), i + max_distance)
+        current = [i] + [max_distance + 1] * len(target)
+        
+        for j in range(low, high + 1):
+            cost = 0 if source_char == target[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+        
+        if min(current[low - 1:high + 1]) > max_distance:
+            return None
+        previous = current
+    
+    distance = previous[len(target)]
+    return distance if distance <= max_distance else None
+
+class TrigramVocabulary:
+    """
+    In-memory trigram index over the distinct index terms
+    
+    Built once from index_postings in a background thread (warm()) and
+    topped up incrementally with terms of postings added since the last
+    refresh, so lookups never touch the database. Until the first build is
+    done, expand() suggests nothing. Terms of deleted documents may linger;
+    expanding to them just matches nothing.
+    
+    New postings are found through an id watermark; index_postings ids are
+    never reused (AUTOINCREMENT on SQLite, a sequence on PostgreSQL). A
+    sequence may still commit a lower id after a higher one, and postings
+    get deleted, so the posting count up to the watermark is kept too:
+    when it does not add up, all postings are rescanned.
+    """
+    
+    def __init__(self, refresh_interval: float = 30.0, time_budget_ms: float = 50.0, max_expansions: int = 3):
+        """
+        Initialize the vocabulary
+        
+        Args:
+            refresh_interval: Seconds between checks for new postings
+            time_budget_ms: Time allowed for expanding one query
+            max_expansions: Similar terms kept per query term
+        """
+        self.refresh_interval = refresh_interval
+        self.time_budget_ms = time_budget_ms
+        self.max_expansions = max_expansions
+        
+        self._warm_thread: Optional[threading.Thread] = None
+        self._reset()
+        
+        # A worker forked mid-build (gunicorn --preload) would inherit a held lock and half a vocabulary
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+    
+    @property
+    def ready(self) -> bool:
+        """Whether the first build is done"""
+        return self._ready.is_set()
+    
+    def warm(self, app: Flask):
+        """Start the first build in a background thread (idempotent)"""
+        if self.ready or (self._warm_thread and self._warm_thread.is_alive()):
+            return
+        
+        def build():
+            try:
+                with app.app_context():
+                    self.refresh(force=True)
+            except Exception as e:
+                logger.error(f"❌ فشل في بناء مفردات البحث التقريبي: {e}")
+        
+        self._warm_thread = threading.Thread(target=build, name='fuzzy-vocabulary', daemon=True)
+        self._warm_thread.start()
+    
+    def refresh(self, force: bool = False):
+        """
+        Add terms of postings created since the last refresh
+        
+        Before the first build is done, a non-forced refresh only (re)starts
+        the background build, so requests never wait for the full scan.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_check < self.refresh_interval:
+            return
+        
+        if not force and not self.ready:
+            self._last_check = now
+            self.warm(current_app._get_current_object())
+            return
+        
+        with self._lock:
+            self._last_check = now
+            latest = db.session.query(db.func.max(IndexPosting.id)).scalar() or 0
+            total = db.session.query(db.func.count(IndexPosting.id)).filter(IndexPosting.id <= latest).scalar()
+            since = db.session.query(db.func.count(IndexPosting.id)).filter(
+                IndexPosting.id > self._last_posting_id,
+                IndexPosting.id <= latest
+            ).scalar()
+            
+            rescan = self._posting_count + since != total
+            if not rescan and latest <= self._last_posting_id:
+                return
+            
+            rows = db.session.query(IndexPosting.term, db.func.count(IndexPosting.id)).filter(
+                IndexPosting.id > (0 if rescan else self._last_posting_id),
+                IndexPosting.id <= latest
+            ).group_by(IndexPosting.term).all()
+            
+            if rescan:
+                # Term ids stay put so concurrent expand() calls never see a half-swapped vocabulary
+                logger.info("🔤 تغيرت فهارس البحث منذ آخر تحديث، إعادة حساب مفردات البحث التقريبي")
+                frequencies = dict(rows)
+                for term_id, term in enumerate(self._terms):
+                    self._document_frequency[term_id] = frequencies.get(term, 0)
+            
+            added = 0
+            for term, frequency in rows:
+                term_id = self._term_ids.get(term)
+                if term_id is not None:
+                    if not rescan:
+                        self._document_frequency[term_id] += frequency
+                    continue
+                
+                term_id = len(self._terms)
+                self._terms.append(term)
+                self._term_ids[term] = term_id
+                self._document_frequency.append(frequency)
+                for gram in trigrams(term):
+                    self._trigrams[gram].append(term_id)
+                added += 1
+            
+            if added:
+                self._sorted_terms = sorted(self._terms)
+            self._last_posting_id = latest
+            self._posting_count = total
+            self._ready.set()
+            logger.info(f"🔤 تم تحديث مفردات البحث التقريبي: {added} مصطلح جديد ({len(self._terms)} إجمالاً)")
+    
+    def expand(self, terms: List[str], prefix_last: bool = False) -> Tuple[Dict[str, List[str]], float]:
+        """
+        Map each query term to itself plus similar vocabulary terms
+        
+        Candidates come from trigram prefix filtering: a term within edit
+        distance d shares at least |T| - 3d trigrams with the query term,
+        so it must appear in one of the 3d + 1 rarest query trigram lists.
+        Candidates are then verified with a banded edit distance. Work stops
+        when the time budget is spent, keeping the expansions found so far.
+        
+        Args:
+            terms: Normalized, stemmed query terms
+            prefix_last: Also complete the last term as a prefix (search-as-you-type)
+        
+        Returns:
+            Tuple of (expansions per query term, elapsed milliseconds)
+        """
+        started = time.perf_counter()
+        if not self.ready:
+            return {term: [term] for term in terms}, 0.0
+        
+        deadline = started + self.time_budget_ms / 1000
+        expansions = {}
+        
+        for index, term in enumerate(terms):
+            matches = []
+            if time.perf_counter() < deadline:
+                matches = self._similar_terms(term, deadline)
+                if prefix_last and index == len(terms) - 1:
+                    matches += self._prefix_terms(term)
+            
+            best = {}
+            for distance, match in matches:
+                if match != term and distance < best.get(match, distance + 1):
+                    best[match] = distance
+            
+            # Closest first, then the most common spellings
+            ranked = sorted(best, key=lambda match: (best[match], -self._document_frequency[self._term_ids[match]]))
+            expansions[term] = [term] + ranked[:self.max_expansions]
+        
+        return expansions, round((time.perf_counter() - started) * 1000, 2)
+    
+    def get_stats(self) -> Dict:
+        """Get vocabulary size and settings"""
+        return {
+            'ready': self.ready,
+            'terms': len(self._terms),
+            'trigrams': len(self._trigrams),
+            'time_budget_ms': self.time_budget_ms
+        }
+    
+    def _reset(self):
+        """Empty vocabulary, not yet built"""
+        self._terms: List[str] = []
+        self._term_ids: Dict[str, int] = {}
+        self._document_frequency = array('I')
+        self._trigrams: Dict[str, array] = defaultdict(lambda: array('I'))
+        self._sorted_terms: List[str] = []
+        
+        self._last_posting_id = 0
+        self._posting_count = 0
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+    
+    def _after_fork(self):
+        """Fresh lock in a forked child; drop a build the parent had not finished"""
+        if self.ready:
+            self._lock = threading.Lock()
+        else:
+            self._reset()
+        self._warm_thread = None
+    
+    def _similar_terms(self, term: str, deadline: float) -> List[Tuple[int, str]]:
+        """(distance, term) of vocabulary terms within the term's edit distance allowance"""
+        max_distance = max_edit_distance(term)
+        if not max_distance:
+            return []
+        
+        grams = sorted(trigrams(term), key=lambda gram: len(self._trigrams.get(gram, ())))
+        probe_count = min(len(grams), 3 * max_distance + 1)
+        
+        candidates = set()
+        for gram in grams[:probe_count]:
+            candidates.update(self._trigrams.get(gram, ()))
+        
+        matches = []
+        for checked, term_id in enumerate(candidates):
+            if checked % 64 == 0 and time.perf_counter() > deadline:
+                break
+            
+            candidate = self._terms[term_id]
+            distance = bounded_edit_distance(term, candidate, max_distance)
+            if distance is not None:
+                matches.append((distance, candidate))
+        
+        return matches
+    
+    def _prefix_terms(self, prefix: str, limit: int = 20) -> List[Tuple[int, str]]:
+        """Vocabulary terms starting with prefix, ranked after close typo matches"""
+        start = bisect.bisect_left(self._sorted_terms, prefix)
+        matches = []
+        for candidate in self._sorted_terms[start:start + limit]:
+            if not candidate.startswith(prefix):
+                break
+            matches.append((1, candidate))
+        return matches
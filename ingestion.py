@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Background Ingestion
+تطبيق المدرس AI المحسن - المعالجة الخلفية للمستندات
+
+Author: Teacher AI Enhanced Team
+Version: 2.0.0
+"""
+
+import json
+import time
+import logging
+import tempfile
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+from flask import Flask
+
+import arabic_text
+from database import init_db, db, Document, DocumentChunk
+from document_processor import DocumentProcessor, block_separator
+from search_index import SearchIndex
+from semantic_index import create_semantic_index
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Settings forwarded from the web app to the worker processes
+WORKER_CONFIG_KEYS = (
+    'SQLALCHEMY_DATABASE_URI',
+    'SQLALCHEMY_ENGINE_OPTIONS',
+    'SQLALCHEMY_TRACK_MODIFICATIONS',
+    'CHUNK_MAX_TOKENS',
+    'PDF_EXTRACTION_WORKERS',
+    'PDF_PARALLEL_MIN_PAGES',
+    'OCR_WORKERS',
+    'OCR_LANGUAGES',
+    'OCR_MIN_PAGE_CHARS',
+    'OCR_PAGE_TIMEOUT',
+    'OCR_RESOLUTION',
+    'OCR_CACHE_FOLDER',
+    'SEMANTIC_RETRIEVAL',
+    'SEMANTIC_MODEL',
+    'SEMANTIC_INDEX_FOLDER',
+    'SEMANTIC_VECTOR_DTYPE',
+)
+
+# Per-process state of a worker (created once by _init_worker)
+_worker_app = None
+_worker_processor = None
+_worker_index = None
+_worker_semantic_index = None
+
+def _init_worker(config: Dict):
+    """Create an app context, processor and index inside a worker process"""
+    global _worker_app, _worker_processor, _worker_index, _worker_semantic_index
+    
+    _worker_app = Flask(__name__)
+    _worker_app.config.update(config)
+    init_db(_worker_app)
+    
+    _worker_processor = DocumentProcessor(
+        chunk_max_tokens=config.get('CHUNK_MAX_TOKENS', 300),
+        pdf_workers=config.get('PDF_EXTRACTION_WORKERS'),
+        pdf_parallel_min_pages=config.get('PDF_PARALLEL_MIN_PAGES', 40),
+        ocr_workers=config.get('OCR_WORKERS'),
+        ocr_languages=config.get('OCR_LANGUAGES', 'ara+eng'),
+        ocr_min_page_chars=config.get('OCR_MIN_PAGE_CHARS', 20),
+        ocr_page_timeout=config.get('OCR_PAGE_TIMEOUT', 60),
+        ocr_resolution=config.get('OCR_RESOLUTION', 300),
+        ocr_cache_dir=config.get('OCR_CACHE_FOLDER')
+    )
+    _worker_index = SearchIndex()
+    if config.get('SEMANTIC_RETRIEVAL', 'off') != 'off':
+        _worker_semantic_index = create_semantic_index(
+            config.get('SEMANTIC_INDEX_FOLDER', 'vector_index'),
+            config.get('SEMANTIC_MODEL'),
+            dtype=config.get('SEMANTIC_VECTOR_DTYPE', 'float16')
+        )
+
+def _spool_extraction(file_path: str, content_file, chunk_file) -> int:
+    """
+    Extract and chunk a document into spool files, outside any database transaction
+    
+    The text is written to content_file as it streams (joined as by
+    join_blocks) and the chunks to chunk_file as JSON lines, so memory
+    holds one page and one open chunk rather than the whole document.
+    
+    Returns:
+        Word count of the extracted text
+    """
+    word_count = 0
+    
+    def extracted_blocks():
+        nonlocal word_count
+        for index, block in enumerate(_worker_processor.iter_blocks(file_path)):
+            if index:
+                content_file.write(block_separator(block))
+            content_file.write(block['text'])
+            word_count += len(block['text'].split())
+            yield block
+    
+    for chunk in _worker_processor.chunk_blocks(extracted_blocks()):
+        chunk_file.write(json.dumps(chunk, ensure_ascii=False) + '\n')
+    
+    content_file.seek(0)
+    chunk_file.seek(0)
+    return word_count
+
+def process_document(document_id: int) -> str:
+    """
+    Extract, chunk and index one claimed document (runs in a worker process)
+    
+    Extraction (and OCR) can take minutes, so it runs before any write:
+    the results are spooled to temporary files and stored in one short
+    transaction at the end. Embeddings are computed after that commit.
+    
+    Results are only written while the document is still this job's claim
+    (same file and claim time); a document replaced or reclaimed meanwhile
+    is left to the job processing its new state.
+    
+    Returns:
+        Final processing status of the document ('replaced' when the claim was lost)
+    """
+    with _worker_app.app_context():
+        claim = db.session.query(Document.file_path, Document.processing_started).filter_by(id=document_id).first()
+        db.session.rollback()  # no transaction stays open during extraction
+        if claim is None:
+            return 'missing'
+        file_path = claim.file_path
+        
+        try:
+            with tempfile.TemporaryFile('w+', encoding='utf-8') as content_file, \
+                    tempfile.TemporaryFile('w+', encoding='utf-8') as chunk_file:
+                word_count = _spool_extraction(file_path, content_file, chunk_file)
+                content = content_file.read()
+                
+                # Short write transaction: index, content and status together
+                document = db.session.get(Document, document_id, with_for_update=True)
+                if not document:
+                    db.session.rollback()
+                    return 'missing'
+                
+                chunk_count = _worker_index.index_document(document, (json.loads(line) for line in chunk_file))
+                
+                # Replaced by an upload while extracting: the new content is already queued
+                if not _holds_claim(document, claim):
+                    db.session.rollback()
+                    logger.info(f"🔁 تم استبدال المستند {document_id} أثناء معالجته")
+                    return 'replaced'
+                
+                document.content = content
+                document.word_count = word_count
+                
+                # Language of the extracted text, from a bounded sample (never re-extracted)
+                language_stats = arabic_text.script_stats(content)
+                document.language = language_stats['language']
+                document.language_stats = language_stats
+                
+                document.processing_status = 'completed'
+                document.processing_error = None
+                db.session.commit()
+                del content  # not held while embedding
+            
+            logger.info(f"✅ تمت معالجة المستند {document_id}")
+        
+        except Exception as e:
+            db.session.rollback()
+            document = db.session.get(Document, document_id, with_for_update=True)
+            if not document:
+                db.session.rollback()
+                return 'missing'
+            
+            # A failure on the old file (e.g. deleted after a replacement) must not fail the new upload
+            if not _holds_claim(document, claim):
+                db.session.rollback()
+                logger.info(f"🔁 تم استبدال المستند {document_id} أثناء معالجته، تم تجاهل الخطأ: {e}")
+                return 'replaced'
+            
+            document.processing_status = 'failed'
+            document.processing_error = str(e)
+            db.session.commit()
+            logger.error(f"❌ فشل في معالجة المستند {document_id}: {e}")
+            return 'failed'
+        
+        if chunk_count and _worker_semantic_index:
+            _embed_document(document_id)
+        return 'completed'
+
+def _holds_claim(document: Document, claim) -> bool:
+    """Whether a document is still in the state a job claimed (not replaced or reclaimed since)"""
+    return (
+        document.processing_status == 'processing'
+        and document.file_path == claim.file_path
+        and document.processing_started == claim.processing_started
+    )
+
+def _embed_document(document_id: int):
+    """Embed the committed chunks of a document (queries then only embed the question)"""
+    try:
+        chunks = db.session.query(DocumentChunk.id, DocumentChunk.text).filter_by(
+            document_id=document_id
+        ).order_by(DocumentChunk.chunk_index).all()
+        db.session.rollback()
+        _worker_semantic_index.index_document(document_id, chunks)
+    except Exception as e:
+        # Lexical retrieval still covers the document; 'flask reindex' re-embeds it
+        _worker_semantic_index.remove_document(document_id)
+        logger.error(f"❌ فشل في تضمين المستند {document_id}: {e}")
+
+class IngestionQueue:
+    """Database-backed ingestion queue drained by a local process pool"""
+    
+    def __init__(self, app: Flask, max_workers: int = 2, poll_interval: float = 5.0, stale_timeout: float = 1800.0):
+        """
+        Initialize the queue
+        
+        Args:
+            app: Flask app whose database holds the queue (documents table)
+            max_workers: Number of extraction processes
+            poll_interval: Seconds between scans for pending documents
+            stale_timeout: Seconds after which a 'processing' claim is taken to belong to a dead worker
+        """
+        self.app = app
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.stale_timeout = stale_timeout
+        
+        self._executor = None
+        self._dispatcher = None
+        self._last_reclaim = 0.0
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'replaced': 0, 'missing': 0}
+    
+    def start(self):
+        """
+        Start the worker pool and dispatcher thread (idempotent)
+        
+        Called explicitly by the process that runs the queue ('flask ingest'
+        or python app.py), never at import: spawned worker processes
+        re-import the main module and must not start dispatchers of their own.
+        """
+        if multiprocessing.parent_process() is not None:
+            logger.warning("⚠️ لا يمكن تشغيل طابور المعالجة من داخل عملية فرعية")
+            return
+        
+        with self._lock:
+            if self._dispatcher and self._dispatcher.is_alive():
+                return
+            
+            self._reclaim_stale()
+            config = {key: self.app.config[key] for key in WORKER_CONFIG_KEYS if key in self.app.config}
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(config,)
+            )
+            self._dispatcher = threading.Thread(target=self._run, name='ingestion-dispatcher', daemon=True)
+            self._dispatcher.start()
+            logger.info(f"✅ تم تشغيل طابور المعالجة بـ {self.max_workers} عملية")
+    
+    def enqueue(self, document_id: int):
+        """
+        Signal that a pending document is waiting (the row itself is the job)
+        
+        The dispatcher picks the row up on its next poll wherever it runs;
+        when it runs in this process, it is woken up right away.
+        """
+        self._wakeup.set()
+    
+    def join(self):
+        """Block while the dispatcher runs (foreground 'flask ingest' process)"""
+        while self._dispatcher and self._dispatcher.is_alive():
+            self._dispatcher.join(timeout=1.0)
+    
+    def shutdown(self):
+        """Stop handing out work; documents in flight are reclaimed after stale_timeout"""
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+    
+    def get_stats(self) -> Dict:
+        """Get queue statistics"""
+        with self.app.app_context():
+            pending = Document.query.filter_by(processing_status='pending').count()
+        
+        return {
+            'workers': self.max_workers,
+            'running': bool(self._dispatcher and self._dispatcher.is_alive()),
+            'in_flight': self._in_flight,
+            'pending': pending,
+            **self._stats
+        }
+    
+    def _run(self):
+        """Dispatcher loop: claim pending documents while workers are free"""
+        while True:
+            try:
+                if time.monotonic() - self._last_reclaim >= self.stale_timeout / 2:
+                    self._reclaim_stale()
+                
+                while self._in_flight < self.max_workers:
+                    document_id = self._claim_next()
+                    if document_id is None:
+                        break
+                    self._submit(document_id)
+            except Exception as e:
+                logger.error(f"❌ خطأ في طابور المعالجة: {e}")
+            
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+    
+    def _claim_next(self) -> Optional[int]:
+        """Atomically move the oldest pending document to 'processing'"""
+        with self.app.app_context():
+            candidate = db.session.query(Document.id).filter_by(
+                processing_status='pending'
+            ).order_by(Document.upload_date, Document.id).first()
+            
+            if not candidate:
+                return None
+            
+            # Conditional update so that concurrent dispatchers never claim the same row
+            claimed = Document.query.filter_by(
+                id=candidate.id, processing_status='pending'
+            ).update(
+                {'processing_status': 'processing', 'processing_started': datetime.utcnow()},
+                synchronize_session=False
+            )
+            db.session.commit()
+            
+            return candidate.id if claimed else self._claim_next()
+    
+    def _reclaim_stale(self):
+        """Put back 'processing' documents whose worker died (claimed longer ago than stale_timeout)"""
+        self._last_reclaim = time.monotonic()
+        try:
+            with self.app.app_context():
+                cutoff = datetime.utcnow() - timedelta(seconds=self.stale_timeout)
+                reclaimed = Document.query.filter(
+                    Document.processing_status == 'processing',
+                    db.or_(Document.processing_started.is_(None), Document.processing_started < cutoff)
+                ).update({'processing_status': 'pending'}, synchronize_session=False)
+                db.session.commit()
+            
+            if reclaimed:
+                logger.warning(f"⚠️ تمت إعادة {reclaimed} مستند عالق إلى طابور المعالجة")
+        except Exception as e:
+            logger.error(f"❌ فشل في استعادة المستندات العالقة: {e}")
+    
+    def _submit(self, document_id: int):
+        """Hand a claimed document to the process pool"""
+        with self._lock:
+            self._in_flight += 1
+            self._stats['submitted'] += 1
+        
+        try:
+            future = self._executor.submit(process_document, document_id)
+        except Exception:
+            # Pool unusable (shut down or broken): give the claim back instead of leaving it 'processing'
+            with self._lock:
+                self._in_flight -= 1
+            with self.app.app_context():
+                Document.query.filter_by(id=document_id, processing_status='processing').update(
+                    {'processing_status': 'pending'}, synchronize_session=False
+                )
+                db.session.commit()
+            raise
+        
+        future.add_done_callback(lambda done: self._on_done(document_id, done))
+    
+    def _on_done(self, document_id: int, future):
+        """Record the result and wake the dispatcher for the next job"""
+        with self._lock:
+            self._in_flight -= 1
+        
+        try:
+            status = future.result()
+        except Exception as e:
+            # The worker process died before it could record the failure
+            status = 'failed'
+            self._mark_failed(document_id, str(e))
+        
+        # 'replaced' and 'missing' jobs processed nothing: their document changed or was deleted meanwhile
+        with self._lock:
+            self._stats[status] += 1
+        self._wakeup.set()
+    
+    def _mark_failed(self, document_id: int, error: str):
+        """Mark a document as failed from the web process"""
+        try:
+            with self.app.app_context():
+                Document.query.filter_by(id=document_id).update(
+                    {'processing_status': 'failed', 'processing_error': error},
+                    synchronize_session=False
+                )
+                db.session.commit()
+        except Exception as e:
+            logger.error(f"❌ فشل في تحديث حالة المستند {document_id}: {e}")
+        logger.error(f"❌ توقفت معالجة المستند {document_id}: {error}")
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Document Lifecycle Events
+تطبيق المدرس AI المحسن - أحداث دورة حياة المستندات
+
+Author: Teacher AI Enhanced Team
+Version: 2.0.0
+"""
+
+import logging
+from collections import Counter
+from typing import Callable, Dict, List
+
+from sqlalchemy import event
+
+from database import db, DocumentChunk
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Session.info key of the events waiting for the transaction to commit
+PENDING_EVENTS_KEY = 'document_events'
+
+class DocumentEvent:
+    """A document was created, replaced by new content, or deleted"""
+    
+    CREATED = 'created'
+    REPLACED = 'replaced'
+    DELETED = 'deleted'
+    
+    def __init__(self, event_type: str, document_id: int, chunk_ids: List[int] = None):
+        self.event_type = event_type
+        self.document_id = document_id
+        self.chunk_ids = chunk_ids or []  # chunks of the content being replaced or deleted
+    
+    def __repr__(self):
+        return f'<DocumentEvent {self.event_type} {self.document_id}>'
+
+class DocumentEvents:
+    """
+    Dispatches document lifecycle events to the components derived from documents
+    
+    Handlers subscribed normally run inside the caller's transaction, so
+    index cleanup commits or rolls back together with the document change.
+    Handlers subscribed with after_commit=True run once that transaction
+    has committed (e.g. waking the ingestion queue, which reads the
+    committed row from another session); a rollback drops them.
+    """
+    
+    def __init__(self, session=None):
+        """Initialize the dispatcher on a SQLAlchemy (scoped) session"""
+        self.session = session or db.session
+        self._handlers: List[Callable[[DocumentEvent], None]] = []
+        self._committed_handlers: List[Callable[[DocumentEvent], None]] = []
+        self._stats = Counter()
+        
+        event.listen(self.session, 'after_commit', self._after_commit)
+        event.listen(self.session, 'after_soft_rollback', self._after_rollback)
+    
+    def subscribe(self, handler: Callable[[DocumentEvent], None], after_commit: bool = False):
+        """Register a handler for every event"""
+        (self._committed_handlers if after_commit else self._handlers).append(handler)
+    
+    def emit(self, event_type: str, document_id: int) -> DocumentEvent:
+        """
+        Publish an event for a document
+        
+        For replaced and deleted documents this must run before their old
+        chunks are removed, so that handlers learn which chunk ids go away.
+        """
+        chunk_ids = []
+        if event_type != DocumentEvent.CREATED:
+            chunk_ids = [
+                chunk_id for (chunk_id,) in
+                self.session.query(DocumentChunk.id).filter_by(document_id=document_id)
+            ]
+        
+        document_event = DocumentEvent(event_type, document_id, chunk_ids)
+        for handler in self._handlers:
+            handler(document_event)
+        
+        self.session.info.setdefault(PENDING_EVENTS_KEY, []).append(document_event)
+        self._stats[event_type] += 1
+        logger.info(f"📣 حدث مستند: {event_type} للمستند {document_id} ({len(chunk_ids)} مقطع)")
+        return document_event
+    
+    def get_stats(self) -> Dict:
+        """Get the number of events emitted per type"""
+        return dict(self._stats)
+    
+    def _after_commit(self, session):
+        """Run the after-commit handlers for the events of the committed transaction"""
+        for document_event in session.info.pop(PENDING_EVENTS_KEY, []):
+            for handler in self._committed_handlers:
+                try:
+                    handler(document_event)
+                except Exception as e:
+                    logger.error(f"❌ فشل معالج الحدث {document_event}: {e}")
+    
+    def _after_rollback(self, session, previous_transaction):
+        """Forget the events of a rolled back transaction"""
+        session.info.pop(PENDING_EVENTS_KEY, None)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Prompt Builder
+تطبيق المدرس AI المحسن - بناء الطلب ضمن ميزانية الرموز
+
+Author: Teacher AI Enhanced Team
+Version: 2.0.0
+"""
+
+import logging
+from typing import List, Dict, Optional
+
+import arabic_text
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Separator between retrieved passages in the context string (see app.retrieve_document_context)
+PASSAGE_SEPARATOR = "\n\n"
+
+# Marker appended to text cut to fit its budget
+TRUNCATION_MARKER = " …"
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text at a word boundary so that its estimated size fits max_tokens"""
+    if not text or max_tokens <= 0:
+        return ""
+    
+    total = arabic_text.estimate_tokens(text)
+    if total <= max_tokens:
+        return text
+    
+    # Start from the proportional cut and shrink until the estimate fits
+    cut = int(len(text) * max_tokens / total)
+    while cut > 0 and arabic_text.estimate_tokens(text[:cut]) + 1 > max_tokens:
+        cut = int(cut * 0.9)
+    
+    head = text[:cut]
+    if ' ' in head:
+        head = head.rsplit(' ', 1)[0]
+    return head + TRUNCATION_MARKER if head else ""
+
+class PromptBuilder:
+    """Assembles the user prompt within a token budget split across its sections"""
+    
+    SECTIONS = ('system', 'instructions', 'question', 'history', 'context')
+    
+    def __init__(self, max_input_tokens: int = 12000, max_question_tokens: int = 1000,
+                 max_history_tokens: int = 1500, max_history_messages: int = 16):
+        """
+        Initialize the builder
+        
+        Args:
+            max_input_tokens: Budget for everything sent to the provider
+            max_question_tokens: Cap for the current question
+            max_history_tokens: Cap for earlier conversation turns
+            max_history_messages: Most recent turns considered for history
+        """
+        self.max_input_tokens = max_input_tokens
+        self.max_question_tokens = max_question_tokens
+        self.max_history_tokens = max_history_tokens
+        self.max_history_messages = max_history_messages
+    
+    def build(
+        self,
+        system_prompt: str,
+        question: str,
+        instructions: str,
+        context: str = "",
+        conversation_history: Optional[List[Dict]] = None,
+        conversation_summary: str = ""
+    ) -> Dict:
+        """
+        Fit the prompt sections into the budget
+        
+        System prompt and instructions are fixed. The question is capped,
+        history keeps the conversation summary (up to half of its share)
+        and the newest turns that fit the rest of its share (at most a third
+        of the remaining budget), and retrieved passages get whatever is
+        left, kept whole in ranking order with only the last one cut.
+        
+        Returns:
+            Dict with 'system', 'context' (the passages section), 'prompt'
+            (history, question and instructions), per-section 'token_counts'
+            and the names of 'truncated' sections
+        """
+        counts = dict.fromkeys(self.SECTIONS, 0)
+        truncated = []
+        
+        counts['system'] = arabic_text.estimate_tokens(system_prompt)
+        counts['instructions'] = arabic_text.estimate_tokens(instructions)
+        remaining = self.max_input_tokens - counts['system'] - counts['instructions']
+        
+        fitted_question = truncate_to_tokens(question, min(self.max_question_tokens, remaining))
+        if fitted_question != question:
+            truncated.append('question')
+        counts['question'] = arabic_text.estimate_tokens(fitted_question)
+        remaining -= counts['question']
+        
+        # History never takes more than a third of what is left, so passages keep room
+        history_budget = min(self.max_history_tokens, remaining // 3)
+        
+        fitted_summary = truncate_to_tokens(conversation_summary, history_budget // 2)
+        summary_tokens = arabic_text.estimate_tokens(fitted_summary)
+        
+        history_lines, history_tokens, history_cut = self._fit_history(
+            conversation_history or [], history_budget - summary_tokens
+        )
+        if history_cut or fitted_summary != conversation_summary:
+            truncated.append('history')
+        counts['history'] = summary_tokens + history_tokens
+        remaining -= counts['history']
+        
+        passages, counts['context'], context_cut = self._fit_context(context, remaining)
+        if context_cut:
+            truncated.append('context')
+        
+        conversation_context = ""
+        if fitted_summary:
+            conversation_context = f"\n**ملخص المحادثة السابقة:**\n{fitted_summary}\n"
+        if history_lines:
+            conversation_context += "\n**السياق من المحادثة السابقة:**\n" + "\n".join(history_lines) + "\n"
+        
+        document_context = ""
+        if passages:
+            document_context = f"\n**المحتوى المرجعي:**\n{PASSAGE_SEPARATOR.join(passages)}\n"
+        
+        # Passages come first so that the stable part of the turn forms a cacheable prefix
+        prompt = f"""{conversation_context}
+
+**السؤال الحالي:** {fitted_question}
+
+{instructions}"""
+        
+        counts['total'] = sum(counts[section] for section in self.SECTIONS)
+        if truncated:
+            logger.info(f"✂️ تم تقليص أجزاء الطلب لتناسب الميزانية: {', '.join(truncated)}")
+        
+        return {
+            'system': system_prompt,
+            'context': document_context,
+            'prompt': prompt,
+            'token_counts': counts,
+            'truncated': truncated
+        }
+    
+    def _fit_history(self, conversation_history: List[Dict], budget: int):
+        """Keep the newest turns that fit; returns (lines oldest first, tokens, truncated)"""
+        recent = conversation_history[-self.max_history_messages:]
+        lines = []
+        used = 0
+        
+        for msg in reversed(recent):
+            role = "المستخدم" if msg.get('type') == 'user' else "المساعد"
+            line = f"{role}: {msg.get('text', '')}"
+            tokens = arabic_text.estimate_tokens(line)
+            
+            if used + tokens > budget:
+                # A long turn is shortened rather than dropped when it is the newest one
+                if not lines and budget > 0:
+                    line = truncate_to_tokens(line, budget)
+                    if line:
+                        lines.append(line)
+                        used += arabic_text.estimate_tokens(line)
+                return list(reversed(lines)), used, True
+            
+            lines.append(line)
+            used += tokens
+        
+        return list(reversed(lines)), used, len(recent) < len(conversation_history)
+    
+    def _fit_context(self, context: str, budget: int):
+        """Keep passages in order while they fit; returns (passages, tokens, truncated)"""
+        if not context:
+            return [], 0, False
+        
+        passages = []
+        used = 0
+        separator_tokens = arabic_text.estimate_tokens(PASSAGE_SEPARATOR)
+        
+        for passage in context.split(PASSAGE_SEPARATOR):
+            tokens = arabic_text.estimate_tokens(passage) + (separator_tokens if passages else 0)
+            if used + tokens > budget:
+                rest = truncate_to_tokens(passage, budget - used - separator_tokens)
+                if rest:
+                    passages.append(rest)
+                    used += arabic_text.estimate_tokens(rest) + (separator_tokens if len(passages) > 1 else 0)
+                return passages, used, True
+            
+            passages.append(passage)
+            used += tokens
+        
+        return passages, used, False
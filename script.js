@@ -36,9 +36,13 @@ class TeacherAI {
             averageResponseTime: 0
         };
         
+        // Files above this size are uploaded in resumable chunks
+        this.chunkedUploadThreshold = 8 * 1024 * 1024;
+
         // API Endpoints
         this.apiEndpoints = {
             upload: '/api/upload',
+            uploads: '/api/uploads',
             chat: '/api/chat',
             documents: '/api/documents',
             search: '/api/search',
@@ -1746,7 +1750,8 @@ class TeacherAI {
                 content += '<div class="message-sources">';
                 content += '<strong><i class="fas fa-book"></i> المصادر:</strong><br>';
                 metadata.sources.forEach(source => {
-                    content += `📄 ${source.filename}<br>`;
+                    const pages = source.pages && source.pages.length ? ` (صفحة ${source.pages.join('، ')})` : '';
+                    content += `📄 ${source.filename}${pages}<br>`;
                 });
                 content += '</div>';
             }
@@ -2124,17 +2129,30 @@ class TeacherAI {
         this.showNotification(`📤 جاري رفع ${validFiles.length} ملف...`, 'info');
 
         try {
-            const formData = new FormData();
-            validFiles.forEach(file => {
-                formData.append('files', file);
-            });
+            // Large files go through the resumable chunked upload API
+            const largeFiles = validFiles.filter(file => file.size > this.chunkedUploadThreshold);
+            const smallFiles = validFiles.filter(file => file.size <= this.chunkedUploadThreshold);
+            const results = [];
 
-            const response = await fetch(this.apiEndpoints.upload, {
-                method: 'POST',
-                body: formData
-            });
+            for (const file of largeFiles) {
+                results.push(await this.uploadFileInChunks(file));
+            }
+
+            if (smallFiles.length > 0) {
+                const formData = new FormData();
+                smallFiles.forEach(file => {
+                    formData.append('files', file);
+                });
 
-            const result = await response.json();
+                const response = await fetch(this.apiEndpoints.upload, {
+                    method: 'POST',
+                    body: formData
+                });
+                results.push(await response.json());
+            }
+
+            const failed = results.find(item => item.status !== 'success');
+            const result = failed || results[results.length - 1];
 
             if (result.status === 'success') {
                 this.showNotification(result.message || 'تم رفع الملفات بنجاح ✅', 'success');
@@ -2153,6 +2171,47 @@ class TeacherAI {
         }
     }
 
+    /**
+     * Upload one file in resumable chunks (init, PUT each chunk at its offset, complete)
+     */
+    async uploadFileInChunks(file) {
+        const init = await fetch(this.apiEndpoints.uploads, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size })
+        }).then(response => response.json());
+
+        if (init.status !== 'success') return init;
+
+        const uploadUrl = `${this.apiEndpoints.uploads}/${init.upload_id}`;
+        let offset = init.offset;
+        let retries = 0;
+
+        while (offset < file.size) {
+            try {
+                const response = await fetch(`${uploadUrl}?offset=${offset}`, {
+                    method: 'PUT',
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    body: file.slice(offset, offset + init.chunk_size)
+                });
+                const result = await response.json();
+
+                // 409 carries the offset the server expects; resume from there
+                if (result.status !== 'success' && response.status !== 409) return result;
+                offset = result.offset;
+                retries = 0;
+            } catch (error) {
+                if (++retries > 3) throw error;
+                const status = await fetch(uploadUrl).then(response => response.json());
+                if (status.status !== 'success') return status;
+                offset = status.offset;
+            }
+            console.log(`📤 ${file.name}: ${Math.round(offset * 100 / file.size)}%`);
+        }
+
+        return fetch(`${uploadUrl}/complete`, { method: 'POST' }).then(response => response.json());
+    }
+
     /**
      * Check if file type is valid
      */
@@ -2325,9 +2384,16 @@ class TeacherAI {
      */
     async loadDocuments() {
         try {
-            const response = await this.apiRequest('GET', this.apiEndpoints.documents);
+            // The listing is paginated; follow next_cursor until the last page
+            const documents = [];
+            let response = await this.apiRequest('GET', this.apiEndpoints.documents);
+            while (response.status === 'success') {
+                documents.push(...(response.documents || []));
+                if (!response.next_cursor) break;
+                response = await this.apiRequest('GET', this.apiEndpoints.documents, { cursor: response.next_cursor });
+            }
             if (response.status === 'success') {
-                this.documents = response.documents || [];
+                this.documents = documents;
                 this.displayDocuments();
                 this.updateFilesCount();
                 console.log(`📚 تم تحميل ${this.documents.length} ملف`);
@@ -2494,7 +2560,7 @@ class TeacherAI {
             html += `
                 <div class="search-result-item">
                     <div class="search-result-title">📄 ${result.filename}</div>
-                    <div class="search-result-content">${result.content_preview}</div>
+                    <div class="search-result-content">${(result.snippets || []).map(snippet => snippet.highlighted).join(' … ') || result.content_preview}</div>
                     <div class="search-result-meta">
                         📝 ${result.word_count} كلمة • 📅 ${this.formatDate(new Date(result.created_at))}
                     </div>
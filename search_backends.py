@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Full-Text Search Backends
+تطبيق المدرس AI المحسن - محركات البحث النصي الكامل
+
+Author: Teacher AI Enhanced Team
+Version: 2.0.0
+"""
+
+import logging
+from typing import List, Tuple
+
+from sqlalchemy import text
+
+from database import db
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# (chunk_id, document_id, score) of the best chunk per document, and the number of matching documents
+SearchPage = Tuple[List[Tuple[int, int, float]], int]
+
+class SearchBackend:
+    """
+    Ranks documents for /api/search from the normalized chunk terms
+    
+    All backends search DocumentChunk.search_text, the space-joined index
+    terms written by SearchIndex.index_document, so Arabic letter folding
+    and stemming behave the same whichever database is used.
+    """
+    
+    name = 'base'
+    
+    def install(self):
+        """
+        Create the backend's database objects (idempotent DDL)
+        
+        Run with the schema setup (flask init-db), never from search():
+        DDL takes exclusive table locks that would stall concurrent requests.
+        """
+    
+    def search(self, terms: List[str], limit: int, offset: int = 0) -> SearchPage:
+        """Return one page of documents ranked by their best chunk"""
+        raise NotImplementedError
+
+class PostingsSearchBackend(SearchBackend):
+    """Portable backend over the application's own BM25 postings (SearchIndex)"""
+    
+    name = 'index'
+    
+    # Chunks scanned to fill pages of documents
+    MAX_CANDIDATE_CHUNKS = 1000
+    
+    def __init__(self, search_index):
+        self.search_index = search_index
+    
+    def search(self, terms: List[str], limit: int, offset: int = 0) -> SearchPage:
+        best = {}
+        for chunk_id, document_id, score in self.search_index.search_terms(terms, limit=self.MAX_CANDIDATE_CHUNKS):
+            best.setdefault(document_id, (chunk_id, document_id, score))
+        
+        ranked = list(best.values())
+        return ranked[offset:offset + limit], len(ranked)
+
+class SQLiteFTSSearchBackend(SearchBackend):
+    """SQLite FTS5 external-content table over document_chunks, synced by triggers"""
+    
+    name = 'sqlite_fts5'
+    
+    TRIGGERS = (
+        """CREATE TRIGGER IF NOT EXISTS document_chunks_fts_insert AFTER INSERT ON document_chunks BEGIN
+            INSERT INTO document_chunks_fts(rowid, search_text) VALUES (new.id, new.search_text);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS document_chunks_fts_delete AFTER DELETE ON document_chunks BEGIN
+            INSERT INTO document_chunks_fts(document_chunks_fts, rowid, search_text)
+            VALUES ('delete', old.id, old.search_text);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS document_chunks_fts_update AFTER UPDATE OF search_text ON document_chunks BEGIN
+            INSERT INTO document_chunks_fts(document_chunks_fts, rowid, search_text)
+            VALUES ('delete', old.id, old.search_text);
+            INSERT INTO document_chunks_fts(rowid, search_text) VALUES (new.id, new.search_text);
+        END""",
+    )
+    
+    def install(self):
+        exists = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'document_chunks_fts'"
+        )).first()
+        
+        db.session.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS document_chunks_fts USING fts5("
+            "search_text, content='document_chunks', content_rowid='id', tokenize='unicode61 remove_diacritics 0')"
+        ))
+        for trigger in self.TRIGGERS:
+            db.session.execute(text(trigger))
+        
+        if not exists:
+            # Index the chunks stored before the table existed
+            db.session.execute(text("INSERT INTO document_chunks_fts(document_chunks_fts) VALUES ('rebuild')"))
+            logger.info("✅ تم إنشاء فهرس FTS5 للبحث")
+        db.session.commit()
+    
+    def search(self, terms: List[str], limit: int, offset: int = 0) -> SearchPage:
+        # Any term may match; bm25() ranks chunks matching more and rarer terms first
+        match = ' OR '.join(f'"{term}"' for term in terms)
+        hits = """
+            WITH hits AS (
+                SELECT rowid AS chunk_id, -bm25(document_chunks_fts) AS score
+                FROM document_chunks_fts WHERE document_chunks_fts MATCH :match
+            ),
+            best AS (
+                SELECT hits.chunk_id, c.document_id, hits.score,
+                       row_number() OVER (PARTITION BY c.document_id ORDER BY hits.score DESC) AS position
+                FROM hits JOIN document_chunks c ON c.id = hits.chunk_id
+            )
+        """
+        rows = db.session.execute(text(hits + """
+            SELECT chunk_id, document_id, score FROM best WHERE position = 1
+            ORDER BY score DESC, document_id LIMIT :limit OFFSET :offset
+        """), {'match': match, 'limit': limit, 'offset': offset}).all()
+        total = db.session.execute(text(hits + "SELECT count(*) FROM best WHERE position = 1"), {'match': match}).scalar()
+        
+        return [(row.chunk_id, row.document_id, float(row.score)) for row in rows], total or 0
+
+class PostgresSearchBackend(SearchBackend):
+    """PostgreSQL generated tsvector column with a GIN index"""
+    
+    name = 'postgres_tsvector'
+    
+    def install(self):
+        # The 'simple' configuration keeps our own normalized, stemmed terms as they are
+        db.session.execute(text(
+            "ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(search_text, ''))) STORED"
+        ))
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_document_chunks_search_vector "
+            "ON document_chunks USING GIN (search_vector)"
+        ))
+        db.session.commit()
+    
+    def search(self, terms: List[str], limit: int, offset: int = 0) -> SearchPage:
+        query = ' | '.join(terms)
+        hits = """
+            WITH hits AS (
+                SELECT c.id AS chunk_id, c.document_id,
+                       ts_rank_cd(c.search_vector, to_tsquery('simple', :query)) AS score
+                FROM document_chunks c
+                WHERE c.search_vector @@ to_tsquery('simple', :query)
+            ),
+            best AS (
+                SELECT DISTINCT ON (document_id) chunk_id, document_id, score
+                FROM hits ORDER BY document_id, score DESC
+            )
+        """
+        rows = db.session.execute(text(hits + """
+            SELECT chunk_id, document_id, score FROM best
+            ORDER BY score DESC, document_id LIMIT :limit OFFSET :offset
+        """), {'query': query, 'limit': limit, 'offset': offset}).all()
+        total = db.session.execute(text(hits + "SELECT count(*) FROM best"), {'query': query}).scalar()
+        
+        return [(row.chunk_id, row.document_id, float(row.score)) for row in rows], total or 0
+
+def create_search_backend(search_index, dialect_name: str, preferred: str = 'auto') -> SearchBackend:
+    """
+    Pick the search backend for the database in use
+    
+    Args:
+        search_index: SearchIndex used by the portable postings backend
+        dialect_name: SQLAlchemy dialect name (sqlite, postgresql, ...)
+        preferred: 'auto' for the database's native full-text search, 'index' for postings
+    """
+    if preferred != 'index':
+        if dialect_name == 'sqlite':
+            return SQLiteFTSSearchBackend()
+        if dialect_name == 'postgresql':
+            return PostgresSearchBackend()
+    
+    return PostingsSearchBackend(search_index)
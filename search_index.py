@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Search Index
+تطبيق المدرس AI المحسن - فهرس البحث
+
+Author: Teacher AI Enhanced Team
+Version: 2.0.0
+"""
+
+import math
+import logging
+from itertools import islice
+from collections import Counter, defaultdict
+from typing import List, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy.orm import undefer_group
+
+import arabic_text
+from database import db, Document, DocumentChunk, IndexPosting
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Chunks written per flush while indexing a chunk stream
+INDEX_BATCH_CHUNKS = 200
+
+class SearchIndex:
+    """Persistent chunk-level inverted index (term -> postings) with BM25 ranking"""
+    
+    def __init__(self, k1: float = 1.5, b: float = 0.75, min_term_length: int = 2, max_term_length: int = 100):
+        """Initialize the index with BM25 parameters"""
+        self.k1 = k1
+        self.b = b
+        self.min_term_length = min_term_length
+        self.max_term_length = max_term_length
+    
+    def tokenize(self, text: str) -> List[str]:
+        """Split text into normalized, stemmed index terms"""
+        if not text:
+            return []
+        
+        return [
+            term for term in arabic_text.tokenize(text, min_length=self.min_term_length)
+            if len(term) <= self.max_term_length
+        ]
+    
+    def term_occurrences(self, text: str) -> List[Tuple[str, int, int]]:
+        """Index terms of a text with their (start, end) character offsets"""
+        return [
+            (term, start, end) for term, start, end in arabic_text.iter_terms(text, min_length=self.min_term_length)
+            if len(term) <= self.max_term_length
+        ]
+    
+    def index_document(self, document: Document, chunks: Iterable[Dict]) -> int:
+        """
+        Store a document's chunks and build their postings, replacing any previous ones
+        
+        Chunks may be a stream (e.g. read back from a spool file); they are
+        written in batches, so only one batch of rows is held at a time.
+        The caller owns the transaction and is expected to commit; it should
+        produce the chunks before opening it, since the first batch takes
+        the database write lock.
+        
+        Args:
+            document: Persisted document row (must have an id)
+            chunks: Chunk dicts from DocumentProcessor.chunk_text or chunk_blocks
+        
+        Returns:
+            Number of stored chunks
+        """
+        self.remove_document(document.id)
+        
+        chunk_count = 0
+        posting_count = 0
+        chunks = iter(chunks)
+        while True:
+            batch = list(islice(chunks, INDEX_BATCH_CHUNKS))
+            if not batch:
+                break
+            posting_count += self._index_batch(document, batch, chunk_count)
+            chunk_count += len(batch)
+        
+        logger.info(f"🗂️ تمت فهرسة المستند {document.id}: {chunk_count} مقطع، {posting_count} إدخال")
+        return chunk_count
+    
+    def _index_batch(self, document: Document, chunks: List[Dict], first_index: int) -> int:
+        """Write one batch of chunks and their postings (returns the number of postings)"""
+        # One pass per chunk yields both the terms and where they occur
+        chunk_occurrences = [self.term_occurrences(chunk['text']) for chunk in chunks]
+        batch_rows = [
+            DocumentChunk(
+                document_id=document.id,
+                chunk_index=first_index + index,
+                offset=chunk['offset'],
+                page=chunk.get('page'),
+                text=chunk['text'],
+                token_count=chunk['token_count'],
+                search_text=' '.join(term for term, _, _ in occurrences)
+            )
+            for index, (chunk, occurrences) in enumerate(zip(chunks, chunk_occurrences))
+        ]
+        db.session.add_all(batch_rows)
+        db.session.flush()
+        
+        postings = []
+        for chunk, occurrences in zip(batch_rows, chunk_occurrences):
+            positions: Dict[str, List[str]] = defaultdict(list)
+            for term, start, end in occurrences:
+                positions[term].append(f"{start}:{end - start}")
+            
+            for term, term_positions in positions.items():
+                postings.append({
+                    'term': term,
+                    'chunk_id': chunk.id,
+                    'document_id': document.id,
+                    'term_frequency': len(term_positions),
+                    'positions': ' '.join(term_positions)
+                })
+        
+        if postings:
+            db.session.execute(IndexPosting.__table__.insert(), postings)
+        return len(postings)
+    
+    def remove_document(self, document_id: int):
+        """Remove all chunks and postings of a document"""
+        IndexPosting.query.filter_by(document_id=document_id).delete(synchronize_session=False)
+        DocumentChunk.query.filter_by(document_id=document_id).delete(synchronize_session=False)
+    
+    def search_chunks(self, query: str, limit: int = 10) -> List[Tuple[int, int, float]]:
+        """
+        Rank chunks for a query with BM25
+        
+        Only postings of the query terms are read, so the cost grows with
+        the number of matching postings rather than with the corpus size.
+        
+        Args:
+            query: Free-text query
+            limit: Maximum number of results
+        
+        Returns:
+            List of (chunk_id, document_id, score) sorted by descending score
+        """
+        return self.search_terms(self.tokenize(query), limit=limit)
+    
+    def search_terms(self, terms: Iterable[str], limit: int = 10) -> List[Tuple[int, int, float]]:
+        """
+        Rank chunks for index terms with BM25
+        
+        The terms are looked up as they are: they must already be normalized
+        and stemmed (tokenize); stemming them again would change them.
+        
+        Returns:
+            List of (chunk_id, document_id, score) sorted by descending score
+        """
+        terms = set(terms)
+        if not terms:
+            return []
+        
+        total_chunks, average_length = db.session.query(
+            db.func.count(DocumentChunk.id),
+            db.func.avg(DocumentChunk.token_count)
+        ).one()
+        
+        if not total_chunks:
+            return []
+        average_length = float(average_length or 1)
+        
+        postings = db.session.query(
+            IndexPosting.term,
+            IndexPosting.chunk_id,
+            IndexPosting.document_id,
+            IndexPosting.term_frequency,
+            DocumentChunk.token_count
+        ).join(DocumentChunk, DocumentChunk.id == IndexPosting.chunk_id).filter(
+            IndexPosting.term.in_(terms)
+        ).all()
+        
+        document_frequencies = Counter(posting.term for posting in postings)
+        scores: Dict[Tuple[int, int], float] = {}
+        
+        for term, chunk_id, document_id, term_frequency, chunk_length in postings:
+            idf = self._idf(total_chunks, document_frequencies[term])
+            length_norm = 1 - self.b + self.b * (chunk_length or 0) / average_length
+            score = idf * term_frequency * (self.k1 + 1) / (term_frequency + self.k1 * length_norm)
+            key = (chunk_id, document_id)
+            scores[key] = scores.get(key, 0.0) + score
+        
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [(chunk_id, document_id, score) for (chunk_id, document_id), score in ranked[:limit]]
+    
+    def search(self, query: str, limit: int = 10) -> List[Tuple[int, float]]:
+        """
+        Rank documents for a query by their best-scoring chunk
+        
+        Returns:
+            List of (document_id, score) sorted by descending score
+        """
+        best: Dict[int, float] = {}
+        for _, document_id, score in self.search_chunks(query, limit=limit * 10):
+            best[document_id] = max(best.get(document_id, 0.0), score)
+        
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:limit]
+    
+    def pack_context(self, query: str, max_tokens: int, limit: int = 50,
+                     ranked: Optional[List[Tuple[int, int, float]]] = None) -> List[DocumentChunk]:
+        """
+        Select the best-scoring chunks across all documents within a token budget
+        
+        Args:
+            query: Free-text query
+            max_tokens: Token budget for the packed context
+            limit: Maximum number of candidate chunks to consider
+            ranked: Precomputed (chunk_id, document_id, score) ranking, e.g. a hybrid one
+        
+        Returns:
+            DocumentChunk rows in ranking order
+        """
+        if ranked is None:
+            ranked = self.search_chunks(query, limit=limit)
+        if not ranked:
+            return []
+        
+        chunks_by_id = {
+            chunk.id: chunk
+            for chunk in DocumentChunk.query.filter(DocumentChunk.id.in_([chunk_id for chunk_id, _, _ in ranked]))
+        }
+        
+        packed = []
+        used_tokens = 0
+        for chunk_id, _, _ in ranked:
+            chunk = chunks_by_id.get(chunk_id)
+            if not chunk or used_tokens + chunk.token_count > max_tokens:
+                continue
+            packed.append(chunk)
+            used_tokens += chunk.token_count
+        
+        return packed
+    
+    def snippets(self, document_ids: List[int], terms: List[str], per_document: int = 3,
+                 window: int = 200) -> Dict[int, List[Dict]]:
+        """
+        Best passages of each document for a query, from the stored term positions
+        
+        Windows of up to `window` characters are ranked by local term density
+        (occurrences plus a bonus for each distinct query term), and the top
+        non-overlapping ones are cut from their chunks. No document text is
+        rescanned; only the chunks holding a selected window are read.
+        
+        Returns:
+            Dict of document_id -> list of {'chunk_id', 'offset' (in the
+            document), 'page', 'text', 'matches' ([start, end] in 'text'), 'score'}
+        """
+        if not document_ids or not terms or per_document <= 0:
+            return {}
+        
+        rows = db.session.query(
+            IndexPosting.document_id, IndexPosting.chunk_id, IndexPosting.term, IndexPosting.positions
+        ).filter(
+            IndexPosting.document_id.in_(document_ids),
+            IndexPosting.term.in_(set(terms))
+        ).all()
+        
+        # Occurrences per chunk, read from the positions column
+        occurrences: Dict[Tuple[int, int], List[Tuple[int, int, str]]] = defaultdict(list)
+        legacy_chunks = set()
+        for document_id, chunk_id, term, positions in rows:
+            if positions is None:
+                legacy_chunks.add(chunk_id)
+                continue
+            for position in positions.split():
+                start, length = position.split(':')
+                occurrences[(document_id, chunk_id)].append((int(start), int(start) + int(length), term))
+        
+        chunks: Dict[int, Tuple[int, Optional[int], str]] = {}  # chunk_id -> (offset, page, text)
+        if legacy_chunks:
+            # Postings written before positions were stored: locate terms in those chunks once
+            query_terms = set(terms)
+            for chunk in DocumentChunk.query.filter(DocumentChunk.id.in_(legacy_chunks)):
+                chunks[chunk.id] = (chunk.offset, chunk.page, chunk.text)
+                occurrences[(chunk.document_id, chunk.id)].extend(
+                    (start, end, term) for term, start, end in self.term_occurrences(chunk.text) if term in query_terms
+                )
+        
+        candidates: Dict[int, List[Tuple[float, int, int, int, List[Tuple[int, int]]]]] = defaultdict(list)
+        for (document_id, chunk_id), spans in occurrences.items():
+            spans = sorted(set(spans))
+            last = 0
+            for first in range(len(spans)):
+                # Extend the window over the following occurrences that still fit
+                last = max(last, first)
+                while last + 1 < len(spans) and spans[last + 1][1] - spans[first][0] <= window:
+                    last += 1
+                window_spans = spans[first:last + 1]
+                score = len(window_spans) + 2 * len({term for _, _, term in window_spans})
+                candidates[document_id].append((
+                    score, chunk_id, window_spans[0][0], window_spans[-1][1],
+                    [(start, end) for start, end, _ in window_spans]
+                ))
+        
+        selected: Dict[int, List[Tuple[float, int, int, int, List[Tuple[int, int]]]]] = {}
+        for document_id, document_candidates in candidates.items():
+            chosen = []
+            for candidate in sorted(document_candidates, key=lambda item: (-item[0], item[1], item[2])):
+                _, chunk_id, start, end, _ = candidate
+                if any(chunk_id == other[1] and start < other[3] and other[2] < end for other in chosen):
+                    continue
+                chosen.append(candidate)
+                if len(chosen) >= per_document:
+                    break
+            selected[document_id] = chosen
+        
+        needed = {candidate[1] for chosen in selected.values() for candidate in chosen} - set(chunks)
+        if needed:
+            for chunk_id, chunk_offset, chunk_page, chunk_text in db.session.query(
+                DocumentChunk.id, DocumentChunk.offset, DocumentChunk.page, DocumentChunk.text
+            ).filter(DocumentChunk.id.in_(needed)):
+                chunks[chunk_id] = (chunk_offset, chunk_page, chunk_text)
+        
+        results: Dict[int, List[Dict]] = {}
+        for document_id, chosen in selected.items():
+            results[document_id] = []
+            for score, chunk_id, start, end, spans in chosen:
+                chunk_offset, chunk_page, chunk_text = chunks.get(chunk_id, (0, None, ""))
+                
+                # Pad the matched span with context up to the window size, on word boundaries
+                margin = max(0, (window - (end - start)) // 2)
+                cut_start = max(0, start - margin)
+                cut_end = min(len(chunk_text), end + margin)
+                while cut_start > 0 and not chunk_text[cut_start - 1].isspace() and start - cut_start < margin + 20:
+                    cut_start -= 1
+                while cut_end < len(chunk_text) and not chunk_text[cut_end].isspace() and cut_end - end < margin + 20:
+                    cut_end += 1
+                
+                results[document_id].append({
+                    'chunk_id': chunk_id,
+                    'offset': chunk_offset + cut_start,
+                    'page': chunk_page,
+                    'text': chunk_text[cut_start:cut_end],
+                    'matches': [[span_start - cut_start, span_end - cut_start] for span_start, span_end in spans],
+                    'score': score
+                })
+        
+        return results
+    
+    def rebuild(self, document_processor) -> int:
+        """Re-chunk and re-index every stored document"""
+        count = 0
+        # One document's text in memory at a time (content is a deferred column)
+        for (document_id,) in db.session.query(Document.id).order_by(Document.id).all():
+            document = db.session.get(Document, document_id, options=[undefer_group('content')])
+            self.index_document(document, document_processor.chunk_text(document.content or ""))
+            db.session.expire(document, ['content'])
+            count += 1
+        db.session.commit()
+        logger.info(f"✅ تمت إعادة بناء الفهرس لـ {count} مستند")
+        return count
+    
+    def _idf(self, total_documents: int, document_frequency: int) -> float:
+        """BM25 inverse document frequency (always positive)"""
+        return math.log(1 + (total_documents - document_frequency + 0.5) / (document_frequency + 0.5))
@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Semantic Retrieval
+تطبيق المدرس AI المحسن - البحث الدلالي بالمتجهات
+
+Author: Teacher AI Enhanced Team
+Version: 2.0.0
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Tuple
+
+# Inter-process lock around compaction (POSIX only)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Vector math and local embedding model (optional)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+from database import db, Document, DocumentChunk
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+SEMANTIC_AVAILABLE = np is not None and SentenceTransformer is not None
+
+# Rows converted to float32 at a time when scoring a float16 matrix
+SCORE_BLOCK_ROWS = 65536
+
+class ChunkEmbedder:
+    """Local CPU sentence-embedding model, loaded on first use"""
+    
+    def __init__(self, model_name: str, batch_size: int = 32):
+        """
+        Initialize the embedder
+        
+        Args:
+            model_name: sentence-transformers model name or local path
+            batch_size: Texts encoded per forward pass
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._model = None
+        self._lock = threading.Lock()
+    
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        """Unit-length float32 vectors, one row per text"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = SentenceTransformer(self.model_name, device='cpu')
+                    logger.info(f"✅ تم تحميل نموذج التضمين: {self.model_name}")
+        
+        vectors = self._model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        return np.asarray(vectors, dtype=np.float32)
+
+class SemanticIndex:
+    """
+    Chunk embeddings in memory-mapped NumPy matrices with brute-force top-k
+    
+    Ingestion workers write one segment per document (vectors plus
+    (chunk_id, document_id) rows) under <directory>/segments. The processes
+    that answer queries share a compacted base matrix, memory-mapped
+    read-only, and each keeps the segments written since that compaction.
+    Removed or re-embedded documents are tombstoned: their base rows are
+    masked out of the scores until the next compaction merges the live
+    segments into a new base matrix. A query is one embedding and a matrix
+    product per mapped matrix.
+    
+    Compaction runs in one process at a time (a file lock, POSIX only). It
+    writes a new generation of files under unique names and publishes it
+    by atomically replacing base.json; the other processes map the new
+    generation on their next refresh.
+    """
+    
+    def __init__(self, directory: str, embedder: ChunkEmbedder, dtype: str = 'float16',
+                 refresh_interval: float = 30.0, compact_interval: float = 3600.0,
+                 max_recent_segments: int = 64, max_dead_ratio: float = 0.2):
+        """
+        Initialize the index
+        
+        Args:
+            directory: Folder holding the segments and the base matrix
+            embedder: Model used for chunks and queries
+            dtype: Storage type of the vectors ('float16' or 'float32')
+            refresh_interval: Seconds between checks for changed segments
+            compact_interval: Seconds after which pending changes are compacted anyway
+            max_recent_segments: Uncompacted segments that trigger a compaction
+            max_dead_ratio: Share of tombstoned base rows that triggers a compaction
+        """
+        self.directory = directory
+        self.segments_directory = os.path.join(directory, 'segments')
+        self.embedder = embedder
+        self.dtype = np.dtype(dtype)
+        self.refresh_interval = refresh_interval
+        self.compact_interval = compact_interval
+        self.max_recent_segments = max_recent_segments
+        self.max_dead_ratio = max_dead_ratio
+        
+        self._base_vectors = None
+        self._base_rows = None
+        self._base_alive = None
+        self._base_segments: Dict[int, int] = {}  # document_id -> segment mtime at compaction
+        self._base_manifest = None  # (mtime_ns, generation) of the mapped base.json
+        self._recent: Dict[int, Tuple] = {}  # document_id -> (mtime, vectors, rows)
+        self._tombstones = set()  # documents whose base rows are dead
+        
+        self._last_check = 0.0
+        self._last_compaction = time.monotonic()
+        self._lock = threading.Lock()
+        self.compactions = 0
+        
+        os.makedirs(self.segments_directory, exist_ok=True)
+    
+    def index_document(self, document_id: int, chunks: List[DocumentChunk]):
+        """Embed a document's stored chunks and write its segment, replacing any previous one"""
+        self.remove_document(document_id)
+        if not chunks:
+            return
+        
+        vectors = self.embedder.embed([chunk.text for chunk in chunks]).astype(self.dtype)
+        rows = np.array([(chunk.id, document_id) for chunk in chunks], dtype=np.int64)
+        
+        # Rows first, vectors last: a segment counts once its vectors file exists
+        vectors_path, rows_path = self._segment_paths(document_id)
+        self._write_array(rows_path, rows)
+        self._write_array(vectors_path, vectors)
+        logger.info(f"🧭 تم تضمين المستند {document_id}: {len(chunks)} مقطع")
+    
+    def remove_document(self, document_id: int):
+        """Delete a document's segment and tombstone its rows right away"""
+        for path in self._segment_paths(document_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        
+        with self._lock:
+            self._recent.pop(document_id, None)
+            if document_id in self._base_segments and document_id not in self._tombstones:
+                self._tombstones.add(document_id)
+                self._update_alive()
+    
+    def search(self, query: str, limit: int = 10) -> List[Tuple[int, int, float]]:
+        """
+        Rank chunks by cosine similarity to the query
+        
+        Returns:
+            List of (chunk_id, document_id, score) sorted by descending score
+        """
+        self.refresh()
+        with self._lock:
+            base = (self._base_vectors, self._base_rows, self._base_alive)
+            recent = list(self._recent.values())
+        
+        if (base[0] is None and not recent) or not query.strip():
+            return []
+        
+        query_vector = self.embedder.embed([query])[0]
+        score_parts, row_parts = [], []
+        if base[0] is not None:
+            base_scores = self._score(base[0], query_vector)
+            base_scores[~base[2]] = -np.inf
+            score_parts.append(base_scores)
+            row_parts.append(base[1])
+        for _, vectors, rows in recent:
+            score_parts.append(self._score(vectors, query_vector))
+            row_parts.append(rows)
+        
+        scores = np.concatenate(score_parts)
+        rows = np.concatenate(row_parts)
+        limit = min(limit, int(np.isfinite(scores).sum()))
+        if limit <= 0:
+            return []
+        
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i, 0]), int(rows[i, 1]), float(scores[i])) for i in top]
+    
+    def rebuild(self) -> int:
+        """Re-embed the stored chunks of every document"""
+        count = 0
+        document_ids = [document_id for (document_id,) in db.session.query(DocumentChunk.document_id).distinct()]
+        for document_id in document_ids:
+            chunks = DocumentChunk.query.filter_by(document_id=document_id).order_by(DocumentChunk.chunk_index).all()
+            self.index_document(document_id, chunks)
+            count += 1
+        self.compact()
+        logger.info(f"✅ تمت إعادة بناء فهرس المتجهات لـ {count} مستند")
+        return count
+    
+    def refresh(self, force: bool = False):
+        """Pick up segments written or removed since the last check, compacting when due"""
+        now = time.monotonic()
+        if not force and now - self._last_check < self.refresh_interval:
+            return
+        
+        with self._lock:
+            self._last_check = now
+            self._load_base()
+            current = dict(self._list_segments())
+            
+            # Base rows of removed or re-embedded documents are dead until compaction
+            changed = {
+                document_id for document_id, mtime in self._base_segments.items()
+                if current.get(document_id) != mtime
+            }
+            for document_id in list(self._recent):
+                if current.get(document_id) != self._recent[document_id][0]:
+                    del self._recent[document_id]
+            
+            for document_id, mtime in current.items():
+                if self._base_segments.get(document_id) == mtime or document_id in self._recent:
+                    continue
+                segment = self._load_segment(document_id)
+                if segment:
+                    self._recent[document_id] = (mtime, *segment)
+            
+            if changed - self._tombstones:
+                self._tombstones |= changed
+                self._update_alive()
+            
+            if self._needs_compaction(now):
+                self._compact(blocking=False)
+    
+    def compact(self):
+        """Merge all live segments into a new base matrix (waits for a compaction in another process)"""
+        with self._lock:
+            self._compact(blocking=True)
+    
+    def get_stats(self) -> Dict:
+        """Get index size, pending changes and settings"""
+        with self._lock:
+            base_rows = len(self._base_rows) if self._base_rows is not None else 0
+            live_rows = int(self._base_alive.sum()) if self._base_alive is not None else 0
+            return {
+                'model': self.embedder.model_name,
+                'dtype': self.dtype.name,
+                'vectors': live_rows + sum(len(rows) for _, _, rows in self._recent.values()),
+                'dimension': next(
+                    (vectors.shape[1] for vectors in [self._base_vectors] + [part[1] for part in self._recent.values()]
+                     if vectors is not None), 0
+                ),
+                'recent_segments': len(self._recent),
+                'tombstoned_documents': len(self._tombstones),
+                'dead_rows': base_rows - live_rows,
+                'generation': self._base_manifest[1] if self._base_manifest else None,
+                'compactions': self.compactions
+            }
+    
+    def _score(self, vectors: "np.ndarray", query_vector: "np.ndarray") -> "np.ndarray":
+        """Cosine scores of all rows of a matrix (rows and query are unit length)"""
+        if vectors.dtype == np.float32:
+            return vectors @ query_vector
+        
+        # float16 has no BLAS kernels; widen the mapped rows block by block
+        return np.concatenate([
+            vectors[start:start + SCORE_BLOCK_ROWS].astype(np.float32) @ query_vector
+            for start in range(0, len(vectors), SCORE_BLOCK_ROWS)
+        ])
+    
+    def _update_alive(self):
+        """Recompute the base row mask from the tombstones (lock held by caller)"""
+        if self._base_rows is not None:
+            self._base_alive = ~np.isin(self._base_rows[:, 1], list(self._tombstones))
+    
+    def _needs_compaction(self, now: float) -> bool:
+        """Whether pending segments or dead rows justify a merge (lock held by caller)"""
+        if not self._recent and not self._tombstones:
+            return False
+        if len(self._recent) > self.max_recent_segments:
+            return True
+        if self._base_alive is not None and len(self._base_alive):
+            if 1 - self._base_alive.mean() > self.max_dead_ratio:
+                return True
+        return now - self._last_compaction >= self.compact_interval
+    
+    @contextmanager
+    def _compaction_lock(self, blocking: bool):
+        """Hold the inter-process compaction lock; yields False when another process has it"""
+        if fcntl is None:
+            yield True
+            return
+        
+        with open(os.path.join(self.directory, 'compact.lock'), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _load_base(self) -> bool:
+        """Map the base generation published in base.json if it changed (lock held by caller)"""
+        manifest_path = os.path.join(self.directory, 'base.json')
+        try:
+            mtime = os.stat(manifest_path).st_mtime_ns
+            if self._base_manifest and self._base_manifest[0] == mtime:
+                return False
+            
+            with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+                manifest = json.load(manifest_file)
+            if self._base_manifest and self._base_manifest[1] == manifest['generation']:
+                self._base_manifest = (mtime, manifest['generation'])
+                return False
+            
+            if manifest['rows']:
+                vectors = np.load(os.path.join(self.directory, manifest['vectors']), mmap_mode='r')
+                rows = np.load(os.path.join(self.directory, manifest['rows']))
+            else:
+                vectors = rows = None
+        except FileNotFoundError:
+            return False  # nothing compacted yet, or a generation replaced while reading it (next refresh)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"⚠️ تعذر تحميل فهرس المتجهات المضغوط: {e}")
+            return False
+        
+        self._base_vectors = vectors
+        self._base_rows = rows
+        self._base_alive = np.ones(len(rows), dtype=bool) if rows is not None else None
+        self._base_segments = {int(document_id): mtime for document_id, mtime in manifest['segments'].items()}
+        self._base_manifest = (mtime, manifest['generation'])
+        
+        # Recent segments and tombstones are recomputed against the new base by refresh()
+        self._recent = {}
+        self._tombstones = set()
+        self._last_compaction = time.monotonic()
+        return True
+    
+    def _compact(self, blocking: bool):
+        """Write the live segments to a new base generation and map it (lock held by caller)"""
+        with self._compaction_lock(blocking) as locked:
+            if not locked:
+                return  # another process is compacting; its generation is picked up on refresh
+            
+            # A generation published while waiting already covers the pending changes
+            if self._load_base() and not blocking:
+                return
+            self._write_generation(dict(self._list_segments()))
+        
+        self._last_check = 0.0  # re-list segments written during compaction on the next refresh
+    
+    def _write_generation(self, current: Dict[int, int]):
+        """Merge the live segments into new generation files and publish base.json (compaction lock held)"""
+        # Segments finished by a worker after their document was deleted
+        try:
+            existing = {
+                document_id for (document_id,) in
+                db.session.query(Document.id).filter(Document.id.in_(list(current)))
+            } if current else set()
+            for document_id in set(current) - existing:
+                for path in self._segment_paths(document_id):
+                    if os.path.exists(path):
+                        os.remove(path)
+                del current[document_id]
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر التحقق من المستندات أثناء ضغط فهرس المتجهات: {e}")
+        
+        parts = []
+        merged_segments = {}
+        for document_id in sorted(current):
+            segment = self._load_segment(document_id)
+            if segment:
+                parts.append(segment)
+                merged_segments[document_id] = current[document_id]
+        
+        # Unique names: a generation is never written over, so mapped readers and racing writers are safe
+        generation = uuid.uuid4().hex
+        vectors_name, rows_name = f"vectors.{generation}.npy", f"rows.{generation}.npy"
+        total = sum(len(part_rows) for _, part_rows in parts)
+        if total:
+            merged = np.lib.format.open_memmap(
+                os.path.join(self.directory, vectors_name), mode='w+',
+                dtype=self.dtype, shape=(total, parts[0][0].shape[1])
+            )
+            position = 0
+            for part_vectors, _ in parts:
+                merged[position:position + len(part_vectors)] = part_vectors
+                position += len(part_vectors)
+            merged.flush()
+            del merged
+            self._write_array(
+                os.path.join(self.directory, rows_name),
+                np.concatenate([part_rows for _, part_rows in parts])
+            )
+        
+        manifest = {
+            'generation': generation,
+            'vectors': vectors_name if total else None,
+            'rows': rows_name if total else None,
+            'segments': {str(document_id): mtime for document_id, mtime in merged_segments.items()}
+        }
+        manifest_path = os.path.join(self.directory, 'base.json')
+        temp_path = f"{manifest_path}.{generation}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(temp_path, manifest_path)
+        
+        self._base_manifest = None
+        self._load_base()
+        self._remove_old_generations(generation)
+        self.compactions += 1
+        logger.info(f"🧭 تم ضغط فهرس المتجهات: {total} مقطع من {len(parts)} مستند")
+    
+    def _remove_old_generations(self, generation: str):
+        """Delete the files of earlier generations (mapped copies stay readable until unmapped)"""
+        for entry in os.scandir(self.directory):
+            parts = entry.name.split('.')
+            if len(parts) == 3 and parts[0] in ('vectors', 'rows') and parts[2] == 'npy' and parts[1] != generation:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass  # still mapped on platforms that forbid it; removed by a later compaction
+    
+    def _load_segment(self, document_id: int) -> Optional[Tuple]:
+        """(mapped vectors, rows) of a segment, or None when removed or still being written"""
+        vectors_path, rows_path = self._segment_paths(document_id)
+        try:
+            return np.load(vectors_path, mmap_mode='r'), np.load(rows_path)
+        except (OSError, ValueError):
+            return None
+    
+    def _segment_paths(self, document_id: int) -> Tuple[str, str]:
+        """(vectors, rows) file paths of a document's segment"""
+        base = os.path.join(self.segments_directory, str(document_id))
+        return f"{base}.vectors.npy", f"{base}.rows.npy"
+    
+    def _list_segments(self) -> List[Tuple[int, int]]:
+        """(document_id, modification time in ns) of the complete segments"""
+        segments = []
+        for entry in os.scandir(self.segments_directory):
+            name, _, suffix = entry.name.partition('.')
+            if suffix == 'vectors.npy' and name.isdigit():
+                segments.append((int(name), entry.stat().st_mtime_ns))
+        return sorted(segments)
+    
+    def _write_array(self, path: str, array: "np.ndarray"):
+        """Write an .npy file atomically (the temporary name is unique per writer)"""
+        temp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'wb') as handle:
+            np.save(handle, array)
+        os.replace(temp_path, path)
+
+def fuse_rankings(lexical: List[Tuple[int, int, float]], semantic: List[Tuple[int, int, float]],
+                  semantic_weight: float = 0.5, limit: int = 50) -> List[Tuple[int, int, float]]:
+    """
+    Combine BM25 and cosine rankings of chunks
+    
+    Each list's scores are scaled by its best score so that both lie in
+    [0, 1], then mixed with semantic_weight; a chunk missing from one list
+    contributes 0 for it.
+    
+    Returns:
+        List of (chunk_id, document_id, score) sorted by descending score
+    """
+    fused: Dict[Tuple[int, int], float] = {}
+    for ranking, weight in ((lexical, 1 - semantic_weight), (semantic, semantic_weight)):
+        best = max((score for _, _, score in ranking), default=0.0)
+        if best <= 0:
+            continue
+        for chunk_id, document_id, score in ranking:
+            key = (chunk_id, document_id)
+            fused[key] = fused.get(key, 0.0) + weight * max(score, 0.0) / best
+    
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    return [(chunk_id, document_id, score) for (chunk_id, document_id), score in ranked[:limit]]
+
+def create_semantic_index(directory: str, model_name: str, dtype: str = 'float16') -> Optional[SemanticIndex]:
+    """Semantic index, or None when numpy or sentence-transformers is missing"""
+    if not SEMANTIC_AVAILABLE:
+        logger.warning("⚠️ البحث الدلالي غير متاح: يتطلب numpy و sentence-transformers")
+        return None
+    
+    return SemanticIndex(directory, ChunkEmbedder(model_name), dtype=dtype)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Test Configuration
+تطبيق المدرس AI المحسن - إعداد الاختبارات
+"""
+
+import importlib
+import os
+import sys
+
+import pytest
+
+# The application modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """The app module, imported once inside a scratch directory (it creates logs/ and uploads/ there)"""
+    workdir = tmp_path_factory.mktemp('app')
+    (workdir / 'logs').mkdir()
+    
+    previous_dir, previous_url = os.getcwd(), os.environ.get('DATABASE_URL')
+    os.chdir(workdir)
+    os.environ['DATABASE_URL'] = f"sqlite:///{workdir / 'app.db'}"
+    try:
+        return importlib.import_module('app')
+    finally:
+        os.chdir(previous_dir)
+        if previous_url is None:
+            os.environ.pop('DATABASE_URL')
+        else:
+            os.environ['DATABASE_URL'] = previous_url
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Arabic Text Normalization Tests
+تطبيق المدرس AI المحسن - اختبارات توحيد النص العربي
+"""
+
+import arabic_text
+
+def test_clean_text_folds_presentation_forms():
+    # Isolated/final/initial forms and the Allah ligature as written by PDF exports
+    assert arabic_text.clean_text('ﺍﻟﻄﺎﻗﺔ ﷲ') == 'الطاقة الله'
+
+def test_clean_text_unifies_persian_letters_and_drops_tatweel():
+    assert arabic_text.clean_text('کتـــاب ﯼ') == 'كتاب ي'
+
+def test_clean_text_keeps_diacritics():
+    assert arabic_text.clean_text('عِلْمٌ') == 'عِلْمٌ'
+
+def test_clean_text_leaves_non_arabic_compatibility_characters():
+    text = 'ﬁle x² Ａ ½'
+    assert arabic_text.clean_text(text) == text
+
+def test_normalize_still_applies_nfkc_for_search_keys():
+    assert arabic_text.normalize('ﬁle x² Ａ') == 'file x2 a'
+    assert arabic_text.normalize('ﺍﻟﻄﺎﻗﺔ') == arabic_text.normalize('الطاقة')
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Streaming Chat Tests
+تطبيق المدرس AI المحسن - اختبارات بث المحادثة
+"""
+
+import json
+
+import pytest
+
+from ai_engine import ResponseCache, TeacherAIEngine
+
+@pytest.fixture
+def app_context(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'ingestion_queue', None)
+    monkeypatch.setattr(app_module, 'refresh_conversation_summary', lambda conversation_id: None)
+    monkeypatch.setattr(app_module, 'retrieve_document_context', lambda message: ("الطاقة الحركية", [], [1]))
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.db.create_all()
+        yield app_module
+        app_module.db.session.remove()
+
+@pytest.fixture
+def engine(app_context, monkeypatch):
+    engine = TeacherAIEngine(response_cache=ResponseCache())
+    engine.anthropic_client = object()
+    engine.calls = 0
+    monkeypatch.setattr(app_context, 'ai_engine', engine)
+    return engine
+
+def use_stream(engine, deltas, error=None):
+    def stream(prompt, usage):
+        engine.calls += 1
+        yield from deltas
+        if error:
+            raise error
+    engine._stream_anthropic_response = stream
+
+def post_stream(app_module, conversation_id='c1'):
+    response = app_module.app.test_client().post(
+        '/api/chat/stream', json={'message': 'ما الطاقة؟', 'conversation_id': conversation_id}
+    )
+    events = []
+    for frame in response.get_data(as_text=True).strip().split('\n\n'):
+        event, data = frame.split('\n')
+        events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+def test_completed_stream_is_saved_and_cached(app_context, engine):
+    use_stream(engine, ['الطاقة ', 'هي القدرة'])
+    events = post_stream(app_context)
+    
+    assert [event for event, _ in events] == ['token', 'token', 'done']
+    assert events[-1][1]['response'] == 'الطاقة هي القدرة'
+    assert app_context.ChatMessage.query.count() == 2
+    
+    # The same question in a new conversation is answered from the cache
+    events = post_stream(app_context, conversation_id='c2')
+    assert events[-1][1]['response'] == 'الطاقة هي القدرة'
+    assert engine.calls == 1
+
+def test_interrupted_stream_is_neither_saved_nor_cached(app_context, engine):
+    use_stream(engine, ['الطاقة '], error=ConnectionError('reset'))
+    events = post_stream(app_context)
+    
+    assert [event for event, _ in events] == ['token', 'error']
+    assert app_context.ChatMessage.query.count() == 0
+    assert app_context.ChatSession.query.count() == 0
+    
+    # Asked again, the question goes to the provider rather than a cached partial answer
+    use_stream(engine, ['الطاقة ', 'هي القدرة'])
+    events = post_stream(app_context)
+    assert events[-1][1]['response'] == 'الطاقة هي القدرة'
+    assert engine.calls == 2
+
+def test_provider_streams_use_the_provider_timeout():
+    calls = {}
+    
+    class Recorder:
+        def __init__(self, name, result):
+            self.name, self.result = name, result
+        
+        def __call__(self, **kwargs):
+            calls[self.name] = kwargs
+            return self.result
+    
+    class AnthropicStream:
+        text_stream = ['الطاقة']
+        
+        def __enter__(self):
+            return self
+        
+        def __exit__(self, *exc_info):
+            return False
+        
+        def get_final_message(self):
+            return type('Message', (), {'usage': None})()
+    
+    engine = TeacherAIEngine()
+    engine.config['provider_timeout'] = 7
+    engine.openai_client = type('OpenAI', (), {})()
+    engine.openai_client.ChatCompletion = type('ChatCompletion', (), {'create': Recorder('openai', [])})
+    engine.anthropic_client = type('Anthropic', (), {})()
+    engine.anthropic_client.messages = type('Messages', (), {'stream': Recorder('anthropic', AnthropicStream())})
+    
+    prompt = engine._prepare_enhanced_prompt('ما الطاقة؟', '', [], True, True, True)
+    list(engine._stream_openai_response(prompt, {}))
+    list(engine._stream_anthropic_response(prompt, {}))
+    
+    assert calls['openai']['request_timeout'] == 7
+    assert calls['anthropic']['timeout'] == 7
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Chunked Upload Tests
+تطبيق المدرس AI المحسن - اختبارات الرفع المجزأ
+"""
+
+import io
+import hashlib
+import multiprocessing
+
+import pytest
+
+from chunked_upload import ChunkedUploadStore, UploadError, fcntl
+from file_store import ContentStore
+
+def make_store(directory, **kwargs):
+    return ChunkedUploadStore(ContentStore(str(directory)), **kwargs)
+
+def _write_chunk_in_process(directory, upload_id, offset, data, results):
+    store = make_store(directory)
+    try:
+        results.put(store.write_chunk(upload_id, offset, io.BytesIO(data))['offset'])
+    except UploadError as e:
+        results.put(e.status_code)
+
+@pytest.mark.parametrize('size', [0, -1])
+def test_create_rejects_empty_or_negative_size(tmp_path, size):
+    with pytest.raises(UploadError) as error:
+        make_store(tmp_path).create('a.txt', 'a.txt', size)
+    assert error.value.status_code == 400
+
+def test_create_rejects_size_over_limit_as_bad_request(tmp_path):
+    with pytest.raises(UploadError) as error:
+        make_store(tmp_path, max_size=100).create('a.txt', 'a.txt', 101)
+    assert error.value.status_code == 400
+
+def test_chunks_assemble_into_content_store(tmp_path):
+    store = make_store(tmp_path, chunk_size=4)
+    data = b'hello world\n'
+    state = store.create('a.txt', 'a.txt', len(data))
+    for offset in range(0, len(data), 4):
+        store.write_chunk(state['upload_id'], offset, io.BytesIO(data[offset:offset + 4]))
+    
+    result = store.complete(state['upload_id'])
+    assert result['content_hash'] == hashlib.sha256(data).hexdigest()
+    with open(result['file_path'], 'rb') as stored:
+        assert stored.read() == data
+
+def test_unknown_session_is_not_found(tmp_path):
+    with pytest.raises(UploadError) as error:
+        make_store(tmp_path).write_chunk('0' * 32, 0, io.BytesIO(b'x'))
+    assert error.value.status_code == 404
+
+@pytest.mark.skipif(fcntl is None, reason='flock is POSIX only')
+def test_session_lock_serializes_worker_processes(tmp_path):
+    store = make_store(tmp_path)
+    state = store.create('a.txt', 'a.txt', 8)
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    
+    # Hold the session lock here while another process sends the same chunk
+    with store._lock_for(state['upload_id']):
+        worker = context.Process(
+            target=_write_chunk_in_process,
+            args=(str(tmp_path), state['upload_id'], 0, b'abcd', results)
+        )
+        worker.start()
+        worker.join(timeout=1.5)
+        assert worker.is_alive()
+    
+    worker.join(timeout=10)
+    assert results.get(timeout=5) == 4
+    assert store.status(state['upload_id'])['offset'] == 4
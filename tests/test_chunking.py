@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Document Chunking Tests
+تطبيق المدرس AI المحسن - اختبارات تقطيع المستندات
+"""
+
+import pytest
+
+from document_processor import DocumentProcessor, PAGE_BREAK, join_blocks, split_blocks
+
+LINE_AR = 'الطاقة الحركية هي الطاقة التي يمتلكها الجسم بسبب حركته'
+LINE_EN = 'Kinetic energy is the energy an object has because of its motion'
+
+@pytest.fixture
+def processor():
+    return DocumentProcessor(pdf_workers=1)
+
+def assert_offsets_match(chunks, blocks):
+    text = join_blocks(blocks)
+    for chunk in chunks:
+        assert text[chunk['offset']:chunk['offset'] + len(chunk['text'])] == chunk['text']
+
+def test_paged_chunks_keep_their_page_and_offset(processor):
+    blocks = [{'page': number, 'text': '\n'.join([f'{LINE_AR} {number}', LINE_EN] * 30)} for number in (1, 2, 3)]
+    chunks = list(processor.chunk_blocks(blocks, max_tokens=120))
+    
+    assert {chunk['page'] for chunk in chunks} == {1, 2, 3}
+    assert_offsets_match(chunks, blocks)
+    for chunk in chunks:
+        assert f'{LINE_AR} {chunk["page"]}' in chunk['text']
+        assert PAGE_BREAK not in chunk['text']
+        assert chunk['token_count'] <= 120
+
+def test_chunks_never_cross_a_page(processor):
+    blocks = [{'page': 1, 'text': 'short first page'}, {'page': 2, 'text': 'short second page'}]
+    chunks = list(processor.chunk_blocks(blocks, max_tokens=500))
+    
+    assert [(chunk['page'], chunk['text']) for chunk in chunks] == [(1, 'short first page'), (2, 'short second page')]
+    assert chunks[1]['offset'] == len('short first page') + 1
+
+def test_unpaginated_blocks_are_merged_into_one_chunk(processor):
+    blocks = [{'page': None, 'text': LINE_EN}, {'page': None, 'text': LINE_AR}]
+    chunks = list(processor.chunk_blocks(blocks, max_tokens=500))
+    
+    assert len(chunks) == 1
+    assert chunks[0]['page'] is None
+    assert chunks[0]['text'] == f'{LINE_EN}\n{LINE_AR}'
+    assert_offsets_match(chunks, blocks)
+
+def test_empty_pages_still_advance_offsets(processor):
+    blocks = [{'page': 1, 'text': LINE_EN}, {'page': 2, 'text': ''}, {'page': 3, 'text': LINE_AR}]
+    chunks = list(processor.chunk_blocks(blocks, max_tokens=500))
+    
+    assert [chunk['page'] for chunk in chunks] == [1, 3]
+    assert_offsets_match(chunks, blocks)
+
+def test_overlong_line_is_split_within_budget(processor):
+    blocks = [{'page': None, 'text': ' '.join([LINE_EN] * 50)}]
+    chunks = list(processor.chunk_blocks(blocks, max_tokens=60))
+    
+    assert len(chunks) > 1
+    assert all(chunk['token_count'] <= 60 for chunk in chunks)
+    assert_offsets_match(chunks, blocks)
+
+def test_chunk_text_matches_chunk_blocks_of_split_text(processor):
+    blocks = [{'page': number, 'text': '\n'.join([LINE_AR, LINE_EN] * 20)} for number in (1, 2)]
+    text = join_blocks(blocks)
+    
+    assert split_blocks(text) == blocks
+    assert processor.chunk_text(text, max_tokens=100) == list(processor.chunk_blocks(blocks, max_tokens=100))
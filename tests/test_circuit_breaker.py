@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Circuit Breaker Tests
+تطبيق المدرس AI المحسن - اختبارات قاطع الدائرة
+"""
+
+import pytest
+
+import ai_engine
+from ai_engine import CircuitBreaker
+
+class Clock:
+    """Controllable replacement for time.monotonic"""
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ai_engine.time, 'monotonic', clock)
+    return clock
+
+def make_breaker(**kwargs):
+    options = {'window_size': 10, 'error_threshold': 0.5, 'min_calls': 4, 'open_seconds': 30}
+    options.update(kwargs)
+    return CircuitBreaker('test', **options)
+
+def test_breaker_stays_closed_below_min_calls(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record_failure(0.1)
+    
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+def test_breaker_opens_at_error_threshold_and_skips_calls(clock):
+    breaker = make_breaker()
+    breaker.record_success(0.1)
+    breaker.record_success(0.1)
+    breaker.record_failure(0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+    
+    breaker.record_failure(0.1)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.get_stats()['skipped'] == 1
+
+def test_breaker_half_open_allows_a_single_probe(clock):
+    breaker = make_breaker(min_calls=1)
+    breaker.record_failure(0.1)
+    
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()  # probe already in flight
+
+def test_breaker_probe_success_closes(clock):
+    breaker = make_breaker(min_calls=1)
+    breaker.record_failure(0.1)
+    clock.now += 30
+    assert breaker.allow()
+    
+    breaker.record_success(0.2)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.get_stats()['error_rate'] == 0
+    assert breaker.allow()
+
+def test_breaker_probe_failure_reopens(clock):
+    breaker = make_breaker(min_calls=1)
+    breaker.record_failure(0.1)
+    clock.now += 30
+    assert breaker.allow()
+    
+    breaker.record_failure(0.1)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    clock.now += 30
+    assert breaker.allow()
+
+def test_breaker_release_frees_the_probe_slot(clock):
+    breaker = make_breaker(min_calls=1)
+    breaker.record_failure(0.1)
+    clock.now += 30
+    assert breaker.allow()
+    
+    breaker.release()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+def test_breaker_latency_percentiles(clock):
+    breaker = make_breaker(window_size=100)
+    for latency in range(1, 101):
+        breaker.record_success(latency / 100)
+    
+    stats = breaker.get_stats()
+    assert (stats['latency_p50'], stats['latency_p95'], stats['latency_p99']) == (0.51, 0.96, 1.0)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Fuzzy Term Matching Tests
+تطبيق المدرس AI المحسن - اختبارات البحث التقريبي
+"""
+
+import itertools
+
+import pytest
+from flask import Flask
+
+from database import db, IndexPosting
+from fuzzy_search import TrigramVocabulary, bounded_edit_distance, max_edit_distance, trigrams
+
+VOCABULARY = ['طاقه', 'حركيه', 'حرارة', 'physics', 'physical', 'energy', 'energies', 'synergy']
+
+def levenshtein(source, target):
+    """Reference full-matrix edit distance"""
+    previous = list(range(len(target) + 1))
+    for i, source_char in enumerate(source, 1):
+        current = [i]
+        for j, target_char in enumerate(target, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (source_char != target_char)))
+        previous = current
+    return previous[-1]
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'fuzzy.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+def add_terms(terms, document_id=1):
+    db.session.add_all(IndexPosting(term, chunk_id=document_id, document_id=document_id) for term in terms)
+    db.session.commit()
+
+@pytest.mark.parametrize('source, target', [
+    ('kitten', 'sitting'), ('energy', 'enrgy'), ('energy', 'energies'), ('حركيه', 'حركية'),
+    ('abc', 'abc'), ('', 'ab'), ('flaw', 'lawn'), ('physics', 'physical'),
+])
+@pytest.mark.parametrize('max_distance', [0, 1, 2, 3])
+def test_bounded_edit_distance_agrees_with_levenshtein_within_band(source, target, max_distance):
+    expected = levenshtein(source, target)
+    assert bounded_edit_distance(source, target, max_distance) == (expected if expected <= max_distance else None)
+
+def test_bounded_edit_distance_exhaustive_short_strings():
+    words = [''.join(letters) for length in range(4) for letters in itertools.product('ab', repeat=length)]
+    for source, target in itertools.product(words, repeat=2):
+        expected = levenshtein(source, target)
+        assert bounded_edit_distance(source, target, 1) == (expected if expected <= 1 else None)
+
+def test_max_edit_distance_by_length():
+    assert [max_edit_distance('x' * length) for length in (3, 4, 6, 7)] == [0, 1, 1, 2]
+
+def test_trigrams_are_padded_and_distinct():
+    assert trigrams('aaa') == ['$$a', '$aa', 'aaa', 'aa$', 'a$$']
+
+def test_expand_finds_typos_through_trigram_candidates(app):
+    add_terms(VOCABULARY)
+    vocabulary = TrigramVocabulary()
+    vocabulary.refresh(force=True)
+    
+    expansions, _ = vocabulary.expand(['enrgy', 'physcs'])
+    assert expansions['enrgy'][0] == 'enrgy'
+    assert 'energy' in expansions['enrgy']
+    assert 'synergy' not in expansions['enrgy']  # distance 2 > allowance of a 5-letter term
+    assert expansions['physcs'][:2] == ['physcs', 'physics']
+
+def test_candidates_share_a_probed_trigram(app):
+    add_terms(VOCABULARY)
+    vocabulary = TrigramVocabulary()
+    vocabulary.refresh(force=True)
+    
+    matches = dict((term, distance) for distance, term in vocabulary._similar_terms('energys', float('inf')))
+    assert matches == {'energy': 1, 'energies': 2}
+
+def test_short_terms_are_not_expanded(app):
+    add_terms(['cat', 'cut'])
+    vocabulary = TrigramVocabulary()
+    vocabulary.refresh(force=True)
+    
+    assert vocabulary.expand(['cat'])[0] == {'cat': ['cat']}
+
+def test_prefix_completion_of_last_term(app):
+    add_terms(VOCABULARY)
+    vocabulary = TrigramVocabulary()
+    vocabulary.refresh(force=True)
+    
+    expansions, _ = vocabulary.expand(['energy', 'phys'], prefix_last=True)
+    assert set(expansions['phys'][1:]) == {'physics', 'physical'}
+    assert expansions['energy'] == ['energy']  # only the last term is completed as a prefix
+
+def test_no_suggestions_until_first_build(app):
+    add_terms(VOCABULARY)
+    vocabulary = TrigramVocabulary()
+    
+    assert not vocabulary.ready
+    assert vocabulary.expand(['enrgy'])[0] == {'enrgy': ['enrgy']}
+    
+    vocabulary.warm(app)
+    vocabulary._warm_thread.join(timeout=10)
+    assert vocabulary.ready
+    assert 'energy' in vocabulary.expand(['enrgy'])[0]['enrgy']
+
+def test_request_refresh_does_not_build_inline(app):
+    add_terms(VOCABULARY)
+    vocabulary = TrigramVocabulary()
+    
+    vocabulary.refresh()
+    vocabulary._warm_thread.join(timeout=10)
+    assert vocabulary.ready
+    assert vocabulary.get_stats()['terms'] == len(VOCABULARY)
+
+def test_refresh_adds_new_terms_incrementally(app):
+    add_terms(VOCABULARY)
+    vocabulary = TrigramVocabulary(refresh_interval=0)
+    vocabulary.refresh(force=True)
+    add_terms(['energy', 'quantum'], document_id=2)
+    vocabulary.refresh()
+    
+    assert vocabulary.get_stats()['terms'] == len(VOCABULARY) + 1
+    assert vocabulary._document_frequency[vocabulary._term_ids['energy']] == 2
+
+def test_refresh_picks_up_terms_under_reused_posting_ids(app):
+    add_terms(VOCABULARY)
+    add_terms(['entropy', 'photon'], document_id=2)
+    vocabulary = TrigramVocabulary(refresh_interval=0)
+    vocabulary.refresh(force=True)
+    
+    # Without AUTOINCREMENT, SQLite would hand the deleted tail ids out again, under the watermark
+    IndexPosting.query.filter_by(document_id=2).delete()
+    db.session.commit()
+    add_terms(['neutrino', 'magnetism'], document_id=3)
+    vocabulary.refresh()
+    
+    assert 'neutrino' in vocabulary._term_ids
+    assert vocabulary._document_frequency[vocabulary._term_ids['entropy']] == 0
+    expansions, _ = vocabulary.expand(['nutrino'])
+    assert 'neutrino' in expansions['nutrino']
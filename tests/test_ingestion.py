@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Ingestion Worker Tests
+تطبيق المدرس AI المحسن - اختبارات عمليات معالجة المستندات
+"""
+
+from datetime import datetime
+
+import pytest
+
+import ingestion
+from database import db, Document
+
+@pytest.fixture
+def worker(tmp_path):
+    ingestion._init_worker({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'ingestion.db'}",
+        'PDF_EXTRACTION_WORKERS': 1,
+    })
+    with ingestion._worker_app.app_context():
+        db.create_all()
+        yield ingestion._worker_app
+        db.session.remove()
+
+def claimed_document(tmp_path, text='الطاقة الحركية للأجسام المتحركة'):
+    path = tmp_path / 'lesson.txt'
+    path.write_text(text, encoding='utf-8')
+    document = Document('lesson.txt', 'lesson.txt', str(path), path.stat().st_size)
+    document.processing_status = 'processing'
+    document.processing_started = datetime.utcnow()
+    db.session.add(document)
+    db.session.commit()
+    return document.id
+
+def replace_document(document_id, tmp_path):
+    """What register_upload does when new content arrives under the same name"""
+    document = db.session.get(Document, document_id)
+    document.file_path = str(tmp_path / 'lesson-v2.txt')
+    document.processing_status = 'pending'
+    document.processing_error = None
+    db.session.commit()
+
+def test_completes_claimed_document(worker, tmp_path):
+    document_id = claimed_document(tmp_path)
+    
+    assert ingestion.process_document(document_id) == 'completed'
+    document = db.session.get(Document, document_id)
+    assert document.processing_status == 'completed'
+    assert document.chunks.count() == 1
+
+def test_failure_marks_own_claim_failed(worker, tmp_path, monkeypatch):
+    document_id = claimed_document(tmp_path)
+    
+    def failing_extraction(file_path, content_file, chunk_file):
+        raise FileNotFoundError(file_path)
+    monkeypatch.setattr(ingestion, '_spool_extraction', failing_extraction)
+    
+    assert ingestion.process_document(document_id) == 'failed'
+    assert db.session.get(Document, document_id).processing_status == 'failed'
+
+def test_failure_after_replacement_leaves_new_upload_pending(worker, tmp_path, monkeypatch):
+    document_id = claimed_document(tmp_path)
+    
+    def replaced_during_extraction(file_path, content_file, chunk_file):
+        with worker.app_context():
+            replace_document(document_id, tmp_path)
+        raise FileNotFoundError(file_path)  # the old file was deleted after the replacement
+    monkeypatch.setattr(ingestion, '_spool_extraction', replaced_during_extraction)
+    
+    assert ingestion.process_document(document_id) == 'replaced'
+    db.session.expire_all()
+    document = db.session.get(Document, document_id)
+    assert document.processing_status == 'pending'
+    assert document.processing_error is None
+
+def test_success_after_replacement_is_discarded(worker, tmp_path, monkeypatch):
+    document_id = claimed_document(tmp_path)
+    spool = ingestion._spool_extraction
+    
+    def replaced_during_extraction(file_path, content_file, chunk_file):
+        word_count = spool(file_path, content_file, chunk_file)
+        with worker.app_context():
+            replace_document(document_id, tmp_path)
+        return word_count
+    monkeypatch.setattr(ingestion, '_spool_extraction', replaced_during_extraction)
+    
+    assert ingestion.process_document(document_id) == 'replaced'
+    db.session.expire_all()
+    document = db.session.get(Document, document_id)
+    assert document.processing_status == 'pending'
+    assert document.chunks.count() == 0
+
+@pytest.mark.parametrize('status', ['completed', 'failed', 'replaced', 'missing'])
+def test_queue_counts_each_outcome_separately(worker, status):
+    from concurrent.futures import Future
+    
+    queue = ingestion.IngestionQueue(worker)
+    queue._in_flight = 1
+    future = Future()
+    future.set_result(status)
+    queue._on_done(1, future)
+    
+    stats = queue.get_stats()
+    assert stats[status] == 1
+    assert sum(stats[outcome] for outcome in ('completed', 'failed', 'replaced', 'missing')) == 1
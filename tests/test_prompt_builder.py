@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Prompt Builder Tests
+تطبيق المدرس AI المحسن - اختبارات بناء الطلب ضمن ميزانية الرموز
+"""
+
+from arabic_text import estimate_tokens
+from prompt_builder import PASSAGE_SEPARATOR, TRUNCATION_MARKER, PromptBuilder, truncate_to_tokens
+
+SYSTEM = 'أنت مدرس مساعد يجيب باللغة العربية'
+INSTRUCTIONS = 'أجب بإيجاز واستشهد بالمصادر'
+PASSAGE = 'الطاقة الحركية هي الطاقة التي يمتلكها الجسم بسبب حركته. ' * 10
+
+def history(turns, text='سؤال سابق عن الفيزياء والكيمياء والأحياء'):
+    return [{'type': 'user' if index % 2 == 0 else 'assistant', 'text': f'{text} {index}'} for index in range(turns)]
+
+def test_truncate_to_tokens_fits_budget_at_word_boundary():
+    text = 'energy and motion ' * 100
+    cut = truncate_to_tokens(text, 50)
+    
+    assert cut.endswith(TRUNCATION_MARKER)
+    assert estimate_tokens(cut) <= 50
+    assert text.startswith(cut[:-len(TRUNCATION_MARKER)] + ' ')
+
+def test_truncate_to_tokens_keeps_short_text_and_drops_on_zero_budget():
+    assert truncate_to_tokens('short text', 100) == 'short text'
+    assert truncate_to_tokens('short text', 0) == ''
+
+def test_everything_fits_within_a_large_budget():
+    result = PromptBuilder(max_input_tokens=100000).build(
+        SYSTEM, 'ما هي الطاقة الحركية؟', INSTRUCTIONS,
+        context=PASSAGE_SEPARATOR.join([PASSAGE] * 3), conversation_history=history(4)
+    )
+    
+    assert result['truncated'] == []
+    assert result['context'].count(PASSAGE.strip()) == 3
+    assert 'سؤال سابق عن الفيزياء والكيمياء والأحياء 3' in result['prompt']
+    counts = result['token_counts']
+    assert counts['total'] == sum(counts[section] for section in PromptBuilder.SECTIONS)
+
+def test_total_stays_within_budget_and_context_is_cut_last():
+    budget = 600
+    passages = [f'{index} {PASSAGE}' for index in range(10)]
+    result = PromptBuilder(max_input_tokens=budget).build(
+        SYSTEM, 'ما هي الطاقة الحركية؟', INSTRUCTIONS,
+        context=PASSAGE_SEPARATOR.join(passages), conversation_history=history(4)
+    )
+    
+    assert result['token_counts']['total'] <= budget
+    assert result['truncated'] == ['context']
+    # Passages are kept whole in ranking order; only the last kept one is cut
+    kept = result['context'].strip().split(PASSAGE_SEPARATOR)
+    kept[0] = kept[0].split('\n', 1)[1]
+    assert kept[:-1] == [passage for passage in passages[:len(kept) - 1]]
+    assert kept[-1].endswith(TRUNCATION_MARKER)
+
+def test_question_is_capped():
+    builder = PromptBuilder(max_input_tokens=5000, max_question_tokens=50)
+    result = builder.build(SYSTEM, 'سؤال طويل جداً عن الطاقة ' * 100, INSTRUCTIONS)
+    
+    assert 'question' in result['truncated']
+    assert result['token_counts']['question'] <= 50
+
+def test_history_keeps_newest_turns_within_its_share():
+    builder = PromptBuilder(max_input_tokens=3000, max_history_tokens=100)
+    result = builder.build(SYSTEM, 'سؤال', INSTRUCTIONS, conversation_history=history(20))
+    
+    assert 'history' in result['truncated']
+    assert result['token_counts']['history'] <= 100
+    assert 'الأحياء 19' in result['prompt']
+    assert 'الأحياء 0' not in result['prompt']
+
+def test_history_takes_at_most_a_third_of_the_remaining_budget():
+    builder = PromptBuilder(max_input_tokens=600, max_history_tokens=10000)
+    result = builder.build(SYSTEM, 'سؤال', INSTRUCTIONS, context=PASSAGE, conversation_history=history(40))
+    counts = result['token_counts']
+    
+    remaining = 600 - counts['system'] - counts['instructions'] - counts['question']
+    assert counts['history'] <= remaining // 3
+    assert counts['context'] > 0
+
+def test_summary_uses_at_most_half_of_the_history_share():
+    builder = PromptBuilder(max_input_tokens=3000, max_history_tokens=200)
+    result = builder.build(
+        SYSTEM, 'سؤال', INSTRUCTIONS, conversation_history=history(2),
+        conversation_summary='ملخص طويل للمحادثة السابقة ' * 100
+    )
+    
+    assert 'ملخص المحادثة السابقة' in result['prompt']
+    assert 'history' in result['truncated']
+    assert result['token_counts']['history'] <= 200
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Response Cache Tests
+تطبيق المدرس AI المحسن - اختبارات ذاكرة الردود
+"""
+
+import pytest
+
+import ai_engine
+from ai_engine import ResponseCache
+
+class Clock:
+    """Controllable replacement for time.monotonic"""
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ai_engine.time, 'monotonic', clock)
+    return clock
+
+def test_cache_entry_expires_after_timeout(clock):
+    cache = ResponseCache(timeout=10)
+    cache.set('q', 'answer')
+    
+    clock.now += 9.9
+    assert cache.get('q') == 'answer'
+    clock.now += 0.2
+    assert cache.get('q') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_cache_evicts_least_recently_used(clock):
+    cache = ResponseCache(max_entries=2)
+    cache.set('a', '1')
+    cache.set('b', '2')
+    assert cache.get('a') == '1'  # 'b' is now the least recently used
+    
+    cache.set('c', '3')
+    assert cache.get('b') is None
+    assert cache.get('a') == '1'
+    assert cache.get('c') == '3'
+
+def test_cache_overwrite_refreshes_expiry(clock):
+    cache = ResponseCache(timeout=10)
+    cache.set('q', 'old')
+    clock.now += 8
+    cache.set('q', 'new')
+    clock.now += 8
+    
+    assert cache.get('q') == 'new'
+
+def test_cache_invalidate_by_tag(clock):
+    cache = ResponseCache()
+    cache.set('a', '1', tags=[1, 2])
+    cache.set('b', '2', tags=[2])
+    cache.set('c', '3', tags=[3])
+    
+    assert cache.invalidate(['2']) == 2
+    assert cache.get('a') is None and cache.get('b') is None
+    assert cache.get('c') == '3'
+    assert cache.invalidate([1]) == 0
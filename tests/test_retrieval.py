@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Retrieval Mode Tests
+تطبيق المدرس AI المحسن - اختبارات أنماط الاسترجاع
+"""
+
+import pytest
+
+class FakeSemanticIndex:
+    def __init__(self, results):
+        self.results = results
+    
+    def search(self, query, limit=10):
+        return self.results
+
+class FakeSearchIndex:
+    def __init__(self, lexical):
+        self.lexical = lexical
+        self.ranked = 'unset'
+    
+    def search_chunks(self, query, limit=10):
+        return self.lexical
+    
+    def pack_context(self, query, max_tokens, ranked=None):
+        self.ranked = ranked
+        return []
+
+@pytest.mark.parametrize('mode', ['semantic', 'hybrid'])
+def test_empty_semantic_results_fall_back_to_bm25(app_module, monkeypatch, mode):
+    search_index = FakeSearchIndex([(1, 1, 2.0)])
+    monkeypatch.setattr(app_module, 'semantic_index', FakeSemanticIndex([]))
+    monkeypatch.setattr(app_module, 'search_index', search_index)
+    monkeypatch.setitem(app_module.app.config, 'SEMANTIC_RETRIEVAL', mode)
+    
+    assert app_module.rank_semantic_chunks('سؤال') is None
+    app_module.retrieve_document_context('سؤال')
+    assert search_index.ranked is None  # pack_context ranks with BM25 itself
+
+def test_semantic_results_are_used_when_present(app_module, monkeypatch):
+    semantic = [(7, 3, 0.9)]
+    monkeypatch.setattr(app_module, 'semantic_index', FakeSemanticIndex(semantic))
+    monkeypatch.setattr(app_module, 'search_index', FakeSearchIndex([]))
+    monkeypatch.setitem(app_module.app.config, 'SEMANTIC_RETRIEVAL', 'semantic')
+    
+    assert app_module.rank_semantic_chunks('سؤال') == semantic
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Schema Upgrade Tests
+تطبيق المدرس AI المحسن - اختبارات ترقية قاعدة البيانات
+"""
+
+import pytest
+from flask import Flask
+from sqlalchemy import inspect, text
+
+from database import db, upgrade_tables, ChatMessage, ChatSession, Document
+
+# Tables as created by the first release (before chunks, postings, summaries and token usage)
+FIRST_RELEASE_SCHEMA = (
+    """CREATE TABLE documents (
+        id INTEGER NOT NULL, filename VARCHAR(255) NOT NULL, original_filename VARCHAR(255) NOT NULL,
+        file_path VARCHAR(500) NOT NULL, file_size INTEGER NOT NULL, mime_type VARCHAR(100), content TEXT,
+        content_hash VARCHAR(64), word_count INTEGER, language VARCHAR(10), upload_date DATETIME NOT NULL,
+        last_accessed DATETIME, access_count INTEGER, processing_status VARCHAR(20), processing_error TEXT,
+        document_type VARCHAR(50), subject VARCHAR(100), tags JSON, PRIMARY KEY (id)
+    )""",
+    "CREATE INDEX ix_documents_content_hash ON documents (content_hash)",
+    "CREATE INDEX ix_documents_upload_date ON documents (upload_date)",
+    "CREATE INDEX ix_documents_filename ON documents (filename)",
+    """CREATE TABLE chat_sessions (
+        id VARCHAR(36) NOT NULL, title VARCHAR(200) NOT NULL, created_at DATETIME NOT NULL,
+        last_activity DATETIME NOT NULL, message_count INTEGER, language VARCHAR(10), voice_settings JSON,
+        is_active BOOLEAN, is_archived BOOLEAN, PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE chat_messages (
+        id INTEGER NOT NULL, session_id VARCHAR(36) NOT NULL, content TEXT NOT NULL,
+        message_type VARCHAR(20) NOT NULL, timestamp DATETIME NOT NULL, language VARCHAR(10), confidence FLOAT,
+        response_time FLOAT, model_used VARCHAR(50), sources JSON, context_used TEXT, was_spoken BOOLEAN,
+        speech_settings JSON, was_copied BOOLEAN, was_bookmarked BOOLEAN, was_printed BOOLEAN,
+        PRIMARY KEY (id), FOREIGN KEY(session_id) REFERENCES chat_sessions (id)
+    )""",
+    "CREATE INDEX ix_chat_messages_session_id ON chat_messages (session_id)",
+    """INSERT INTO documents (id, filename, original_filename, file_path, file_size, content_hash, upload_date)
+       VALUES (1, 'old.txt', 'old.txt', '/tmp/old.txt', 3, 'abc', '2024-01-01 00:00:00')""",
+)
+
+@pytest.fixture
+def legacy_app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'legacy.db'}"
+    db.init_app(app)
+    with app.app_context():
+        with db.engine.begin() as connection:
+            for statement in FIRST_RELEASE_SCHEMA:
+                connection.execute(text(statement))
+        yield app
+        db.session.remove()
+
+def test_upgrade_adds_new_columns_and_indexes(legacy_app):
+    db.create_all()
+    changes = upgrade_tables()
+    
+    assert 'column documents.language_stats' in changes
+    assert 'column documents.processing_started' in changes
+    assert 'column chat_sessions.summary' in changes
+    assert 'column chat_messages.input_tokens' in changes
+    assert 'index ix_documents_upload_date_id' in changes
+    assert 'index ix_chat_messages_session_id_id' in changes
+    
+    inspector = inspect(db.engine)
+    assert {'summary', 'summarized_until'} <= {column['name'] for column in inspector.get_columns('chat_sessions')}
+    assert 'positions' in {column['name'] for column in inspector.get_columns('index_postings')}
+
+def test_models_query_upgraded_tables(legacy_app):
+    db.create_all()
+    upgrade_tables()
+    
+    document = db.session.get(Document, 1)
+    assert document.filename == 'old.txt'
+    assert document.language_stats is None
+    
+    session = ChatSession(title='درس')
+    db.session.add(session)
+    db.session.flush()
+    db.session.add(ChatMessage(session_id=session.id, content='سؤال', message_type='user'))
+    db.session.commit()
+    assert ChatMessage.query.one().input_tokens is None
+
+def test_upgrade_is_idempotent(legacy_app):
+    db.create_all()
+    upgrade_tables()
+    
+    assert upgrade_tables() == []
+
+def test_upgrade_makes_content_hash_unique(legacy_app):
+    db.create_all()
+    assert 'index ix_documents_content_hash' in upgrade_tables()
+    
+    unique = {index['name']: bool(index['unique']) for index in inspect(db.engine).get_indexes('documents')}
+    assert unique['ix_documents_content_hash']
+
+def test_upgrade_refuses_duplicate_content_hashes(legacy_app):
+    with db.engine.begin() as connection:
+        connection.execute(text(
+            """INSERT INTO documents (id, filename, original_filename, file_path, file_size, content_hash, upload_date)
+               VALUES (2, 'copy.txt', 'copy.txt', '/tmp/old.txt', 3, 'abc', '2024-01-02 00:00:00')"""
+        ))
+    db.create_all()
+    
+    with pytest.raises(RuntimeError, match='ix_documents_content_hash'):
+        upgrade_tables()
+
+def test_upgrade_rebuilds_index_postings_with_autoincrement(legacy_app):
+    with db.engine.begin() as connection:
+        connection.execute(text(
+            """CREATE TABLE index_postings (
+                id INTEGER NOT NULL, term VARCHAR(100) NOT NULL, chunk_id INTEGER NOT NULL,
+                document_id INTEGER NOT NULL, term_frequency INTEGER NOT NULL, PRIMARY KEY (id)
+            )"""
+        ))
+        connection.execute(text("CREATE INDEX ix_index_postings_term ON index_postings (term)"))
+        connection.execute(text(
+            "INSERT INTO index_postings (id, term, chunk_id, document_id, term_frequency) VALUES (7, 'طاقه', 1, 1, 2)"
+        ))
+    db.create_all()
+    
+    assert 'autoincrement index_postings' in upgrade_tables()
+    with db.engine.begin() as connection:
+        sql = connection.execute(text("SELECT sql FROM sqlite_master WHERE name = 'index_postings'")).scalar()
+        assert 'AUTOINCREMENT' in sql
+        assert connection.execute(text("SELECT term, term_frequency FROM index_postings WHERE id = 7")).one() == ('طاقه', 2)
+        
+        # A deleted tail id is not handed out again
+        connection.execute(text("DELETE FROM index_postings WHERE id = 7"))
+        connection.execute(text(
+            "INSERT INTO index_postings (term, chunk_id, document_id, term_frequency) VALUES ('حركيه', 1, 1, 1)"
+        ))
+        assert connection.execute(text("SELECT max(id) FROM index_postings")).scalar() == 8
+    
+    assert {index['name'] for index in inspect(db.engine).get_indexes('index_postings')} >= {
+        'ix_index_postings_term', 'ix_index_postings_chunk_id', 'ix_index_postings_document_id'
+    }
+    assert upgrade_tables() == []
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Full-Text Search Backend Tests
+تطبيق المدرس AI المحسن - اختبارات محركات البحث النصي الكامل
+"""
+
+import pytest
+from flask import Flask
+
+import arabic_text
+from database import db, Document
+from document_processor import DocumentProcessor
+from search_backends import PostingsSearchBackend, SQLiteFTSSearchBackend
+from search_index import SearchIndex
+
+ARABIC_DOCUMENT = (
+    'درس الرياضيات: المعادلات من الدرجة الأولى والثانية.\n'
+    'نتعلم في الرياضيات حل المعادلات بطرق مختلفة مع أمثلة محلولة.\n'
+)
+OTHER_DOCUMENT = 'الطاقة الحركية هي الطاقة التي يمتلكها الجسم بسبب حركته.\n'
+
+@pytest.fixture
+def search_index(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'search.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        SQLiteFTSSearchBackend().install()
+        
+        index = SearchIndex()
+        processor = DocumentProcessor(pdf_workers=1)
+        for name, text in (('math.txt', ARABIC_DOCUMENT), ('physics.txt', OTHER_DOCUMENT)):
+            document = Document(name, name, f'/tmp/{name}', len(text), content=text)
+            db.session.add(document)
+            db.session.flush()
+            index.index_document(document, processor.chunk_text(text))
+        db.session.commit()
+        
+        yield index
+        db.session.remove()
+
+def backends(search_index):
+    return [PostingsSearchBackend(search_index), SQLiteFTSSearchBackend()]
+
+@pytest.mark.parametrize('query', ['الرياضيات', 'المعادلات', 'رياضيات'])
+def test_every_backend_finds_arabic_document(search_index, query):
+    terms = list(dict.fromkeys(arabic_text.tokenize(query)))
+    math_id = Document.query.filter_by(filename='math.txt').one().id
+    
+    for backend in backends(search_index):
+        ranked, total = backend.search(terms, limit=10)
+        assert total == 1, backend.name
+        assert [document_id for _, document_id, _ in ranked] == [math_id], backend.name
+
+def test_search_terms_does_not_stem_terms_again(search_index):
+    terms = arabic_text.tokenize('الرياضيات')
+    assert arabic_text.tokenize(' '.join(terms)) != terms  # the stemmer is not idempotent
+    
+    assert search_index.search_terms(terms)
+    assert search_index.search_chunks('الرياضيات') == search_index.search_terms(terms)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Semantic Index Tests
+تطبيق المدرس AI المحسن - اختبارات فهرس المتجهات
+"""
+
+import os
+from collections import namedtuple
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import semantic_index
+from semantic_index import SemanticIndex
+
+Chunk = namedtuple('Chunk', 'id text')
+
+class FakeEmbedder:
+    """One-hot vectors: 'docN ...' points along axis N"""
+    
+    model_name = 'fake'
+    
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), 16), dtype=np.float32)
+        for row, text in enumerate(texts):
+            vectors[row, int(text.split()[0][3:]) % 16] = 1.0
+        return vectors
+
+def make_index(directory, **kwargs):
+    return SemanticIndex(str(directory), FakeEmbedder(), refresh_interval=0, **kwargs)
+
+def add_documents(index, document_ids):
+    for document_id in document_ids:
+        index.index_document(document_id, [Chunk(document_id * 10, f'doc{document_id} lesson')])
+
+def test_removed_document_is_tombstoned_until_compaction(tmp_path):
+    index = make_index(tmp_path, max_dead_ratio=0.5)
+    add_documents(index, [1, 2, 3])
+    index.compact()
+    assert index.search('doc2', 1)[0][:2] == (20, 2)
+    
+    index.remove_document(2)
+    assert all(document_id != 2 for _, document_id, _ in index.search('doc2', 3))
+    assert index.get_stats()['dead_rows'] == 1
+    
+    index.compact()
+    stats = index.get_stats()
+    assert stats['dead_rows'] == 0 and stats['vectors'] == 2
+
+def test_dead_ratio_compaction_is_adopted_by_other_processes(tmp_path):
+    writer = make_index(tmp_path, max_dead_ratio=0.2)
+    reader = make_index(tmp_path, max_dead_ratio=0.2)
+    add_documents(writer, range(1, 6))
+    writer.compact()
+    reader.refresh(force=True)
+    generation = reader.get_stats()['generation']
+    
+    # Two of five rows dead: the first refresh compacts, the other process maps its generation
+    writer.remove_document(1)
+    writer.remove_document(2)
+    writer.refresh(force=True)
+    reader.refresh(force=True)
+    
+    assert reader.get_stats()['generation'] == writer.get_stats()['generation'] != generation
+    assert reader.compactions == 0
+    assert reader.get_stats()['vectors'] == 3
+    assert {document_id for _, document_id, _ in reader.search('doc1', 5)} == {3, 4, 5}
+
+def test_reembedded_document_is_not_duplicated(tmp_path):
+    index = make_index(tmp_path)
+    add_documents(index, [1, 2])
+    index.compact()
+    
+    index.index_document(1, [Chunk(11, 'doc1 new'), Chunk(12, 'doc1 newer')])
+    results = index.search('doc1', 5)
+    assert sorted(chunk_id for chunk_id, document_id, _ in results if document_id == 1) == [11, 12]
+    
+    index.compact()
+    assert index.get_stats()['vectors'] == 3
+
+@pytest.mark.skipif(semantic_index.fcntl is None, reason='file locks need fcntl')
+def test_refresh_skips_compaction_while_another_process_compacts(tmp_path):
+    index = make_index(tmp_path, max_recent_segments=0)
+    add_documents(index, [1, 2])
+    
+    with open(os.path.join(str(tmp_path), 'compact.lock'), 'a') as lock_file:
+        semantic_index.fcntl.flock(lock_file, semantic_index.fcntl.LOCK_EX)
+        index.refresh(force=True)
+        assert index.compactions == 0
+        assert index.get_stats()['recent_segments'] == 2
+        semantic_index.fcntl.flock(lock_file, semantic_index.fcntl.LOCK_UN)
+    
+    index.refresh(force=True)
+    assert index.compactions == 1
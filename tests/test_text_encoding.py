@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Text Encoding Detection Tests
+تطبيق المدرس AI المحسن - اختبارات اكتشاف ترميز الملفات النصية
+"""
+
+import codecs
+
+import pytest
+
+from document_processor import DocumentProcessor, detect_text_encoding, ENCODING_SAMPLE_BYTES
+
+ARABIC = 'مرحبا بكم في درس الفيزياء. الطاقة الحركية للأجسام المتحركة.\nسطر ثان عن العلوم والرياضيات\n'
+ENGLISH = 'Hello world, a plain English lesson about energy.\n'
+
+@pytest.fixture
+def processor():
+    return DocumentProcessor(pdf_workers=1)
+
+@pytest.mark.parametrize('repeat', [1, 2000])
+@pytest.mark.parametrize('encoding, expected', [
+    ('utf-16-le', 'utf-16-le'),
+    ('utf-16-be', 'utf-16-be'),
+    ('utf-8', 'utf-8'),
+    ('windows-1256', 'windows-1256'),
+    ('iso-8859-6', 'iso-8859-6'),
+])
+def test_detects_arabic_without_bom(encoding, expected, repeat):
+    data = (ARABIC * repeat).encode(encoding)
+    assert detect_text_encoding(data) == (expected, 0)
+
+@pytest.mark.parametrize('bom, encoding', [
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+])
+def test_byte_order_mark_decides(bom, encoding):
+    data = bom + ARABIC.encode(encoding)
+    assert detect_text_encoding(data) == (encoding, len(bom))
+
+@pytest.mark.parametrize('encoding', ['utf-16-le', 'utf-16-be'])
+def test_detects_mixed_utf16_without_bom(encoding):
+    assert detect_text_encoding(((ENGLISH + ARABIC) * 50).encode(encoding))[0] == encoding
+
+def test_ascii_and_latin_text():
+    assert detect_text_encoding(ENGLISH.encode('ascii')) == ('utf-8', 0)
+    assert detect_text_encoding(('Café résumé naïve déjà vu\n' * 3).encode('latin-1')) == ('latin-1', 0)
+
+def test_arabic_after_long_ascii_prefix_is_sampled():
+    data = (ENGLISH * 3000 + ARABIC * 10).encode('windows-1256')
+    assert len(data) > ENCODING_SAMPLE_BYTES
+    assert detect_text_encoding(data) == ('windows-1256', 0)
+
+@pytest.mark.parametrize('encoding, bom', [
+    ('utf-16-le', b''),
+    ('utf-16-be', b''),
+    ('utf-16-le', codecs.BOM_UTF16_LE),
+    ('utf-16-be', codecs.BOM_UTF16_BE),
+    ('windows-1256', b''),
+    ('utf-8', codecs.BOM_UTF8),
+])
+@pytest.mark.parametrize('repeat', [1, 3000])
+def test_text_files_decode_to_the_original(tmp_path, processor, encoding, bom, repeat):
+    text = (ARABIC * repeat).replace('\n', '\r\n')
+    path = tmp_path / 'lesson.txt'
+    path.write_bytes(bom + text.encode(encoding))
+    
+    assert processor._process_txt(str(path)) == (ARABIC * repeat).strip()
+
+def test_empty_text_file(tmp_path, processor):
+    path = tmp_path / 'empty.txt'
+    path.write_bytes(b'')
+    assert processor._process_txt(str(path)) == ''
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher AI Enhanced - Upload Registration Tests
+تطبيق المدرس AI المحسن - اختبارات تسجيل الملفات المرفوعة
+"""
+
+import hashlib
+import io
+
+import pytest
+
+@pytest.fixture
+def app_context(app_module, tmp_path, monkeypatch):
+    from file_store import ContentStore
+    
+    monkeypatch.setattr(app_module, 'content_store', ContentStore(str(tmp_path / 'store')))
+    monkeypatch.setattr(app_module, 'ingestion_queue', None)
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.db.create_all()
+        yield app_module
+        app_module.db.session.remove()
+
+def store(app_module, data, extension='txt'):
+    return app_module.content_store.save(io.BytesIO(data), extension)
+
+def test_concurrent_duplicate_reuses_the_committed_document(app_context, monkeypatch):
+    app_module = app_context
+    data = 'الطاقة الحركية'.encode('utf-8')
+    original_store = app_module.store_upload_content
+    
+    def store_after_competing_upload(*args):
+        # Another request commits the same bytes between our lookup and our insert
+        with app_module.app.app_context():
+            file_path, content_hash, size = store(app_module, data)
+            original_store('first.txt', 'first.txt', file_path, content_hash, size, 'text/plain')
+        return original_store(*args)
+    monkeypatch.setattr(app_module, 'store_upload_content', store_after_competing_upload)
+    
+    file_path, content_hash, size = store(app_module, data)
+    document, duplicate, replaced = app_module.register_upload('second.txt', 'second.txt', file_path, content_hash, size)
+    
+    assert (duplicate, replaced) == (True, False)
+    assert document.filename == 'first.txt'
+    assert app_module.Document.query.count() == 1
+    with open(document.file_path, 'rb') as stored_file:  # shared file kept for the surviving row
+        assert hashlib.sha256(stored_file.read()).hexdigest() == content_hash
+
+def test_content_hash_is_unique(app_context):
+    from sqlalchemy.exc import IntegrityError
+    
+    app_module = app_context
+    Document = app_module.Document
+    for name in ('a.txt', 'b.txt'):
+        document = Document(name, name, f'/tmp/{name}', 1)
+        document.content_hash = 'f' * 64
+        app_module.db.session.add(document)
+    
+    with pytest.raises(IntegrityError):
+        app_module.db.session.commit()
+    app_module.db.session.rollback()